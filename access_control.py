@@ -1,21 +1,183 @@
 # access_control.py
+import asyncio
+import logging
+import math
+import os
+import time
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
+import config
 from config import ALLOWED_USER_IDS
+from ratelimit import TokenBucket
+from sheets import async_sheets
+
+logger = logging.getLogger(__name__)
+
+# Администраторы (доступ к служебным командам вроде /stats)
+ADMIN_USER_IDS = getattr(config, 'ADMIN_USER_IDS', [])
+# Список операторов без перезапуска: файл с id по одному в строке и/или лист таблицы с id в колонке A.
+# Пока список не загружен (или источник недоступен), действует ALLOWED_USER_IDS из config.py
+ACCESS_LIST_FILE = getattr(config, 'ACCESS_LIST_FILE', None)
+ACCESS_LIST_SHEET = getattr(config, 'ACCESS_LIST_SHEET', None)
+# Как часто перечитывать список, в секундах; после неудачи - повтор через ACCESS_LIST_RETRY
+ACCESS_LIST_TTL = getattr(config, 'ACCESS_LIST_TTL', 300)
+ACCESS_LIST_RETRY = getattr(config, 'ACCESS_LIST_RETRY', 30)
+# Ограничение команд одного пользователя, обращающихся к таблице: в среднем USER_COMMAND_RATE
+# в секунду, подряд не больше USER_COMMAND_BURST; лишние команды сразу отклоняются
+USER_COMMAND_RATE = getattr(config, 'USER_COMMAND_RATE', 0.5)
+USER_COMMAND_BURST = getattr(config, 'USER_COMMAND_BURST', 10)
+
+def parse_user_ids(values):
+    """id пользователей из строк файла или ячеек листа; заголовки, пустые строки и комментарии (#) пропускаются"""
+    user_ids = set()
+    for value in values:
+        value = value.split('#', 1)[0].strip()
+        if value.lstrip('-').isdigit():
+            user_ids.add(int(value))
+    return user_ids
+
+class AccessList:
+    """Список пользователей с доступом: неизменяемое множество, которое целиком заменяется при перезагрузке.
+
+    Проверка доступа только читает текущее множество, поэтому не ждет ни файла, ни таблицы:
+    перечитывает источники фоновая задача раз в ttl секунд.
+    """
+
+    def __init__(self, user_ids, path=ACCESS_LIST_FILE, sheet_title=ACCESS_LIST_SHEET, ttl=ACCESS_LIST_TTL):
+        self.user_ids = frozenset(user_ids)
+        self.path = path
+        self.sheet_title = sheet_title
+        self.ttl = ttl
+        # Время последней успешной загрузки (None - действует список из config.py)
+        self.loaded_at = None
+        self._file_ids = None
+        self._file_mtime = None
+
+    def __contains__(self, user_id):
+        return user_id in self.user_ids
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.sheet_title)
+
+    def _read_file(self):
+        """id из файла; файл перечитывается, только если изменилось время его изменения"""
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self._file_mtime:
+            with open(self.path, encoding='utf-8') as f:
+                self._file_ids = parse_user_ids(f)
+            self._file_mtime = mtime
+        return self._file_ids
+
+    async def reload(self):
+        """Перечитывает источники; при ошибке или пустом списке оставляет прежний. Возвращает успех"""
+        user_ids = set()
+        try:
+            if self.path:
+                user_ids |= await asyncio.to_thread(self._read_file)
+            if self.sheet_title:
+                values = await async_sheets.read_column(self.sheet_title)
+                if values is None:
+                    raise ConnectionError("таблица не подключена")
+                user_ids |= parse_user_ids(values)
+        except Exception as e:
+            logger.warning(f"Не удалось перечитать список доступа, действует прежний: {e}")
+            return False
+
+        # Пустой список скорее означает ошибку в источнике, чем желание закрыть бот для всех
+        if not user_ids:
+            logger.warning("Список доступа пуст, действует прежний")
+            return False
+        if user_ids != self.user_ids:
+            logger.info(f"Список доступа обновлен: {len(user_ids)} пользователей")
+        self.user_ids = frozenset(user_ids)
+        self.loaded_at = time.monotonic()
+        return True
+
+    async def run(self):
+        """Фоновая задача: перечитывает список раз в ttl секунд"""
+        while True:
+            ok = await self.reload()
+            await asyncio.sleep(self.ttl if ok else min(self.ttl, ACCESS_LIST_RETRY))
+
+class UserThrottle:
+    """Token bucket на каждого пользователя: лишние команды отклоняются"""
+
+    def __init__(self, rate=USER_COMMAND_RATE, burst=USER_COMMAND_BURST):
+        self.rate = rate
+        self.burst = burst
+        # пользователь -> TokenBucket
+        self._buckets = {}
+
+    def admit(self, user_id):
+        """Пропускает команду; False - лимит исчерпан.
+
+        Команда не ждет токен: ожидание заняло бы слот обработки апдейтов (CONCURRENT_UPDATES).
+        """
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket.try_acquire()
+
+    def retry_after(self, user_id):
+        bucket = self._buckets.get(user_id)
+        return bucket.delay() if bucket else 0.0
+
+# Глобальные экземпляры для использования в других модулях
+access_list = AccessList(ALLOWED_USER_IDS)
+user_throttle = UserThrottle()
 
 async def check_access(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверяет, имеет ли пользователь доступ к боту"""
     user_id = update.effective_user.id
-    if user_id not in ALLOWED_USER_IDS:
-        await update.message.reply_text("❌ У вас нет доступа к этому боту.")
+    if user_id not in access_list:
+        # У inline-запроса нет сообщения, на него отвечаем пустым списком
+        if update.inline_query:
+            await update.inline_query.answer([], cache_time=0, is_personal=True)
+        else:
+            await update.message.reply_text(
+                "❌ У вас нет доступа к этому боту.\n"
+                "Владельцы роутеров могут подписаться на напоминания о сроке возврата: /subscribe"
+            )
         return False
     return True
 
+async def check_rate(update: Update):
+    """Проверяет лимит команд пользователя до того, как команда обратится к таблице"""
+    user_id = update.effective_user.id
+    if user_throttle.admit(user_id):
+        return True
+    await update.message.reply_text(
+        f"⏳ Слишком много команд подряд. Повторите через {math.ceil(user_throttle.retry_after(user_id))} с."
+    )
+    return False
+
 def restricted_access(func):
     """Декоратор для ограничения доступа к командам"""
     async def wrapped(update, context, *args, **kwargs):
         if not await check_access(update, context):
             return
         return await func(update, context, *args, **kwargs)
-    return wrapped
\ No newline at end of file
+    return wrapped
+
+def throttled(func):
+    """Декоратор для команд, начинающих операцию или обращающихся к таблице: расходует лимит пользователя.
+
+    Шаги диалога (комната, ФИО, "да") идут по локальной базе и лимит не расходуют.
+    """
+    async def wrapped(update, context, *args, **kwargs):
+        if not await check_rate(update):
+            return
+        return await func(update, context, *args, **kwargs)
+    return wrapped
+
+def admin_only(func):
+    """Декоратор для команд, доступных только администраторам"""
+    async def wrapped(update, context, *args, **kwargs):
+        if update.effective_user.id not in ADMIN_USER_IDS:
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+        return await func(update, context, *args, **kwargs)
+    return wrapped
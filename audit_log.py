@@ -0,0 +1,142 @@
+# audit_log.py
+import asyncio
+import logging
+from datetime import datetime
+
+import config
+from metrics import current_handler
+from sheets import sheets_helper, async_sheets
+from validation import is_mac_address
+from write_queue import write_queue
+
+logger = logging.getLogger(__name__)
+
+# Лист таблицы, в который выгружается журнал операций (пустое значение - только локальный журнал)
+HISTORY_SHEET = getattr(config, 'HISTORY_SHEET', 'History')
+# Сколько операций выгружать одной записью и как часто, в секундах
+HISTORY_BATCH_SIZE = getattr(config, 'HISTORY_BATCH_SIZE', 500)
+HISTORY_FLUSH_INTERVAL = getattr(config, 'HISTORY_FLUSH_INTERVAL', 60)
+
+# Заголовок листа истории
+HISTORY_HEADER = ['№', 'Время', 'Оператор', 'Операция', 'Строка', 'MAC', 'Комната', 'Изменения']
+
+# Названия операций для журнала и уведомлений о записи в таблицу
+OPERATION_NAMES = {
+    'issue': "выдача роутера",
+    'return': "возврат роутера",
+    'extend': "продление срока",
+    'add_comment': "комментарий",
+    'change_owner': "смена владельца",
+    'add': "добавление роутера",
+    'bulk_issue': "массовая выдача",
+    'bulk_return': "массовый возврат",
+    'bulk_add': "массовое добавление",
+}
+
+def user_label(user):
+    """Оператор для журнала: @username или имя"""
+    if user is None:
+        return ''
+    username = getattr(user, 'username', None)
+    if username:
+        return f"@{username}"
+    return getattr(user, 'full_name', None) or getattr(user, 'first_name', None) or str(user.id)
+
+def format_changes(changes):
+    """{поле: [было, стало]} в строку "поле: было → стало; ..." """
+    return '; '.join(f"{field}: {old or '-'} → {new or '-'}" for field, (old, new) in changes.items())
+
+class AuditLog:
+    """Журнал операций с роутерами: только дописывается, хранится в локальной базе.
+
+    Каждая подтвержденная операция сразу попадает в SQLite (с индексами по MAC и комнате
+    для /history), а в лист таблицы журнал выгружается пачками - одна запись append на пачку.
+    """
+
+    def __init__(self, helper, sheet_title=HISTORY_SHEET):
+        self.helper = helper
+        self.store = helper.store
+        self.sheet_title = sheet_title
+
+    def entry(self, operation, user, record=None, fields=None, mac=None, row_num=None):
+        """Запись журнала: record - строка до изменения (RouterRecord), fields - {колонка: новое значение}"""
+        columns = record.columns if record else self.helper.columns_for(row_num or 0)
+        names = {col_num: field for field, col_num in columns.as_dict().items() if col_num}
+        fields = fields or {}
+        before = record.cells if record else []
+
+        # Сохраняем и старые значения: возврат стирает владельца и комментарий из листа
+        changes = {}
+        for col_num, value in sorted(fields.items()):
+            old = before[col_num - 1].strip() if len(before) >= col_num else ''
+            if old != value:
+                changes[names.get(col_num, str(col_num))] = [old, value]
+
+        # Комната: новая при выдаче, прежняя при возврате - чтобы /history по комнате находил обе
+        room = fields.get(columns.room) or (record.room if record else '')
+        return {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'user_id': getattr(user, 'id', None),
+            'user_name': user_label(user),
+            'operation': operation,
+            'row_num': record.row_num if record else row_num,
+            'mac': record.mac if record else mac,
+            'room': room,
+            'changes': changes,
+        }
+
+    def add(self, entries):
+        """Дописывает записи в локальный журнал одной транзакцией"""
+        if entries:
+            self.store.add_history(entries)
+
+    def history(self, identifier, limit=20):
+        """Последние операции по MAC-адресу или номеру комнаты (новые первыми)"""
+        if is_mac_address(identifier):
+            return self.store.history_for_mac(identifier, limit)
+        # Корпус в начале номера выбирает общежитие, без него комната ищется во всех
+        shards, room = self.helper.route_room(identifier)
+        return self.store.history_for_room(room, limit, shards[0].index if len(shards) == 1 else None)
+
+    def _sheet_row(self, entry):
+        return [
+            entry['id'], entry['at'], entry['user_name'] or '',
+            OPERATION_NAMES.get(entry['operation'], entry['operation']),
+            self.helper.row_label(entry['row_num']) if entry['row_num'] else '', entry['mac'] or '', entry['room'] or '', format_changes(entry['changes']),
+        ]
+
+    async def flush(self):
+        """Выгружает невыгруженные операции в лист истории, одна запись на пачку; возвращает их число"""
+        if not self.sheet_title:
+            return 0
+        exported = 0
+        # Лист истории лежит в таблице первого общежития - недоступность других выгрузке не мешает
+        while self.helper.is_online(self.helper.primary.name):
+            entries = await async_sheets.run_local(self.store.unexported_history, HISTORY_BATCH_SIZE)
+            if not entries:
+                break
+            # Квота на запись общая с очередью записи
+            await write_queue.bucket.acquire()
+            rows = [self._sheet_row(entry) for entry in entries]
+            if not await async_sheets.append_to_tab(self.sheet_title, rows, HISTORY_HEADER):
+                break
+            await async_sheets.run_local(self.store.mark_history_exported, [entry['id'] for entry in entries])
+            exported += len(entries)
+        if exported:
+            logger.info(f"Выгружено операций в лист {self.sheet_title}: {exported}")
+        return exported
+
+    async def run(self):
+        """Фоновая задача: раз в HISTORY_FLUSH_INTERVAL секунд выгружает накопленные операции"""
+        current_handler.set('audit_log')
+        while True:
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при выгрузке журнала операций: {e}")
+
+# Глобальный экземпляр для использования в других модулях
+audit_log = AuditLog(sheets_helper)
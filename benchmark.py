@@ -0,0 +1,194 @@
+# benchmark.py
+"""Замер стоимости команд бота на поддельном листе (fake_sheets.FakeWorksheet).
+
+Для каждой команды и диалога из handlers.py считает обращения к API Sheets,
+объем отправленных и полученных данных и время выполнения.
+
+    python benchmark.py --sizes 100 1000 10000 --latency 0.05
+
+Завершается с кодом 1, если операция сделала больше обращений, чем указано
+в CALL_BUDGETS, поэтому его можно запускать в CI.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from types import SimpleNamespace
+
+import handlers as h
+from access_control import access_list, user_throttle
+from audit_log import audit_log
+from fake_sheets import FakeWorksheet, make_inventory
+from change_tracker import OWN_WRITE_SKEW
+from ratelimit import TokenBucket
+from sheets import sheets_helper, async_sheets
+from write_queue import write_queue
+
+# Допустимое число обращений к API на одну операцию.
+# Перед записью очередь проверяет время изменения листа - это второе обращение у правок строки
+CALL_BUDGETS = {
+    'burst': 2,
+    'sync': 1,
+    'lookup': 0,
+    'issue': 2,
+    'extend': 2,
+    'add_comment': 2,
+    'change_owner': 2,
+    'return': 2,
+    'issue_oneshot': 2,
+    'add': 1,
+    'update': 3,
+    'history': 0,
+    'history_flush': 3,
+    'edit_sync': 2,
+}
+
+class BenchMessage:
+    def __init__(self, text, replies):
+        self.text = text
+        self._replies = replies
+
+    async def reply_text(self, text, **kwargs):
+        self._replies.append(text)
+
+class BenchBot:
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+def make_update(text, replies, user_id):
+    user = SimpleNamespace(id=user_id, first_name='Bench', username='bench')
+    return SimpleNamespace(
+        effective_user=user,
+        effective_chat=SimpleNamespace(id=user_id),
+        inline_query=None,
+        message=BenchMessage(text, replies),
+    )
+
+async def converse(steps, user_id, args=None):
+    """Проходит шаги диалога [(обработчик, текст)] и дожидается записи в таблицу"""
+    replies = []
+    context = SimpleNamespace(user_data={}, args=args or [], bot=BenchBot())
+    for handler, text in steps:
+        await handler(make_update(text, replies, user_id), context)
+    await write_queue.flush(context.bot)
+    return replies
+
+def scenarios(rows):
+    """Сценарии (имя, шаги, аргументы команды) для листа rows"""
+    free = next(row for row in rows[1:] if row[3] == 'Свободен')
+    issued = [row for row in rows[1:] if row[3] == 'Выдан']
+    returned, extended = issued[0], issued[-1]
+    new_mac = 'FE:ED:00:00:00:01'
+    return [
+        ('lookup', [(h.start_return, '/return'), (h.return_get_identifier, returned[2]), (h.cancel, '/cancel')], None),
+        ('issue', [
+            (h.start_issue, '/issue'), (h.get_mac, free[1]), (h.get_room, '999'), (h.get_name, 'Бенч Бенчев'),
+            (h.get_contact, '@bench'), (h.get_date, '+14'), (h.handle_confirmation, 'да'),
+        ], None),
+        ('extend', [
+            (h.start_extend, '/extend'), (h.extend_get_identifier, extended[1]),
+            (h.extend_get_date, '+7'), (h.handle_confirmation, 'да'),
+        ], None),
+        ('add_comment', [
+            (h.start_add_comment, '/add_comment'), (h.comment_get_identifier, extended[1]),
+            (h.get_comment, 'замер'), (h.handle_confirmation, 'да'),
+        ], None),
+        ('change_owner', [
+            (h.start_change_owner, '/change_owner'), (h.owner_get_identifier, extended[2]),
+            (h.owner_get_name, 'Новый Владелец'), (h.owner_get_contact, '@new_owner'), (h.handle_confirmation, 'да'),
+        ], None),
+        ('return', [(h.start_return, '/return'), (h.return_get_identifier, returned[2]), (h.handle_confirmation, 'да')], None),
+        # Та же выдача одной командой: два сообщения вместо семи
+        ('issue_oneshot', [
+            (h.start_issue, f'/issue {returned[1]} 998 "Бенч Бенчев" @bench +14d'), (h.handle_confirmation, 'да'),
+        ], [returned[1], '998', 'Бенч Бенчев', '@bench', '+14d']),
+        ('add', [(h.add_router, f"/add {new_mac}")], [new_mac]),
+        ('update', [(h.update_statuses, '/update')], None),
+        ('history', [(h.history, f"/history {extended[1]}")], [extended[1]]),
+    ]
+
+async def burst(rows, user_id, count=8):
+    """Одновременные поиски сразу после запуска, пока локальная база пуста"""
+    issued = [row for row in rows[1:] if row[3] == 'Выдан'][:count]
+    await asyncio.gather(*(
+        converse([(h.start_return, '/return'), (h.return_get_identifier, row[2]), (h.cancel, '/cancel')], user_id)
+        for row in issued
+    ))
+
+async def edit_sync(sheet, row_num):
+    """Синхронизация после правки листа вручную: метаданные и одно чтение листа"""
+    sheet.edit(row_num, 10, 'правка вручную')
+    await async_sheets.refresh_cache()
+    row = sheets_helper.store.get_row(row_num)
+    if not row or len(row) < 10 or row[9] != 'правка вручную':
+        raise RuntimeError("правка листа не попала в локальную базу")
+
+async def measure(sheet, name, coro):
+    sheet.reset_stats()
+    started = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - started
+    return {
+        'operation': name,
+        'calls': sheet.total_calls,
+        'sent': sheet.bytes_sent,
+        'received': sheet.bytes_received,
+        'ms': elapsed * 1000,
+    }
+
+async def run(sizes, latency, error_rate):
+    user_id = next(iter(access_list.user_ids))
+    # Замер не должен упираться в ограничитель скорости и писать файл очереди
+    write_queue.bucket = TokenBucket(1e9, 1e9)
+    user_throttle.rate = user_throttle.burst = 1e9
+    write_queue.path = None
+
+    results = []
+    for size in sizes:
+        rows = make_inventory(size)
+        sheet = FakeWorksheet(rows, latency=latency, error_rate=error_rate, seed=size)
+        sheets_helper.attach_worksheet(sheet)
+        result = await measure(sheet, 'burst', burst(rows, user_id))
+        results.append((size, result))
+        result = await measure(sheet, 'sync', async_sheets.refresh_cache())
+        results.append((size, result))
+        for name, steps, args in scenarios(rows):
+            result = await measure(sheet, name, converse(steps, user_id, args))
+            results.append((size, result))
+        # Журнал операций уходит в лист истории одной записью (плюс поиск и создание листа в первый раз)
+        result = await measure(sheet, 'history_flush', audit_log.flush())
+        results.append((size, result))
+        # Правка должна отличаться по времени от наших записей, иначе ее примут за нашу
+        await asyncio.sleep(OWN_WRITE_SKEW.total_seconds() + 0.1)
+        result = await measure(sheet, 'edit_sync', edit_sync(sheet, len(rows) // 2))
+        results.append((size, result))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка одного обращения, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля обращений, отвечающих 429")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.sizes, args.latency, args.error_rate))
+
+    print(f"{'rows':>6}  {'operation':<13} {'calls':>5} {'sent, B':>10} {'recv, B':>10} {'time, ms':>9}")
+    over_budget = []
+    for size, result in results:
+        print(
+            f"{size:>6}  {result['operation']:<13} {result['calls']:>5} "
+            f"{result['sent']:>10} {result['received']:>10} {result['ms']:>9.2f}"
+        )
+        budget = CALL_BUDGETS.get(result['operation'])
+        if budget is not None and result['calls'] > budget:
+            over_budget.append((size, result['operation'], result['calls'], budget))
+
+    # С внедренными ошибками повторы ожидаемо увеличивают число обращений
+    if over_budget and not args.error_rate:
+        for size, operation, calls, budget in over_budget:
+            print(f"ПРЕВЫШЕН БЮДЖЕТ: {operation} на {size} строках - {calls} обращений (допустимо {budget})")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
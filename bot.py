@@ -1,10 +1,45 @@
 # bot.py
+import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+import secrets
+from telegram.ext import (
+    Application, CommandHandler, ConversationHandler, InlineQueryHandler, MessageHandler, filters
+)
 
+import config
 from config import BOT_TOKEN
 from handlers import *
-from access_control import restricted_access
+from access_control import access_list, restricted_access
+from sheets import sheets_helper, async_sheets
+from write_queue import write_queue
+from audit_log import audit_log
+from reminders import reminders
+from update_processor import PerUserUpdateProcessor
+from metrics import start_http_server
+
+# Сколько апдейтов разных пользователей обрабатывается одновременно
+CONCURRENT_UPDATES = getattr(config, 'CONCURRENT_UPDATES', 16)
+# Интервал автоматической проверки просрочек в секундах (0 - отключить)
+OVERDUE_SWEEP_INTERVAL = getattr(config, 'OVERDUE_SWEEP_INTERVAL', 6 * 60 * 60)
+# Порт для метрик в формате Prometheus (None - не запускать)
+METRICS_PORT = getattr(config, 'METRICS_PORT', None)
+METRICS_HOST = getattr(config, 'METRICS_HOST', '127.0.0.1')
+# Напоминания владельцам и операторам о сроке возврата
+REMINDERS_ENABLED = getattr(config, 'REMINDERS_ENABLED', True)
+
+# Режим webhook: публичный адрес, по которому Telegram доставляет апдейты (None - run_polling)
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', None)
+# Где слушает встроенный HTTP-сервер (за reverse proxy - 127.0.0.1 и любой свободный порт)
+WEBHOOK_LISTEN = getattr(config, 'WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', 'telegram')
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (если не задан - новый при каждом запуске)
+WEBHOOK_SECRET_TOKEN = getattr(config, 'WEBHOOK_SECRET_TOKEN', None)
+# Сертификат и ключ, если TLS завершается в самом боте, а не на reverse proxy
+WEBHOOK_CERT = getattr(config, 'WEBHOOK_CERT', None)
+WEBHOOK_KEY = getattr(config, 'WEBHOOK_KEY', None)
+# Сколько одновременных HTTPS-соединений открывает Telegram (1-100)
+WEBHOOK_MAX_CONNECTIONS = getattr(config, 'WEBHOOK_MAX_CONNECTIONS', CONCURRENT_UPDATES)
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,17 +48,95 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    """Основная функция запуска бота"""
-    if not BOT_TOKEN:
-        logger.error("Не задан BOT_TOKEN. Задайте его в config.py или через переменную окружения.")
+async def post_init(application):
+    """Запускает фоновые задачи после инициализации бота"""
+    application.bot_data['write_queue_task'] = asyncio.create_task(write_queue.run(application.bot))
+    # Подключение к таблице идет в фоне: бот сразу принимает апдейты и отвечает по локальной базе
+    application.bot_data['sheets_sync_task'] = asyncio.create_task(async_sheets.run_sync())
+    # Журнал операций выгружается в лист истории пачками
+    application.bot_data['audit_log_task'] = asyncio.create_task(audit_log.run())
+    # Список доступа перечитывается из файла или листа таблицы без перезапуска
+    if access_list.enabled:
+        application.bot_data['access_list_task'] = asyncio.create_task(access_list.run())
+    if REMINDERS_ENABLED:
+        application.bot_data['reminders_task'] = asyncio.create_task(reminders.run(application.bot))
+
+async def post_stop(application):
+    """Останавливает фоновые задачи и дописывает очередь записи"""
+    tasks = []
+    for name in ('audit_log_task', 'access_list_task', 'reminders_task', 'sheets_sync_task', 'write_queue_task'):
+        task = application.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+            tasks.append(task)
+    # Прерванная запись успевает вернуть пачку в очередь до последнего сброса
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await asyncio.wait_for(write_queue.flush(application.bot), timeout=30)
+    except asyncio.TimeoutError:
+        logger.warning(f"Не все записи успели уйти в таблицу, осталось строк: {len(write_queue)}")
+    try:
+        await asyncio.wait_for(audit_log.flush(), timeout=30)
+    except asyncio.TimeoutError:
+        logger.warning("Журнал операций выгружен не полностью, остаток уйдет после перезапуска")
+
+async def post_shutdown(application):
+    """Освобождает ресурсы после остановки бота"""
+    async_sheets.shutdown()
+    sheets_helper.store.close()
+
+def run_webhook(application):
+    """Принимает апдейты встроенным HTTP-сервером вместо long polling"""
+    secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+    if not WEBHOOK_SECRET_TOKEN:
+        logger.warning("WEBHOOK_SECRET_TOKEN не задан, используется случайный секрет до перезапуска.")
+    if bool(WEBHOOK_CERT) != bool(WEBHOOK_KEY):
+        logger.error("Для TLS нужно задать и WEBHOOK_CERT, и WEBHOOK_KEY.")
         return
 
-    application = Application.builder().token(BOT_TOKEN).build()
+    url_path = WEBHOOK_PATH.strip('/')
+    logger.info(f"Режим webhook: {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{url_path}")
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=url_path,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+        secret_token=secret_token,
+        cert=WEBHOOK_CERT,
+        key=WEBHOOK_KEY,
+        max_connections=min(max(WEBHOOK_MAX_CONNECTIONS, 1), 100),
+    )
+
+def build_application(token=BOT_TOKEN, request=None):
+    """Собирает Application со всеми обработчиками; request - свой транспорт Bot API (например, в loadtest.py)"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("add", add_router))
     application.add_handler(CommandHandler("update", update_statuses))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("history", history))
+    application.add_handler(CommandHandler("subscribe", subscribe))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe))
+
+    # Массовые операции: файл с командой в подписи
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/bulk_(issue|return|add)\b'), bulk_upload
+    ))
+    application.add_handler(CommandHandler(["bulk_issue", "bulk_return", "bulk_add"], bulk_help))
+
+    # Inline-поиск (нужно включить inline-режим у бота в @BotFather)
+    application.add_handler(InlineQueryHandler(inline_search))
 
     # Conversation handler для выдачи
     issue_conv_handler = ConversationHandler(
@@ -88,8 +201,32 @@ def main():
     )
     application.add_handler(owner_conv_handler)
 
-    # Запускаем бота
-    application.run_polling()
+    # Плановая проверка просрочек
+    if OVERDUE_SWEEP_INTERVAL:
+        if application.job_queue:
+            application.job_queue.run_repeating(
+                scheduled_update_statuses, interval=OVERDUE_SWEEP_INTERVAL, first=60
+            )
+        else:
+            logger.warning("JobQueue недоступна (установите python-telegram-bot[job-queue]), плановая проверка отключена.")
+    return application
+
+def main():
+    """Основная функция запуска бота"""
+    if not BOT_TOKEN:
+        logger.error("Не задан BOT_TOKEN. Задайте его в config.py или через переменную окружения.")
+        return
+
+    application = build_application()
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, METRICS_HOST)
+
+    # Запускаем бота. При остановке Application.stop дожидается уже принятых апдейтов,
+    # а post_stop дописывает очередь записи в таблицу
+    if WEBHOOK_URL:
+        run_webhook(application)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
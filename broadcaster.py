@@ -0,0 +1,73 @@
+# broadcaster.py
+import asyncio
+import logging
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import config
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: около 30 сообщений в секунду всего, 1 в секунду в один чат,
+# 20 в минуту в группу; держимся чуть ниже
+GLOBAL_RATE = getattr(config, 'BROADCAST_GLOBAL_RATE', 25)
+CHAT_RATE = getattr(config, 'BROADCAST_CHAT_RATE', 1)
+GROUP_RATE = getattr(config, 'BROADCAST_GROUP_RATE', 20 / 60)
+# Сколько раз повторять отправку после ответа 429 (RetryAfter)
+MAX_RETRIES = 3
+
+class Broadcaster:
+    """Рассылка сообщений с учетом общего лимита Telegram и лимита на каждый чат"""
+
+    def __init__(self, bot, rate=GLOBAL_RATE):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, rate)
+        # чат -> TokenBucket
+        self._chat_buckets = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # У групп и каналов отрицательные id
+            rate = GROUP_RATE if chat_id < 0 else CHAT_RATE
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, 1)
+        return bucket
+
+    async def send(self, chat_id, text):
+        """Отправляет сообщение, дожидаясь своей очереди; возвращает успех"""
+        await self._chat_bucket(chat_id).acquire()
+        for _ in range(MAX_RETRIES + 1):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                # В новых версиях python-telegram-bot это timedelta
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Telegram просит подождать {retry_after} с перед отправкой в чат {chat_id}")
+                await asyncio.sleep(retry_after)
+            except Forbidden:
+                logger.info(f"Чат {chat_id} недоступен (бот заблокирован или чат не начат)")
+                return False
+            except TelegramError as e:
+                logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                return False
+        return False
+
+    async def send_each(self, messages):
+        """Отправляет [(чат, текст)]: в один чат по порядку, в разные - параллельно; возвращает успех каждого сообщения"""
+        by_chat = {}
+        for i, (chat_id, text) in enumerate(messages):
+            by_chat.setdefault(chat_id, []).append((i, text))
+
+        results = [False] * len(messages)
+
+        async def send_chat(chat_id, texts):
+            for i, text in texts:
+                results[i] = await self.send(chat_id, text)
+
+        await asyncio.gather(*(send_chat(chat_id, texts) for chat_id, texts in by_chat.items()))
+        return results
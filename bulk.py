@@ -0,0 +1,329 @@
+# bulk.py
+import csv
+import io
+from datetime import date, datetime, timedelta
+
+import config
+from config import DEFAULT_ISSUE_PERIOD
+from records import Status, is_header_row
+from row_locks import APPEND_LOCK
+from sheets import normalize_mac, row_fingerprint
+from validation import is_mac_address, parse_date
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Наибольшее число строк в одном файле (можно переопределить в config.py)
+MAX_ROWS = getattr(config, 'BULK_MAX_ROWS', 1000)
+
+# Колонки файла и допустимые названия в заголовке
+COLUMNS = ('mac', 'room', 'name', 'contact', 'due')
+COLUMN_ALIASES = {
+    'mac': {'mac', 'mac-адрес', 'mac адрес', 'мак'},
+    'room': {'room', 'комната'},
+    'name': {'name', 'owner', 'фио', 'владелец'},
+    'contact': {'contact', 'contacts', 'контакт', 'контакты'},
+    'due': {'due', 'date', 'checkout', 'срок', 'вернуть до', 'дата возврата'},
+}
+
+class BulkFileError(ValueError):
+    """Файл не удалось прочитать как таблицу"""
+
+def _cell_text(value):
+    """Приводит значение ячейки XLSX к строке так, как его видит оператор"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def _read_csv(data):
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise BulkFileError("неизвестная кодировка, сохраните файл в UTF-8")
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return [[cell.strip() for cell in row] for row in csv.reader(io.StringIO(text), dialect)]
+
+def _read_xlsx(data):
+    if openpyxl is None:
+        raise BulkFileError("для XLSX нужен пакет openpyxl, пришлите файл в формате CSV")
+    try:
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except Exception as e:
+        raise BulkFileError(f"не удалось открыть XLSX ({e})")
+    try:
+        return [[_cell_text(value) for value in row] for row in workbook.active.iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+def read_records(file_name, data):
+    """Читает CSV/XLSX и возвращает [(номер строки файла, {колонка: значение})]"""
+    if file_name.lower().endswith(('.xlsx', '.xlsm')):
+        table = _read_xlsx(data)
+    else:
+        table = _read_csv(data)
+
+    # Заголовок необязателен: без него колонки идут в порядке COLUMNS
+    columns = list(COLUMNS)
+    first_line = 1
+    if table:
+        header = [cell.lower() for cell in table[0]]
+        named = {}
+        for i, title in enumerate(header):
+            for column, aliases in COLUMN_ALIASES.items():
+                if title in aliases:
+                    named.setdefault(column, i)
+        if named:
+            columns = [None] * len(header)
+            for column, i in named.items():
+                columns[i] = column
+            table = table[1:]
+            first_line = 2
+
+    records = []
+    for line_num, row in enumerate(table, start=first_line):
+        if not any(row):
+            continue
+        record = {column: '' for column in COLUMNS}
+        for column, value in zip(columns, row):
+            if column:
+                record[column] = value
+        records.append((line_num, record))
+
+    if not records:
+        raise BulkFileError("в файле нет строк с данными")
+    if len(records) > MAX_ROWS:
+        raise BulkFileError(f"слишком много строк ({len(records)}), допустимо не больше {MAX_ROWS}")
+    return records
+
+class Snapshot:
+    """Снимок листов с поиском по MAC и комнате: все строки файла проверяются по одному состоянию"""
+
+    def __init__(self, rows, helper):
+        self.helper = helper
+        self.records = [helper.record(row_num, row) for row_num, row in rows.items() if not is_header_row(row_num)]
+        self.by_mac = {}
+        # (общежитие, комната) -> строка
+        self.by_room = {}
+        for record in self.records:
+            if record.mac:
+                self.by_mac.setdefault(normalize_mac(record.mac), record)
+            if record.room:
+                self.by_room.setdefault((helper.shard_of(record.row_num).index, record.room), record)
+
+    def find_by_mac(self, mac_address):
+        return self.by_mac.get(normalize_mac(mac_address))
+
+    def find_by_room(self, room_number):
+        """Строка по комнате; без корпуса в номере - только если комната нашлась в одном общежитии"""
+        shards, room = self.helper.route_room(room_number)
+        found = [self.by_room[shard.index, room] for shard in shards if (shard.index, room) in self.by_room]
+        return found[0] if len(found) == 1 else None
+
+    def label(self, row_num):
+        return self.helper.row_label(row_num)
+
+class BulkPlan:
+    """Изменения, собранные по файлу, и отчет по каждой его строке"""
+
+    def __init__(self):
+        # {строка листа: {колонка: значение}} для одного batch_update
+        self.updates = {}
+        # MAC-адреса новых роутеров для одного append_rows
+        self.appends = []
+        # [номер строки файла, роутер, успех, сообщение]
+        self.report = []
+        # Строки листа в том виде, в каком их проверили: {строка: RouterRecord}
+        self.expected = {}
+        # строка листа или ключ MAC -> запись отчета
+        self._entries = {}
+
+    def ok(self, line_num, router, message, key=None):
+        entry = [line_num, router, True, message]
+        self.report.append(entry)
+        if key is not None:
+            self._entries[key] = entry
+
+    def fail(self, line_num, router, message):
+        self.report.append([line_num, router, False, message])
+
+    def locks(self):
+        """Ключи замков row_locks для затронутых строк"""
+        return list(self.updates) + ([APPEND_LOCK] if self.appends else [])
+
+    def verify(self, current):
+        """Снимает изменения строк, которые поменялись после проверки (compare-and-set по снимку current)"""
+        current_rows = {record.row_num: record.cells for record in current.records}
+        for row_num, expected in list(self.expected.items()):
+            if row_fingerprint(current_rows.get(row_num, [])) != row_fingerprint(expected.cells):
+                del self.updates[row_num]
+                del self.expected[row_num]
+                self._reject(row_num, "строка изменилась во время обработки, повторите")
+
+        for mac in list(self.appends):
+            found = current.find_by_mac(mac)
+            if found:
+                self.appends.remove(mac)
+                self._reject(normalize_mac(mac), f"уже есть в таблице (строка {current.label(found.row_num)})")
+
+    def _reject(self, key, message):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[2] = False
+            entry[3] = message
+
+    def fail_writes(self, message):
+        """Помечает неудачными все строки, запись которых не прошла"""
+        for entry in self.report:
+            if entry[2]:
+                entry[2] = False
+                entry[3] = message
+
+    @property
+    def succeeded(self):
+        return sum(1 for entry in self.report if entry[2])
+
+def _default_return_date():
+    return datetime.now() + timedelta(days=int(DEFAULT_ISSUE_PERIOD))
+
+def plan_issue(records, snapshot, today=None):
+    """Выдача: роутер есть в таблице и свободен, указаны комната и ФИО"""
+    plan = BulkPlan()
+    issue_date = (today or datetime.now()).strftime("%Y-%m-%d")
+    seen = {}
+    for line_num, record in records:
+        mac = record['mac']
+        if not is_mac_address(mac):
+            plan.fail(line_num, mac, "неверный формат MAC-адреса")
+            continue
+        if normalize_mac(mac) in seen:
+            plan.fail(line_num, mac, f"повторяется в файле (строка {seen[normalize_mac(mac)]})")
+            continue
+        seen[normalize_mac(mac)] = line_num
+
+        found = snapshot.find_by_mac(mac)
+        if not found:
+            plan.fail(line_num, mac, "роутер не найден")
+            continue
+        if not found.is_free:
+            plan.fail(line_num, mac, f"роутер не свободен ({found.status_text or 'без статуса'})")
+            continue
+        if not record['room'] or not record['name']:
+            plan.fail(line_num, mac, "не указаны комната или ФИО")
+            continue
+        return_date = parse_date(record['due']) if record['due'] else _default_return_date()
+        if not return_date:
+            plan.fail(line_num, mac, "неверный формат даты, используйте +N или YYYY-MM-DD")
+            continue
+
+        return_date_str = return_date.strftime("%Y-%m-%d")
+        plan.updates[found.row_num] = found.columns.fields(
+            room=record['room'],
+            status=Status.ISSUED,
+            owner=record['name'],
+            checkin=issue_date,
+            checkout=return_date_str,
+            contact=record['contact'],
+        )
+        plan.expected[found.row_num] = found
+        plan.ok(line_num, mac, f"выдан в комнату {record['room']} до {return_date_str}", key=found.row_num)
+    return plan
+
+def plan_return(records, snapshot):
+    """Возврат: роутер ищется по MAC, а если его нет в строке - по комнате"""
+    plan = BulkPlan()
+    seen = {}
+    for line_num, record in records:
+        identifier = record['mac'] or record['room']
+        if record['mac']:
+            if not is_mac_address(record['mac']):
+                plan.fail(line_num, identifier, "неверный формат MAC-адреса")
+                continue
+            found = snapshot.find_by_mac(record['mac'])
+        elif record['room']:
+            found = snapshot.find_by_room(record['room'])
+        else:
+            plan.fail(line_num, identifier, "не указаны MAC-адрес или комната")
+            continue
+
+        if not found:
+            plan.fail(line_num, identifier, "роутер не найден")
+            continue
+        if found.row_num in seen:
+            plan.fail(line_num, identifier, f"повторяется в файле (строка {seen[found.row_num]})")
+            continue
+        seen[found.row_num] = line_num
+        if found.is_free:
+            plan.fail(line_num, identifier, "роутер уже свободен")
+            continue
+
+        # Очищаем все, что относится к владельцу
+        plan.updates[found.row_num] = found.columns.fields(
+            room="", status=Status.FREE, owner="", checkin="", checkout="", contact="", comment=""
+        )
+        plan.expected[found.row_num] = found
+        plan.ok(line_num, identifier, "принят", key=found.row_num)
+    return plan
+
+def plan_add(records, snapshot):
+    """Добавление: MAC-адреса, которых еще нет в таблице"""
+    plan = BulkPlan()
+    seen = {}
+    for line_num, record in records:
+        mac = record['mac']
+        if not is_mac_address(mac):
+            plan.fail(line_num, mac, "неверный формат MAC-адреса")
+            continue
+        if normalize_mac(mac) in seen:
+            plan.fail(line_num, mac, f"повторяется в файле (строка {seen[normalize_mac(mac)]})")
+            continue
+        seen[normalize_mac(mac)] = line_num
+        found = snapshot.find_by_mac(mac)
+        if found:
+            plan.fail(line_num, mac, f"уже есть в таблице (строка {snapshot.label(found.row_num)})")
+            continue
+
+        plan.appends.append(mac)
+        plan.ok(line_num, mac, "добавлен", key=normalize_mac(mac))
+    return plan
+
+# Массовые операции: команда в подписи к файлу -> функция проверки
+PLANNERS = {
+    'bulk_issue': plan_issue,
+    'bulk_return': plan_return,
+    'bulk_add': plan_add,
+}
+
+def render_report(plan, limit=30):
+    """Текст отчета: итог и строки с ошибками (не больше limit)"""
+    failed = [entry for entry in plan.report if not entry[2]]
+    lines = [f"Готово: {plan.succeeded} из {len(plan.report)}."]
+    if failed:
+        lines.append("Ошибки:")
+        for line_num, router, _, message in failed[:limit]:
+            lines.append(f"строка {line_num}: {router or '-'} - {message}")
+        if len(failed) > limit:
+            lines.append(f"... и еще {len(failed) - limit}, см. файл отчета")
+    return '\n'.join(lines)
+
+def report_csv(plan):
+    """Полный отчет по строкам файла в CSV"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['line', 'router', 'result', 'message'])
+    for line_num, router, ok, message in plan.report:
+        writer.writerow([line_num, router, 'ok' if ok else 'error', message])
+    return output.getvalue().encode('utf-8-sig')
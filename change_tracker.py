@@ -0,0 +1,120 @@
+# change_tracker.py
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+
+import config
+
+# Размер блока строк, для которого считается хэш
+BLOCK_SIZE = getattr(config, 'SHEETS_SYNC_BLOCK_SIZE', 200)
+# Раз в сколько секунд лист перечитывается целиком, даже если по метаданным он не менялся
+FULL_SYNC_INTERVAL = getattr(config, 'SHEETS_FULL_SYNC_INTERVAL', 15 * 60)
+# Допуск расхождения часов при сравнении времени изменения файла с нашими записями
+OWN_WRITE_SKEW = timedelta(seconds=getattr(config, 'SHEETS_OWN_WRITE_SKEW', 1))
+
+def _row_hash(row_num, row):
+    joined = '\x1f'.join(value.strip() for value in row).rstrip('\x1f')
+    return hashlib.blake2b(f"{row_num}\x1e{joined}".encode('utf-8'), digest_size=8).digest()
+
+def _parse_modified(modified):
+    """Время modifiedTime из Drive API ("2024-09-01T10:00:00.000Z") в datetime UTC"""
+    try:
+        return datetime.fromisoformat(modified.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+
+class ChangeTracker:
+    """Решает, нужно ли перекачивать лист, и находит изменившиеся блоки строк.
+
+    Скачивать лист имеет смысл, только если время изменения файла (Drive modifiedTime)
+    стало новее снимка и это изменение сделали не мы сами. После загрузки хэши
+    блоков по BLOCK_SIZE строк показывают, какие строки нужно заменить в локальной базе.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        # modifiedTime, которому соответствует локальная база
+        self.remote_version = None
+        # номер блока -> хэш
+        self.block_hashes = {}
+        self.last_full_sync = None
+        # [(начало, конец)] по UTC наших успешных записей с последней загрузки
+        self.write_windows = []
+        # Отключается, если у сервисного аккаунта нет доступа к метаданным Drive
+        self.gate_enabled = True
+
+    def reset(self):
+        self.remote_version = None
+        self.block_hashes = {}
+        self.last_full_sync = None
+        self.write_windows = []
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc)
+
+    def note_write(self, started):
+        """Отмечает нашу запись, начатую в started: изменение файла в это время - ее следствие"""
+        self.write_windows.append((started, self.now()))
+
+    def invalidate(self, row_nums):
+        """Забывает хэши блоков с этими строками, чтобы при следующей загрузке их сверить заново"""
+        for row_num in row_nums:
+            self.block_hashes.pop((row_num - 1) // self.block_size, None)
+
+    def can_skip(self, modified):
+        """Можно ли не скачивать лист: он не менялся или менялся только нашими записями"""
+        if modified is None or self.remote_version is None or self.last_full_sync is None:
+            return False
+        if time.monotonic() - self.last_full_sync >= FULL_SYNC_INTERVAL:
+            return False
+        if modified == self.remote_version:
+            return True
+        # Изменение, пришедшееся на время нашей записи, считаем нашим. Правка человека,
+        # сделанная раньше нее, так не видна (modifiedTime хранит только последнее
+        # изменение) - ее подберет полная загрузка раз в FULL_SYNC_INTERVAL
+        modified_at = _parse_modified(modified)
+        if modified_at is None:
+            return False
+        return any(
+            started - OWN_WRITE_SKEW <= modified_at <= finished + OWN_WRITE_SKEW
+            for started, finished in self.write_windows
+        )
+
+    def accept(self, modified):
+        """Запоминает modifiedTime, которому теперь соответствует локальная база"""
+        if modified is not None:
+            self.remote_version = modified
+
+    def diff(self, rows, modified):
+        """Сравнивает свежие строки листа с прошлой загрузкой.
+
+        Возвращает (диапазоны [(первая, последняя)], {строка: значения} в этих диапазонах)
+        или (None, None), если сравнивать не с чем и базу нужно заменить целиком.
+        """
+        hashes = {}
+        for row_num in sorted(rows):
+            block = (row_num - 1) // self.block_size
+            hashes.setdefault(block, hashlib.blake2b(digest_size=8)).update(_row_hash(row_num, rows[row_num]))
+        hashes = {block: digest.digest() for block, digest in hashes.items()}
+
+        first_load = not self.block_hashes
+        changed = sorted(
+            block for block in hashes.keys() | self.block_hashes.keys()
+            if hashes.get(block) != self.block_hashes.get(block)
+        )
+        self.block_hashes = hashes
+        self.accept(modified)
+        self.last_full_sync = time.monotonic()
+        # Записи до этой загрузки в ней уже учтены
+        self.write_windows = []
+        if first_load:
+            return None, None
+
+        ranges = [(block * self.block_size + 1, (block + 1) * self.block_size) for block in changed]
+        changed_set = set(changed)
+        changed_rows = {
+            row_num: row for row_num, row in rows.items()
+            if (row_num - 1) // self.block_size in changed_set
+        }
+        return ranges, changed_rows
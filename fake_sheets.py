@@ -0,0 +1,238 @@
+# fake_sheets.py
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from gspread.exceptions import APIError, WorksheetNotFound
+
+A1_RE = re.compile(r"^(?:.*!)?([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+def _col_number(letters):
+    col_num = 0
+    for letter in letters:
+        col_num = col_num * 26 + ord(letter) - ord('A') + 1
+    return col_num
+
+def _col_letters(col_num):
+    letters = ''
+    while col_num:
+        col_num, rem = divmod(col_num - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+class FakeResponse:
+    """Минимальный ответ HTTP, которого достаточно для gspread.exceptions.APIError"""
+
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+        self._payload = {'error': {'code': status_code, 'message': message, 'status': 'RESOURCE_EXHAUSTED'}}
+
+    def json(self):
+        return self._payload
+
+class FakeSpreadsheet:
+    """Файл таблицы: отдает время последнего изменения, как Drive API, и другие листы"""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+        # название -> FakeWorksheet для листов кроме основного
+        self.tabs = {}
+
+    def get_lastUpdateTime(self):
+        self._worksheet._call('get_lastUpdateTime')
+        # Файл меняется при правке любого листа
+        latest = max([self._worksheet, *self.tabs.values()], key=lambda worksheet: worksheet._modified)
+        return self._worksheet._reply(latest.modified_time)
+
+    def worksheet(self, title):
+        self._worksheet._call('fetch_sheet_metadata')
+        if title == self._worksheet.title:
+            return self._worksheet
+        if title not in self.tabs:
+            raise WorksheetNotFound(title)
+        return self.tabs[title]
+
+    def add_worksheet(self, title, rows=1, cols=1):
+        self._worksheet._call('add_worksheet', {'title': title})
+        tab = FakeWorksheet(title=title)
+        # Обращения к другим листам учитываются вместе с основным
+        tab._call = self._worksheet._call
+        tab._reply = self._worksheet._reply
+        tab.spreadsheet = self
+        self.tabs[title] = tab
+        return tab
+
+class FakeWorksheet:
+    """Лист Google Таблицы в памяти с тем же API, что использует sheets.py.
+
+    Считает обращения и объем переданных данных, умеет добавлять задержку
+    и отвечать ошибкой 429, как настоящий API при исчерпании квоты.
+    """
+
+    def __init__(self, rows=None, title='Sheet1', latency=0.0, error_rate=0.0, seed=None):
+        self.title = title
+        self.rows = [list(row) for row in (rows or [])]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._fail_next = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._modified = datetime.now(timezone.utc)
+        self.spreadsheet = FakeSpreadsheet(self)
+
+    # --- учет и внедрение сбоев ---
+
+    def fail_next(self, count=1):
+        """Следующие count обращений вернут 429"""
+        self._fail_next += count
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @property
+    def modified_time(self):
+        """Время изменения в формате modifiedTime из Drive API"""
+        return self._modified.strftime('%Y-%m-%dT%H:%M:%S.') + f"{self._modified.microsecond // 1000:03d}Z"
+
+    def edit(self, row_num, col_num, value):
+        """Правка "руками" в интерфейсе таблицы: без обращения к API, но меняет время изменения"""
+        with self._lock:
+            self._set(row_num, col_num, value)
+
+    def delete_row(self, row_num):
+        """Удаление строки вручную: строки ниже сдвигаются вверх, как в интерфейсе таблицы"""
+        with self._lock:
+            del self.rows[row_num - 1]
+            self._modified = max(datetime.now(timezone.utc), self._modified + timedelta(milliseconds=1))
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def _call(self, name, request=None):
+        self.calls[name] += 1
+        self.bytes_sent += len(json.dumps(request, ensure_ascii=False, default=str)) if request is not None else 0
+        if self.latency:
+            time.sleep(self.latency)
+        if self._fail_next or (self.error_rate and self._random.random() < self.error_rate):
+            self._fail_next = max(0, self._fail_next - 1)
+            raise APIError(FakeResponse(429, "Quota exceeded for quota metric 'Write requests'"))
+
+    def _reply(self, payload):
+        self.bytes_received += len(json.dumps(payload, ensure_ascii=False, default=str))
+        return payload
+
+    def _set(self, row_num, col_num, value):
+        # Время изменения строго растет, даже если правки идут в одну миллисекунду
+        self._modified = max(datetime.now(timezone.utc), self._modified + timedelta(milliseconds=1))
+        while len(self.rows) < row_num:
+            self.rows.append([])
+        row = self.rows[row_num - 1]
+        if len(row) < col_num:
+            row.extend([''] * (col_num - len(row)))
+        row[col_num - 1] = '' if value is None else str(value)
+
+    def _width(self):
+        return max((len(row) for row in self.rows), default=0)
+
+    # --- API gspread.Worksheet ---
+
+    def get_all_values(self, *args, **kwargs):
+        self._call('get_all_values')
+        with self._lock:
+            width = self._width()
+            values = [row + [''] * (width - len(row)) for row in self.rows]
+        return self._reply(values)
+
+    def get_all_records(self, *args, **kwargs):
+        self._call('get_all_records')
+        with self._lock:
+            header = self.rows[0] if self.rows else []
+            records = [
+                {key: (row[i] if i < len(row) else '') for i, key in enumerate(header)}
+                for row in self.rows[1:]
+            ]
+        return self._reply(records)
+
+    def col_values(self, col_num, *args, **kwargs):
+        self._call('col_values', col_num)
+        with self._lock:
+            values = [row[col_num - 1] if len(row) >= col_num else '' for row in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        return self._reply(values)
+
+    def row_values(self, row_num, *args, **kwargs):
+        self._call('row_values', row_num)
+        with self._lock:
+            values = list(self.rows[row_num - 1]) if row_num <= len(self.rows) else []
+        while values and not values[-1]:
+            values.pop()
+        return self._reply(values)
+
+    def cell(self, row_num, col_num, *args, **kwargs):
+        self._call('cell', [row_num, col_num])
+        with self._lock:
+            row = self.rows[row_num - 1] if row_num <= len(self.rows) else []
+            value = row[col_num - 1] if len(row) >= col_num else None
+        return SimpleNamespace(row=row_num, col=col_num, value=self._reply(value))
+
+    def update_cell(self, row_num, col_num, value):
+        self._call('update_cell', [row_num, col_num, value])
+        with self._lock:
+            self._set(row_num, col_num, value)
+        return self._reply({'updatedCells': 1})
+
+    def batch_update(self, data, **kwargs):
+        self._call('batch_update', data)
+        updated = 0
+        with self._lock:
+            for item in data:
+                match = A1_RE.match(item['range'])
+                row_num, col_num = int(match.group(2)), _col_number(match.group(1))
+                for i, values in enumerate(item['values']):
+                    for j, value in enumerate(values):
+                        self._set(row_num + i, col_num + j, value)
+                        updated += 1
+        return self._reply({'totalUpdatedCells': updated})
+
+    def append_rows(self, values, **kwargs):
+        self._call('append_rows', values)
+        with self._lock:
+            first_row = len(self.rows) + 1
+            for row in values:
+                self.rows.append(['' if value is None else str(value) for value in row])
+            self._modified = max(datetime.now(timezone.utc), self._modified + timedelta(milliseconds=1))
+            last_row = len(self.rows)
+        width = max((len(row) for row in values), default=1)
+        updated_range = f"{self.title}!A{first_row}:{_col_letters(width)}{last_row}"
+        return self._reply({'updates': {'updatedRange': updated_range}})
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+def make_inventory(size, issued_share=0.5, overdue_share=0.1, seed=0):
+    """Строит лист из size роутеров: заголовок + строки в формате таблицы бота"""
+    rnd = random.Random(seed)
+    header = ['№', 'MAC', 'Room', 'Status', 'Model', 'Owner', 'Checkin', 'Checkout', 'Contact', 'Comment']
+    rows = [header]
+    for i in range(1, size + 1):
+        mac = ':'.join(f"{(i >> shift) & 0xFF:02X}" for shift in (40, 32, 24, 16, 8, 0))
+        if rnd.random() < issued_share:
+            checkout = '2000-01-01' if rnd.random() < overdue_share else '2999-01-01'
+            rows.append([str(i), mac, str(100 + i), 'Выдан', '', f"Владелец {i}",
+                         '2024-09-01', checkout, f"@owner{i}", ''])
+        else:
+            rows.append([str(i), mac, '', 'Свободен', '', '', '', '', '', ''])
+    return rows
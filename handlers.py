@@ -1,35 +1,104 @@
 # handlers.py
 import logging
-import re
+import time
 from datetime import datetime, timedelta
 
-from telegram import Update, ReplyKeyboardRemove
+from telegram import (
+    InlineQueryResultArticle, InputFile, InputTextMessageContent, Update, ReplyKeyboardRemove
+)
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters
 
+import bulk
+from audit_log import OPERATION_NAMES, audit_log, format_changes
 from config import DEFAULT_ISSUE_PERIOD
-from sheets import sheets_helper
-from access_control import restricted_access
+from records import Status
+from sheets import sheets_helper, async_sheets, row_fingerprint
+from access_control import restricted_access, admin_only, throttled
+from metrics import metrics, track_handler
+from write_queue import write_queue
+from row_locks import APPEND_LOCK, row_locks
+from validation import DATE_ARG_RE, command_args, is_mac_address, parse_date
 
 logger = logging.getLogger(__name__)
 
 # Состояния для ConversationHandler'а
 MAC, ROOM, NAME, CONTACT, DATE, CONFIRMATION, COMMENT, NEW_OWNER, NEW_CONTACT = range(9)
 
-def parse_date(date_str):
-    """Парсит строку даты в формате +Nd или YYYY-MM-DD"""
-    if date_str.startswith('+'):
-        try:
-            days = int(date_str[1:])
-            return datetime.now() + timedelta(days=days)
-        except ValueError:
-            return None
+# Подсказки к командам в одну строку
+ISSUE_USAGE = 'Использование: /issue <MAC> <комната> "<ФИО>" <контакты> [+Nd или YYYY-MM-DD]'
+RETURN_USAGE = "Использование: /return <MAC или комната>"
+EXTEND_USAGE = "Использование: /extend <MAC или комната> <+Nd или YYYY-MM-DD>"
+OWNER_USAGE = 'Использование: /change_owner <MAC или комната> "<ФИО>" <контакты>'
+
+async def find_router(identifier):
+    """Ищет роутер по MAC-адресу или номеру комнаты"""
+    if is_mac_address(identifier):
+        return await async_sheets.find_row_by_mac(identifier)
+    return await async_sheets.find_row_by_room(identifier)
+
+async def not_found_text(identifier, retry=False):
+    """Ответ, если роутер не найден; комнату без корпуса, которая есть в нескольких общежитиях, просим уточнить"""
+    shards = [] if is_mac_address(identifier) else await async_sheets.find_room_shards(identifier)
+    if len(shards) > 1:
+        room = identifier.strip()
+        variants = [f"{shard.room_prefix}-{room}" for shard in shards if shard.room_prefix]
+        hint = f"Укажите корпус: {' или '.join(variants)}." if variants else "Укажите MAC-адрес роутера."
+        text = f"Комната {room} есть в нескольких общежитиях: {', '.join(shard.name for shard in shards)}. {hint}"
     else:
-        try:
-            return datetime.strptime(date_str, '%Y-%m-%d')
-        except ValueError:
-            return None
+        text = "Роутер не найден."
+    if retry:
+        text += " Попробуйте еще раз или /cancel."
+    return text + offline_notice()
+
+def offline_notice(dorm=None):
+    """Предупреждение о режиме только для чтения, если Google Таблица (или лист общежития dorm) недоступна (иначе пустая строка)"""
+    if sheets_helper.is_online(dorm):
+        return ""
+    synced_at = sheets_helper.synced_at(dorm)
+    when = synced_at.strftime('%d.%m %H:%M') if synced_at else "неизвестного времени"
+    if dorm and len(sheets_helper.shards) > 1:
+        return (
+            f"\n\n⚠️ Лист общежития {dorm} недоступен, данные из снимка от {when}. "
+            "Подтвержденные изменения будут записаны, когда он снова станет доступен."
+        )
+    return (
+        f"\n\n⚠️ Google Таблица недоступна, данные из снимка от {when}. "
+        "Подтвержденные изменения будут записаны, когда она снова станет доступна."
+    )
+
+async def reject_offline(update, *dorms):
+    """Отказывает в команде, которой нужна запись в таблицу (или в листы общежитий dorms) прямо сейчас"""
+    offline = [dorm for dorm in dorms or [None] if not sheets_helper.is_online(dorm)]
+    if not offline:
+        return False
+    if dorms and len(sheets_helper.shards) > 1:
+        await update.message.reply_text(
+            f"Лист общежития {', '.join(offline)} сейчас недоступен, запись в него невозможна. Повторите команду позже."
+        )
+    else:
+        await update.message.reply_text(
+            "Google Таблица сейчас недоступна, бот работает только на чтение. Повторите команду позже."
+        )
+    return True
+
+async def end_one_shot(update, context, text):
+    """Завершает команду в одну строку с ошибкой"""
+    await update.message.reply_text(text)
+    context.user_data.clear()
+    return ConversationHandler.END
+
+def remember_row(context, row_num, row_data):
+    """Сохраняет найденную строку и ее отпечаток до подтверждения операции"""
+    context.user_data['pending_row_num'] = row_num
+    context.user_data['pending_row_data'] = row_data
+    context.user_data['pending_row_version'] = row_fingerprint(row_data)
+
+def pending_record(context):
+    """RouterRecord строки, сохраненной на шаге поиска"""
+    return sheets_helper.record(context.user_data['pending_row_num'], context.user_data['pending_row_data'])
 
 @restricted_access
+@track_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
@@ -37,76 +106,146 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Привет, {user.first_name}!\n"
         "Я бот для учета роутеров в общежитии.\n"
         "Доступные команды:\n"
-        "/add <MAC> - Добавить роутер\n"
+        "/add <MAC> [общежитие] - Добавить роутер\n"
         "/issue - Выдать роутер\n"
         "/return - Принять роутер\n"
         "/extend - Продлить срок\n"
         "/update - Проверить просрочки\n"
         "/add_comment - Добавить комментарий\n"
-        "/change_owner - Изменить владельца"
+        "/change_owner - Изменить владельца\n"
+        "/history <MAC или комната> - История операций\n"
+        "/bulk_issue, /bulk_return, /bulk_add - Массовые операции из файла CSV/XLSX\n"
+        "Можно и одной строкой:\n"
+        "/issue <MAC> <комната> \"<ФИО>\" <контакты> [+Nd]\n"
+        "/return <MAC или комната>\n"
+        "/extend <MAC или комната> <+Nd или YYYY-MM-DD>\n"
+        "/change_owner <MAC или комната> \"<ФИО>\" <контакты>"
     )
 
 @restricted_access
+@throttled
+@track_handler
 async def add_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /add"""
     if not context.args:
-        await update.message.reply_text("Использование: /add <MAC-адрес>")
+        await update.message.reply_text("Использование: /add <MAC-адрес> [общежитие]")
         return
 
-    mac_address = ' '.join(context.args)
-    if not re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", mac_address):
+    # Общежитие можно не указывать, если оно одно
+    mac_address, dorm = ' '.join(context.args), None
+    if not is_mac_address(mac_address):
+        mac_address, dorm = context.args[0], ' '.join(context.args[1:]) or None
+    if not is_mac_address(mac_address):
         await update.message.reply_text("Неверный формат MAC-адреса.")
         return
-
-    row_num, _ = sheets_helper.find_row_by_mac(mac_address)
-    if row_num:
-        await update.message.reply_text("Этот MAC-адрес уже есть в таблице.")
+    shard = sheets_helper.shard(dorm)
+    if shard is None:
+        await update.message.reply_text(
+            f"Укажите общежитие: /add <MAC-адрес> <{' | '.join(sheets_helper.shards)}>"
+        )
+        return
+    if await reject_offline(update, shard.name):
         return
 
-    try:
-        all_values = sheets_helper.sheet.get_all_values()
-        next_row = len(all_values) + 1
-        sheets_helper.update_cell(next_row, 2, mac_address)  # Колонка B (MAC)
-        sheets_helper.update_cell(next_row, 4, "Свободен")   # Колонка D (Status)
+    # Проверка и добавление под общим замком, чтобы один MAC не добавили дважды
+    async with row_locks.lock(APPEND_LOCK):
+        row_num, _ = await async_sheets.find_row_by_mac(mac_address)
+        if row_num:
+            await update.message.reply_text("Этот MAC-адрес уже есть в таблице.")
+            return
+
+        # Одна запись append: MAC и статус "Свободен" в их колонки
+        row_num = await async_sheets.append_router(mac_address, shard.name)
+    if row_num:
+        entry = audit_log.entry(
+            'add', update.effective_user,
+            fields=sheets_helper.columns_for(row_num).fields(mac=mac_address, status=Status.FREE),
+            mac=mac_address, row_num=row_num
+        )
+        await async_sheets.run_local(audit_log.add, [entry])
         await update.message.reply_text(f"Роутер с MAC {mac_address} успешно добавлен.")
-    except Exception as e:
-        logger.error(f"Ошибка при добавлении роутера: {e}")
+    else:
         await update.message.reply_text("Произошла ошибка при добавлении.")
 
 @restricted_access
+@throttled
+@track_handler
 async def start_issue(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начинает процесс выдачи роутера"""
+    context.user_data['started_at'] = time.monotonic()
+    if context.args:
+        return await issue_one_shot(update, context)
     await update.message.reply_text(
         "Введите MAC-адрес роутера:",
         reply_markup=ReplyKeyboardRemove()
     )
     return MAC
 
+async def issue_one_shot(update, context):
+    """Выдача одной командой: /issue <MAC> <комната> "<ФИО>" <контакты> [срок]"""
+    args = command_args(update.message.text)
+    if not args or len(args) < 4:
+        return await end_one_shot(update, context, ISSUE_USAGE)
+
+    mac_address, room, *rest = args
+    # Срок необязателен; без него - DEFAULT_ISSUE_PERIOD дней
+    if len(rest) > 2 and DATE_ARG_RE.match(rest[-1]):
+        # Похожий на срок, но неразборчивый аргумент не становится контактом
+        return_date = parse_date(rest.pop())
+    else:
+        return_date = datetime.now() + timedelta(days=int(DEFAULT_ISSUE_PERIOD))
+    name, contact = ' '.join(rest[:-1]), rest[-1]
+    if DATE_ARG_RE.match(contact):
+        return await end_one_shot(update, context, ISSUE_USAGE)
+
+    if not is_mac_address(mac_address):
+        return await end_one_shot(update, context, "Неверный формат MAC-адреса.")
+    if not return_date:
+        return await end_one_shot(update, context, "Неверный формат даты. Используйте +Nd или YYYY-MM-DD.")
+
+    row_num, row_data = await async_sheets.find_row_by_mac(mac_address)
+    if not row_num:
+        return await end_one_shot(update, context, f"Роутер с таким MAC-адресом не найден.{offline_notice()}")
+    if not sheets_helper.record(row_num, row_data).is_free:
+        return await end_one_shot(update, context, "Этот роутер сейчас не свободен.")
+
+    context.user_data.update({
+        'issue_mac': mac_address,
+        'issue_row': row_num,
+        'issue_room': room,
+        'issue_name': name,
+        'issue_contact': contact,
+    })
+    remember_row(context, row_num, row_data)
+    return await ask_issue_confirmation(update, context, return_date)
+
 @restricted_access
+@track_handler
 async def get_mac(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает MAC-адрес от пользователя"""
     mac_address = update.message.text
-    if not re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", mac_address):
+    if not is_mac_address(mac_address):
         await update.message.reply_text("Неверный формат MAC. Попробуйте еще раз или /cancel.")
         return MAC
 
-    row_num, row_data = sheets_helper.find_row_by_mac(mac_address)
+    row_num, row_data = await async_sheets.find_row_by_mac(mac_address)
     if not row_num:
-        await update.message.reply_text("Роутер с таким MAC-адресом не найден.")
+        await update.message.reply_text(f"Роутер с таким MAC-адресом не найден.{offline_notice()}")
         return MAC
 
-    current_status = row_data[3] if len(row_data) > 3 else ""
-    if current_status != "Свободен":
+    if not sheets_helper.record(row_num, row_data).is_free:
         await update.message.reply_text("Этот роутер сейчас не свободен.")
         return ConversationHandler.END
 
     context.user_data['issue_mac'] = mac_address
     context.user_data['issue_row'] = row_num
+    remember_row(context, row_num, row_data)
 
     await update.message.reply_text("Введите номер комнаты:")
     return ROOM
 
 @restricted_access
+@track_handler
 async def get_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает номер комнаты"""
     room = update.message.text
@@ -115,6 +254,7 @@ async def get_room(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return NAME
 
 @restricted_access
+@track_handler
 async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает ФИО"""
     name = update.message.text
@@ -123,6 +263,7 @@ async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CONTACT
 
 @restricted_access
+@track_handler
 async def get_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает контакты"""
     contact = update.message.text
@@ -131,6 +272,7 @@ async def get_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return DATE
 
 @restricted_access
+@track_handler
 async def get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает дату и завершает процесс выдачи"""
     date_str = update.message.text
@@ -140,6 +282,10 @@ async def get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Неверный формат даты. Используйте +Nd или YYYY-MM-DD.")
         return DATE
 
+    return await ask_issue_confirmation(update, context, return_date)
+
+async def ask_issue_confirmation(update, context, return_date):
+    """Показывает собранные данные выдачи и ждет подтверждения"""
     return_date_str = return_date.strftime("%Y-%m-%d")
     user_data = context.user_data
     row_num = user_data['issue_row']
@@ -175,64 +321,86 @@ async def get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CONFIRMATION
 
 @restricted_access
+@throttled
+@track_handler
 async def start_return(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начинает процесс возврата роутера"""
+    context.user_data['started_at'] = time.monotonic()
+    if context.args:
+        return await return_one_shot(update, context)
     await update.message.reply_text("Введите номер комнаты или MAC-адрес роутера для возврата:")
     return MAC
 
 @restricted_access
+@track_handler
 async def return_get_identifier(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает идентификатор для возврата"""
     identifier = update.message.text
     
-    # Определяем, это MAC или номер комнаты
-    if re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", identifier):
-        row_num, row_data = sheets_helper.find_row_by_mac(identifier)
-    else:
-        row_num, row_data = sheets_helper.find_row_by_room(identifier)
+    row_num, row_data = await find_router(identifier)
 
     if not row_num:
-        await update.message.reply_text("Роутер не найден. Попробуйте еще раз или /cancel.")
+        await update.message.reply_text(await not_found_text(identifier, retry=True))
         return MAC
 
+    return await ask_return_confirmation(update, context, row_num, row_data)
+
+async def return_one_shot(update, context):
+    """Возврат одной командой: /return <MAC или комната>"""
+    args = command_args(update.message.text)
+    if not args:
+        return await end_one_shot(update, context, RETURN_USAGE)
+
+    identifier = ' '.join(args)
+    row_num, row_data = await find_router(identifier)
+    if not row_num:
+        return await end_one_shot(update, context, await not_found_text(identifier))
+    return await ask_return_confirmation(update, context, row_num, row_data)
+
+async def ask_return_confirmation(update, context, row_num, row_data):
+    """Показывает роутер и ждет подтверждения возврата"""
     # Показываем информацию о роутере
-    info_text = sheets_helper.get_router_info(row_data)
+    info_text = sheets_helper.record(row_num, row_data).info()
+    info_text += offline_notice(sheets_helper.shard_of(row_num).name)
     info_text += "\n\nВы уверены, что хотите принять этот роутер? (да/нет)"
     
     context.user_data['pending_operation'] = 'return'
-    context.user_data['pending_row_num'] = row_num
+    remember_row(context, row_num, row_data)
     
     await update.message.reply_text(info_text)
     return CONFIRMATION
 
 @restricted_access
+@throttled
+@track_handler
 async def start_extend(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начинает процесс продления срока"""
+    context.user_data['started_at'] = time.monotonic()
+    if context.args:
+        return await extend_one_shot(update, context)
     await update.message.reply_text("Введите номер комнаты или MAC-адрес роутера для продления:")
     return MAC
 
 @restricted_access
+@track_handler
 async def extend_get_identifier(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает идентификатор для продления"""
     identifier = update.message.text
     
-    # Определяем, это MAC или номер комнаты
-    if re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", identifier):
-        row_num, row_data = sheets_helper.find_row_by_mac(identifier)
-    else:
-        row_num, row_data = sheets_helper.find_row_by_room(identifier)
+    row_num, row_data = await find_router(identifier)
 
     if not row_num:
-        await update.message.reply_text("Роутер не найден. Попробуйте еще раз или /cancel.")
+        await update.message.reply_text(await not_found_text(identifier, retry=True))
         return MAC
 
     context.user_data['pending_operation'] = 'extend'
-    context.user_data['pending_row_num'] = row_num
+    remember_row(context, row_num, row_data)
     
     await update.message.reply_text("Введите новый срок (+Nd или YYYY-MM-DD):")
     return DATE
 
 @restricted_access
+@track_handler
 async def extend_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает дату для продления"""
     date_str = update.message.text
@@ -242,12 +410,32 @@ async def extend_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Неверный формат даты. Используйте +Nd или YYYY-MM-DD.")
         return DATE
 
+    return await ask_extend_confirmation(update, context, return_date)
+
+async def extend_one_shot(update, context):
+    """Продление одной командой: /extend <MAC или комната> <срок>"""
+    args = command_args(update.message.text)
+    if not args or len(args) < 2:
+        return await end_one_shot(update, context, EXTEND_USAGE)
+
+    return_date = parse_date(args[-1])
+    if not return_date:
+        return await end_one_shot(update, context, "Неверный формат даты. Используйте +Nd или YYYY-MM-DD.")
+    identifier = ' '.join(args[:-1])
+    row_num, row_data = await find_router(identifier)
+    if not row_num:
+        return await end_one_shot(update, context, await not_found_text(identifier))
+
+    context.user_data['pending_operation'] = 'extend'
+    remember_row(context, row_num, row_data)
+    return await ask_extend_confirmation(update, context, return_date)
+
+async def ask_extend_confirmation(update, context, return_date):
+    """Показывает роутер с новым сроком и ждет подтверждения"""
     return_date_str = return_date.strftime("%Y-%m-%d")
-    row_num = context.user_data['pending_row_num']
     
-    # Получаем текущие данные для подтверждения
-    _, row_data = sheets_helper.find_row_by_mac(sheets_helper.sheet.cell(row_num, 2).value)
-    info_text = sheets_helper.get_router_info(row_data)
+    # Показываем данные, сохраненные на шаге поиска
+    info_text = pending_record(context).info()
     info_text += f"\n\nНовый срок возврата: {return_date_str}\n\nПодтверждаете продление? (да/нет)"
     
     context.user_data['pending_data'] = {'return_date': return_date_str}
@@ -256,74 +444,76 @@ async def extend_get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CONFIRMATION
 
 @restricted_access
+@throttled
+@track_handler
 async def start_add_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начинает процесс добавления комментария"""
+    context.user_data['started_at'] = time.monotonic()
     await update.message.reply_text("Введите номер комнаты или MAC-адрес роутера для добавления комментария:")
     return MAC
 
 @restricted_access
+@track_handler
 async def comment_get_identifier(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает идентификатор для добавления комментария"""
     identifier = update.message.text
     
-    # Определяем, это MAC или номер комнаты
-    if re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", identifier):
-        row_num, row_data = sheets_helper.find_row_by_mac(identifier)
-    else:
-        row_num, row_data = sheets_helper.find_row_by_room(identifier)
+    row_num, row_data = await find_router(identifier)
 
     if not row_num:
-        await update.message.reply_text("Роутер не найден. Попробуйте еще раз или /cancel.")
+        await update.message.reply_text(await not_found_text(identifier, retry=True))
         return MAC
 
     context.user_data['pending_operation'] = 'add_comment'
-    context.user_data['pending_row_num'] = row_num
+    remember_row(context, row_num, row_data)
     
     await update.message.reply_text("Введите комментарий:")
     return COMMENT
 
 @restricted_access
+@track_handler
 async def get_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает комментарий"""
     comment = update.message.text
     context.user_data['pending_comment'] = comment
     
-    row_num = context.user_data['pending_row_num']
-    _, row_data = sheets_helper.find_row_by_mac(sheets_helper.sheet.cell(row_num, 2).value)
-    info_text = sheets_helper.get_router_info(row_data)
+    info_text = pending_record(context).info()
     info_text += f"\n\nНовый комментарий: {comment}\n\nПодтверждаете добавление? (да/нет)"
     
     await update.message.reply_text(info_text)
     return CONFIRMATION
 
 @restricted_access
+@throttled
+@track_handler
 async def start_change_owner(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начинает процесс изменения владельца"""
+    context.user_data['started_at'] = time.monotonic()
+    if context.args:
+        return await owner_one_shot(update, context)
     await update.message.reply_text("Введите номер комнаты или MAC-адрес роутера для изменения владельца:")
     return MAC
 
 @restricted_access
+@track_handler
 async def owner_get_identifier(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает идентификатор для изменения владельца"""
     identifier = update.message.text
     
-    # Определяем, это MAC или номер комнаты
-    if re.match(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$", identifier):
-        row_num, row_data = sheets_helper.find_row_by_mac(identifier)
-    else:
-        row_num, row_data = sheets_helper.find_row_by_room(identifier)
+    row_num, row_data = await find_router(identifier)
 
     if not row_num:
-        await update.message.reply_text("Роутер не найден. Попробуйте еще раз или /cancel.")
+        await update.message.reply_text(await not_found_text(identifier, retry=True))
         return MAC
 
     context.user_data['pending_operation'] = 'change_owner'
-    context.user_data['pending_row_num'] = row_num
+    remember_row(context, row_num, row_data)
     
     await update.message.reply_text("Введите ФИО нового владельца:")
     return NEW_OWNER
 
 @restricted_access
+@track_handler
 async def owner_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает имя нового владельца"""
     name = update.message.text
@@ -333,20 +523,37 @@ async def owner_get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return NEW_CONTACT
 
 @restricted_access
+@track_handler
 async def owner_get_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получает контакты нового владельца"""
     contact = update.message.text
-    row_num = context.user_data['pending_row_num']
+    return await ask_owner_confirmation(update, context, context.user_data['pending_new_owner'], contact)
     
-    # Получаем текущие данные для подтверждения
-    _, row_data = sheets_helper.find_row_by_mac(sheets_helper.sheet.cell(row_num, 2).value)
-    info_text = sheets_helper.get_router_info(row_data)
-    info_text += f"\n\nНовый владелец: {context.user_data['pending_new_owner']}\n"
+async def owner_one_shot(update, context):
+    """Смена владельца одной командой: /change_owner <MAC или комната> "<ФИО>" <контакты>"""
+    args = command_args(update.message.text)
+    if not args or len(args) < 3:
+        return await end_one_shot(update, context, OWNER_USAGE)
+
+    identifier = args[0]
+    row_num, row_data = await find_router(identifier)
+    if not row_num:
+        return await end_one_shot(update, context, await not_found_text(identifier))
+
+    context.user_data['pending_operation'] = 'change_owner'
+    remember_row(context, row_num, row_data)
+    return await ask_owner_confirmation(update, context, ' '.join(args[1:-1]), args[-1])
+
+async def ask_owner_confirmation(update, context, name, contact):
+    """Показывает роутер с новым владельцем и ждет подтверждения"""
+    # Показываем данные, сохраненные на шаге поиска
+    info_text = pending_record(context).info()
+    info_text += f"\n\nНовый владелец: {name}\n"
     info_text += f"Новые контакты: {contact}\n\n"
     info_text += "Подтверждаете изменение? (да/нет)"
     
     context.user_data['pending_data'] = {
-        'name': context.user_data['pending_new_owner'],
+        'name': name,
         'contact': contact
     }
     
@@ -354,6 +561,7 @@ async def owner_get_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CONFIRMATION
 
 @restricted_access
+@track_handler
 async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатывает подтверждение действий"""
     text = update.message.text.lower()
@@ -367,112 +575,346 @@ async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data.clear()
         return ConversationHandler.END
     
+    confirmed_at = time.monotonic()
+    
     # Обработка подтверждения для разных операций
     operation = context.user_data.get('pending_operation')
     
+    # Колонки берутся по заголовку листа того общежития, в котором строка
+    columns = sheets_helper.columns_for(context.user_data.get('pending_row_num', 0))
     if operation == 'issue':
         data = context.user_data['pending_data']
-        success = True
-        success &= sheets_helper.update_cell(data['row_num'], 3, data['room'])  # Комната
-        success &= sheets_helper.update_cell(data['row_num'], 4, "Выдан")       # Статус
-        success &= sheets_helper.update_cell(data['row_num'], 6, data['name'])  # Владелец
-        success &= sheets_helper.update_cell(data['row_num'], 7, data['issue_date'])  # Checkin (дата выдачи)
-        success &= sheets_helper.update_cell(data['row_num'], 8, data['return_date'])  # Checkout (дата возврата)
-        success &= sheets_helper.update_cell(data['row_num'], 9, data['contact'])  # Контакты
-        
-        if success:
-            await update.message.reply_text("Роутер успешно выдан!")
-        else:
-            await update.message.reply_text("Ошибка при обновлении таблицы.")
+        row_num = data['row_num']
+        fields = columns.fields(
+            room=data['room'],
+            status=Status.ISSUED,
+            owner=data['name'],
+            checkin=data['issue_date'],
+            checkout=data['return_date'],
+            contact=data['contact'],
+        )
+        reply = "Роутер успешно выдан!"
     
     elif operation == 'return':
         row_num = context.user_data['pending_row_num']
-        success = True
-        success &= sheets_helper.update_cell(row_num, 3, "")  # Очищаем комнату
-        success &= sheets_helper.update_cell(row_num, 4, "Свободен")  # Статус
-        success &= sheets_helper.update_cell(row_num, 6, "")  # Владелец
-        success &= sheets_helper.update_cell(row_num, 7, "")  # Checkin (дата выдачи)
-        success &= sheets_helper.update_cell(row_num, 8, "")  # Checkout (дата возврата)
-        success &= sheets_helper.update_cell(row_num, 9, "")  # Контакты
-        success &= sheets_helper.update_cell(row_num, 10, "")  # Комментарий
-        
-        if success:
-            await update.message.reply_text("Роутер принят и теперь свободен.")
-        else:
-            await update.message.reply_text("Ошибка при обновлении таблицы.")
+        # Очищаем все, что относится к владельцу
+        fields = columns.fields(
+            room="", status=Status.FREE, owner="", checkin="", checkout="", contact="", comment=""
+        )
+        reply = "Роутер принят и теперь свободен."
     
     elif operation == 'extend':
         row_num = context.user_data['pending_row_num']
         return_date = context.user_data['pending_data']['return_date']
-        
-        success = sheets_helper.update_cell(row_num, 8, return_date)  # Обновляем только checkout
-        
-        if success:
-            await update.message.reply_text(f"Срок возврата продлен до {return_date}.")
-        else:
-            await update.message.reply_text("Ошибка при обновлении таблицы.")
+        fields = columns.fields(checkout=return_date)  # Обновляем только checkout
+        reply = f"Срок возврата продлен до {return_date}."
     
     elif operation == 'add_comment':
         row_num = context.user_data['pending_row_num']
         comment = context.user_data['pending_comment']
         
-        # Получаем текущий комментарий и добавляем новый
-        current_comment = sheets_helper.sheet.cell(row_num, 10).value or ""
+        # Текущий комментарий берем из проверенной выше строки и добавляем новый
+        current_comment = pending_record(context).comment
         if current_comment:
             new_comment = f"{current_comment}; {comment}"
         else:
             new_comment = comment
-        
-        success = sheets_helper.update_cell(row_num, 10, new_comment)
-        
-        if success:
-            await update.message.reply_text("Комментарий успешно добавлен.")
-        else:
-            await update.message.reply_text("Ошибка при обновлении таблицы.")
+        fields = columns.fields(comment=new_comment)
+        reply = "Комментарий успешно добавлен."
     
     elif operation == 'change_owner':
         row_num = context.user_data['pending_row_num']
         data = context.user_data['pending_data']
+        fields = columns.fields(owner=data['name'], contact=data['contact'])
+        reply = "Данные владельца успешно обновлены."
         
-        success = True
-        success &= sheets_helper.update_cell(row_num, 6, data['name'])  # Владелец
-        success &= sheets_helper.update_cell(row_num, 9, data['contact'])  # Контакты
-        
-        if success:
-            await update.message.reply_text("Данные владельца успешно обновлены.")
-        else:
-            await update.message.reply_text("Ошибка при обновлении таблицы.")
+    else:
+        await update.message.reply_text("Нет операции для подтверждения.")
+        context.user_data.clear()
+        return ConversationHandler.END
+    
+    # Проверка и постановка в очередь идут под замком строки (compare-and-set):
+    # из двух одновременных подтверждений одного роутера второе увидит изменения первого
+    async with row_locks.lock(row_num):
+        current_row = await async_sheets.get_row(row_num) or []
+        conflict = None
+        if row_fingerprint(current_row) != context.user_data.get('pending_row_version'):
+            conflict = "Данные роутера изменились, пока шло оформление. Начните операцию заново."
+        elif operation == 'issue' and not sheets_helper.record(row_num, current_row).is_free:
+            conflict = "Роутер уже выдан другим оператором."
+        if conflict:
+            await update.message.reply_text(conflict, reply_markup=ReplyKeyboardRemove())
+            context.user_data.clear()
+            return ConversationHandler.END
+
+        # Запись уходит в очередь: оператор получает ответ сразу, а об успешной записи - отдельным сообщением
+        write_queue.enqueue(
+            row_num, fields,
+            chat_id=update.effective_chat.id,
+            description=f"{OPERATION_NAMES[operation]}, строка {sheets_helper.row_label(row_num)}",
+            mac=sheets_helper.record(row_num, current_row).mac
+        )
+        # В журнал попадают и прежние значения: возврат стирает владельца и комментарий
+        entry = audit_log.entry(operation, update.effective_user, sheets_helper.record(row_num, current_row), fields)
+    await async_sheets.run_local(audit_log.add, [entry])
+    await update.message.reply_text(
+        f"{reply}\nИзменения сохраняются в таблицу.{offline_notice(sheets_helper.shard_of(row_num).name)}"
+    )
+    
+    # Время подтверждения и всего диалога - от первой команды до ответа
+    finished_at = time.monotonic()
+    metrics.observe('operation', {'operation': operation}, finished_at - confirmed_at)
+    started_at = context.user_data.get('started_at')
+    if started_at is not None:
+        metrics.observe('conversation', {'operation': operation}, finished_at - started_at)
     
     context.user_data.clear()
     return ConversationHandler.END
 
+async def sweep_overdue(chat_id=None):
+    """Ставит в очередь записи пометку просроченных роутеров доступных общежитий: {общежитие: число строк или None}"""
+    found = await async_sheets.find_overdue()
+    today = datetime.now().date()
+    counts = {}
+    for name, row_nums in found.items():
+        if row_nums is None:
+            counts[name] = None
+            continue
+        updates, macs = {}, {}
+        # Как и подтверждения операций: под замками строк сверяемся с текущими данными,
+        # чтобы не пометить просроченным роутер, который только что вернули или продлили
+        async with row_locks.lock(*row_nums):
+            snapshot = await async_sheets.snapshot()
+            for row_num in row_nums:
+                record = sheets_helper.record(row_num, snapshot.get(row_num))
+                if record and record.status is Status.ISSUED and record.checkout and record.checkout < today:
+                    updates[row_num] = sheets_helper.columns_for(row_num).fields(status=Status.OVERDUE)
+                    macs[row_num] = record.mac
+            if updates:
+                label = f" ({name})" if len(found) > 1 else ""
+                write_queue.enqueue_many(
+                    updates, chat_id=chat_id, description=f"пометка просрочек{label}, строк: {len(updates)}", macs=macs
+                )
+        counts[name] = len(updates)
+    return counts
+
 @restricted_access
+@throttled
+@track_handler
 async def update_statuses(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Проверяет и обновляет статусы просроченных роутеров"""
+    """Проверяет и обновляет статусы просроченных роутеров в доступных общежитиях"""
+    # Недоступный лист одного общежития не мешает проверить остальные
+    online = {name for name in sheets_helper.shards if sheets_helper.is_online(name)}
+    if not online:
+        await reject_offline(update)
+        return
+    counts = await sweep_overdue(update.effective_chat.id)
+    saving = "\nИзменения сохраняются в таблицу." if any(counts.values()) else ""
+    if len(counts) == 1:
+        updated_count, = counts.values()
+        if updated_count is None:
+            await update.message.reply_text("Произошла ошибка при обновлении статусов.")
+        else:
+            await update.message.reply_text(f"Проверка завершена. Обновлено статусов: {updated_count}.{saving}")
+        return
+
+    lines = []
+    for name, count in counts.items():
+        if count is not None:
+            lines.append(f"{name}: обновлено статусов {count}")
+        elif name in online:
+            lines.append(f"{name}: ошибка при обновлении статусов")
+        else:
+            lines.append(f"{name}: не проверено, лист недоступен")
+    await update.message.reply_text("Проверка завершена.\n" + "\n".join(lines) + saving)
+
+async def scheduled_update_statuses(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая проверка просрочек из JobQueue"""
+    counts = await sweep_overdue()
+    for name, updated_count in counts.items():
+        label = f" ({name})" if name else ""
+        if updated_count is None:
+            logger.error(f"Плановая проверка просрочек{label} не удалась")
+        else:
+            logger.info(f"Плановая проверка просрочек{label}: обновлено статусов {updated_count}")
+
+@restricted_access
+@track_handler
+async def bulk_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подсказка, если массовую команду прислали без файла"""
+    await update.message.reply_text(
+        "Пришлите файл CSV или XLSX с командой в подписи:\n"
+        "/bulk_issue - выдать роутеры (колонки: MAC, комната, ФИО, контакты, срок)\n"
+        "/bulk_return - принять роутеры (MAC или комната)\n"
+        "/bulk_add [общежитие] - добавить роутеры (MAC)\n\n"
+        "Первая строка может быть заголовком (mac, room, name, contact, due). "
+        f"Срок - +N или YYYY-MM-DD, по умолчанию {DEFAULT_ISSUE_PERIOD} дн."
+    )
+
+@restricted_access
+@throttled
+@track_handler
+async def bulk_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Массовая выдача, возврат или добавление роутеров из файла"""
+    command, *dorm = update.message.caption.split()
+    command = command.lstrip('/').split('@')[0].lower()
+    planner = bulk.PLANNERS.get(command)
+    if planner is None:
+        await update.message.reply_text("Неизвестная команда. Используйте /bulk_issue, /bulk_return или /bulk_add.")
+        return
+    # Новые роутеры добавляются в лист общежития из подписи (его можно не указывать, если оно одно)
+    shard = sheets_helper.shard(' '.join(dorm) or None)
+    if command == 'bulk_add' and shard is None:
+        await update.message.reply_text(f"Укажите общежитие: /bulk_add <{' | '.join(sheets_helper.shards)}>")
+        return
+    if command == 'bulk_add' and await reject_offline(update, shard.name):
+        return
+
+    document = update.message.document
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
     try:
-        all_records = sheets_helper.get_all_records()
-        current_date = datetime.now().date()
-        updated_count = 0
-
-        for i, record in enumerate(all_records, start=2):
-            status = record.get('Status', '')
-            checkout_str = record.get('Checkout', '')
-
-            if status == 'Выдан' and checkout_str:
-                try:
-                    checkout_date = datetime.strptime(checkout_str, '%Y-%m-%d').date()
-                    if checkout_date < current_date:
-                        sheets_helper.update_cell(i, 4, 'Просрочен')
-                        updated_count += 1
-                except ValueError:
-                    continue
-
-        await update.message.reply_text(f"Проверка завершена. Обновлено статусов: {updated_count}.")
-    except Exception as e:
-        logger.error(f"Ошибка при обновлении статусов: {e}")
-        await update.message.reply_text("Произошла ошибка при обновлении статусов.")
+        records = bulk.read_records(document.file_name or '', data)
+    except bulk.BulkFileError as e:
+        await update.message.reply_text(f"Не удалось прочитать файл: {e}.")
+        return
+
+    # Все строки проверяются по одному снимку листа, запись - одним запросом на операцию
+    snapshot = bulk.Snapshot(await async_sheets.snapshot(), sheets_helper)
+    plan = planner(records, snapshot)
+    # Нужны только листы общежитий, в которые попадают строки файла
+    if await reject_offline(update, *sorted({sheets_helper.shard_of(row_num).name for row_num in plan.updates})):
+        return
+
+    # Под замками затронутых строк сверяемся с текущим состоянием и снимаем изменившиеся строки
+    async with row_locks.lock(*plan.locks()):
+        plan.verify(bulk.Snapshot(await async_sheets.snapshot(), sheets_helper))
+        entries = []
+        if plan.updates:
+            # Через очередь записи, как и одиночные операции: более старая запись той же строки
+            # из очереди не перезапишет изменения из файла
+            write_queue.enqueue_many(
+                plan.updates,
+                chat_id=update.effective_chat.id,
+                description=f"{OPERATION_NAMES[command]}, строк: {len(plan.updates)}",
+                macs={row_num: record.mac for row_num, record in plan.expected.items() if record.mac}
+            )
+            entries.extend(
+                audit_log.entry(command, update.effective_user, plan.expected[row_num], fields)
+                for row_num, fields in plan.updates.items()
+            )
+        if plan.appends:
+            row_nums = await async_sheets.append_routers(plan.appends, shard.name)
+            if row_nums is None:
+                plan.fail_writes("ошибка записи в таблицу")
+            else:
+                entries.extend(
+                    audit_log.entry(
+                        command, update.effective_user,
+                        fields=sheets_helper.columns_for(row_num).fields(mac=mac, status=Status.FREE),
+                        mac=mac, row_num=row_num
+                    )
+                    for mac, row_num in zip(plan.appends, row_nums)
+                )
+    await async_sheets.run_local(audit_log.add, entries)
+
+    report = bulk.render_report(plan)
+    if plan.updates:
+        report += "\nИзменения сохраняются в таблицу."
+    await update.message.reply_text(report)
+    if len(plan.report) > 30:
+        await update.message.reply_document(
+            InputFile(bulk.report_csv(plan), filename=f"{command}_report.csv")
+        )
+
+@restricted_access
+@track_handler
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Последние операции с роутером по MAC или комнате из локального журнала (без обращений к таблице)"""
+    if not context.args:
+        await update.message.reply_text("Использование: /history <MAC-адрес или номер комнаты>")
+        return
+
+    identifier = ' '.join(context.args)
+    entries = await async_sheets.run_local(audit_log.history, identifier)
+    if not entries:
+        await update.message.reply_text("Операций с этим роутером или комнатой в журнале нет.")
+        return
+
+    lines = [f"История: {identifier}"]
+    for entry in entries:
+        lines.append(
+            f"{entry['at'].replace('T', ' ')} {entry['user_name'] or '-'}: "
+            f"{OPERATION_NAMES.get(entry['operation'], entry['operation'])}, {entry['mac'] or '-'}"
+        )
+        if entry['changes']:
+            lines.append(f"  {format_changes(entry['changes'])}")
+    await update.message.reply_text('\n'.join(lines)[:4000])
+
+@restricted_access
+@track_handler
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-поиск роутера по комнате, MAC, ФИО или контактам (@бот 512)"""
+    query = update.inline_query.query.strip()
+    if not query:
+        await update.inline_query.answer([], cache_time=0, is_personal=True)
+        return
+
+    results = []
+    for row_num, row_data in await async_sheets.search(query, limit=20):
+        record = sheets_helper.record(row_num, row_data)
+        results.append(InlineQueryResultArticle(
+            id=str(row_num),
+            title=f"Комната {record.room}: {record.mac}" if record.room else record.mac,
+            description=', '.join(part for part in (record.status_text, record.owner) if part),
+            input_message_content=InputTextMessageContent(record.info()),
+        ))
+    await update.inline_query.answer(results, cache_time=5, is_personal=True)
+
+@track_handler
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подписывает владельца роутера на напоминания о сроке возврата (доступно всем)"""
+    username = update.effective_user.username
+    if not username:
+        await update.message.reply_text(
+            "Чтобы получать напоминания, задайте имя пользователя (username) в настройках Telegram "
+            "и повторите /subscribe."
+        )
+        return
+
+    await async_sheets.run_local(sheets_helper.store.set_contact, username.lower(), update.effective_chat.id)
+    await update.message.reply_text(
+        f"Готово! Напомню о сроке возврата роутера, записанного на @{username}. Отписаться: /unsubscribe"
+    )
+
+@track_handler
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отписывает от напоминаний о сроке возврата"""
+    username = update.effective_user.username
+    removed = username and await async_sheets.run_local(sheets_helper.store.delete_contact, username.lower())
+    if removed:
+        await update.message.reply_text("Напоминания отключены.")
+    else:
+        await update.message.reply_text("Вы не были подписаны на напоминания.")
+
+@admin_only
+@track_handler
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает статистику обращений к Google Таблице и времени ответа"""
+    # Доступность и синхронизация у каждого общежития своя
+    lines = []
+    for name in sheets_helper.shards:
+        synced_at = sheets_helper.synced_at(name)
+        title = "Google Таблица" if len(sheets_helper.shards) == 1 else f"Общежитие {name}"
+        lines.append(
+            f"{title}: {'доступна' if sheets_helper.is_online(name) else 'недоступна'}, "
+            f"последняя синхронизация: {synced_at.strftime('%d.%m %H:%M:%S') if synced_at else 'не было'}"
+        )
+    health = '\n'.join(lines) + f"\nСтрок в очереди записи: {len(write_queue)}"
+    await update.message.reply_text(f"{health}\n\nСтатистика с момента запуска:\n\n{metrics.render_summary()}")
 
 @restricted_access
+@track_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отменяет текущую операцию"""
     await update.message.reply_text("Операция отменена.", reply_markup=ReplyKeyboardRemove())
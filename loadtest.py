@@ -0,0 +1,357 @@
+# loadtest.py
+"""Нагрузочный прогон: несколько операторов одновременно работают с ботом.
+
+Собирает Application из bot.py (bot.build_application) с подмененным транспортом
+Bot API и поддельным листом (fake_sheets.FakeWorksheet) с задержкой на каждое
+обращение. Операторы вперемешку проходят диалоги /issue, /return, /extend
+и команду /update, как на выдаче в неделю заселения; часть выдач нарочно
+нацелена на один и тот же роутер.
+
+    python loadtest.py --operators 20 --rounds 5 --latency 0.1
+
+Выводит p50/p95/p99 задержки ответа и пропускную способность, а затем сверяет
+итоговый лист с подтвержденными операциями. Завершается с кодом 1, если запись
+потерялась, роутер выдан дважды или бот не ответил, поэтому его можно запускать в CI.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import bot
+from access_control import access_list, user_throttle
+from fake_sheets import FakeWorksheet, make_inventory
+from records import ColumnMap, Status
+from sheets import sheets_helper, async_sheets
+from validation import parse_date
+from write_queue import write_queue
+
+# Уведомления очереди записи приходят отдельными сообщениями, а не ответом на сообщение оператора
+WRITE_OK_PREFIX = "✅ Записано в таблицу"
+WRITE_FAILED_PREFIX = "❌ Не удалось записать в таблицу"
+# Ответы, которыми бот отклоняет операцию из-за чужого изменения (диалог при этом завершается)
+CONFLICT_REPLIES = ("не свободен", "уже выдан другим", "изменились")
+# Первый id оператора; операторы получают id подряд
+FIRST_USER_ID = 10_000
+
+class StubTelegram(BaseRequest):
+    """Транспорт Bot API без сети: отвечает на запросы бота и раскладывает его сообщения по чатам"""
+
+    def __init__(self):
+        # чат -> очередь (время получения, текст) ответов бота
+        self.inboxes = defaultdict(asyncio.Queue)
+        self.calls = Counter()
+        self.writes_ok = 0
+        self.writes_failed = 0
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        params = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Router bot', 'username': 'router_bot'}
+        elif endpoint == 'sendMessage':
+            result = self._deliver(int(params['chat_id']), params['text'])
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def _deliver(self, chat_id, text):
+        if text.startswith(WRITE_OK_PREFIX):
+            self.writes_ok += 1
+        elif text.startswith(WRITE_FAILED_PREFIX):
+            self.writes_failed += 1
+        else:
+            self.inboxes[chat_id].put_nowait((time.perf_counter(), text))
+        self._message_id += 1
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        }
+
+def issue_operation(mac, k):
+    due = parse_date('+14').strftime('%Y-%m-%d')
+    room, name, contact = str(5000 + k), f"Жилец {k}", f"@tenant{k}"
+    return {
+        'operation': 'issue',
+        'mac': mac,
+        # (сообщение оператора, часть ожидаемого ответа)
+        'steps': [
+            ('/issue', 'MAC-адрес'), (mac, 'номер комнаты'), (room, 'ФИО'),
+            (name, 'контакты'), (contact, 'срок выдачи'), ('+14', 'Подтвердите'), ('да', 'успешно выдан'),
+        ],
+        'fields': {'room': room, 'status': Status.ISSUED.value, 'owner': name, 'contact': contact, 'checkout': due},
+    }
+
+def return_operation(mac):
+    return {
+        'operation': 'return',
+        'mac': mac,
+        'steps': [('/return', 'для возврата'), (mac, '(да/нет)'), ('да', 'принят')],
+        'fields': {'room': '', 'status': Status.FREE.value, 'owner': '', 'contact': '', 'checkout': ''},
+    }
+
+def extend_operation(mac, days):
+    return {
+        'operation': 'extend',
+        'mac': mac,
+        'steps': [('/extend', 'для продления'), (mac, 'новый срок'), (f'+{days}', '(да/нет)'), ('да', 'продлен')],
+        'fields': {'checkout': parse_date(f'+{days}').strftime('%Y-%m-%d')},
+    }
+
+def update_operation():
+    return {'operation': 'update', 'mac': None, 'steps': [('/update', 'Проверка завершена')], 'fields': None}
+
+def plan(rows, operators, rounds, contention, seed):
+    """Сценарии операторов {id: [операция]}: в каждом раунде выдача, продление и возврат, плюс одна /update.
+
+    Роутеры у операторов разные, кроме "горячих": с вероятностью contention выдача
+    в раунде нацелена на общий для всех роутер, и выдать его должен только один оператор.
+    """
+    rnd = random.Random(seed)
+    free = [row[1] for row in rows[1:] if row[3] == Status.FREE.value]
+    issued = [row[1] for row in rows[1:] if row[3] == Status.ISSUED.value]
+    if len(free) < (operators + 1) * rounds or len(issued) < 2 * operators * rounds:
+        raise ValueError(f"в листе из {len(rows) - 1} строк не хватит роутеров, увеличьте --size")
+    rnd.shuffle(free)
+    rnd.shuffle(issued)
+
+    hot = [free.pop() for _ in range(rounds)]
+    scripts = {}
+    k = 0
+    for i in range(operators):
+        script = []
+        for r in range(rounds):
+            k += 1
+            target = hot[r] if rnd.random() < contention else free.pop()
+            batch = [issue_operation(target, k), extend_operation(issued.pop(), rnd.randint(7, 60)),
+                     return_operation(issued.pop())]
+            rnd.shuffle(batch)
+            script += batch
+        script.insert(rnd.randrange(len(script) + 1), update_operation())
+        scripts[FIRST_USER_ID + i] = script
+    return scripts
+
+class Operator:
+    """Оператор: отправляет сообщения диалогов по одному и ждет ответа бота на каждое"""
+
+    def __init__(self, user_id, application, telegram, think, timeout, seed):
+        self.user_id = user_id
+        self.application = application
+        self.telegram = telegram
+        self.think = think
+        self.timeout = timeout
+        self.rnd = random.Random(seed)
+        # операция -> задержки ответов, с
+        self.latencies = defaultdict(list)
+        # [{'operation', 'mac', 'result', 'fields', 'at'}]
+        self.outcomes = []
+        self._update_id = 0
+
+    def _update(self, text):
+        self._update_id += 1
+        message = {
+            'message_id': self._update_id,
+            'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': {'id': self.user_id, 'is_bot': False, 'first_name': f"Оператор {self.user_id}",
+                     'username': f"operator{self.user_id}"},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return Update.de_json({'update_id': self.user_id * 10_000 + self._update_id, 'message': message},
+                              self.application.bot)
+
+    async def send(self, text):
+        """Отправляет сообщение; (задержка, ответ) или None, если бот не ответил за timeout"""
+        sent_at = time.perf_counter()
+        await self.application.update_queue.put(self._update(text))
+        try:
+            received_at, reply = await asyncio.wait_for(self.telegram.inboxes[self.user_id].get(), self.timeout)
+        except asyncio.TimeoutError:
+            return None
+        return received_at - sent_at, reply
+
+    async def pause(self):
+        await asyncio.sleep(self.think * self.rnd.uniform(0.5, 1.5))
+
+    async def perform(self, operation):
+        """Проходит шаги операции; результат - ok, conflict, failed или timeout"""
+        for text, expected in operation['steps']:
+            answer = await self.send(text)
+            if answer is None:
+                return 'timeout'
+            latency, reply = answer
+            self.latencies[operation['operation']].append(latency)
+            if expected not in reply:
+                if any(marker in reply for marker in CONFLICT_REPLIES):
+                    return 'conflict'
+                # Неожиданный ответ: выходим из диалога, чтобы он не перехватил следующие операции
+                await self.send('/cancel')
+                return 'failed'
+            await self.pause()
+        return 'ok'
+
+    async def run(self, script):
+        await asyncio.sleep(self.think * self.rnd.random())
+        for operation in script:
+            result = await self.perform(operation)
+            self.outcomes.append({**operation, 'result': result, 'at': time.perf_counter()})
+            # Без ответа дальше идти нельзя: следующий ответ может оказаться запоздавшим ответом на этот шаг
+            if result == 'timeout':
+                break
+
+def verify(sheet, outcomes):
+    """Сверяет итоговый лист с подтвержденными операциями: (потеряно записей, выдано дважды)"""
+    columns = ColumnMap.from_header(sheet.rows[0])
+    by_mac = {columns.text(row, 'mac'): row for row in sheet.rows[1:]}
+    confirmed = sorted((o for o in outcomes if o['result'] == 'ok' and o['fields']), key=lambda o: o['at'])
+
+    # Каждая ячейка должна хранить значение последней подтвержденной операции
+    expected = {}
+    issues = Counter()
+    for outcome in confirmed:
+        for field, value in outcome['fields'].items():
+            expected[(outcome['mac'], field)] = (value, id(outcome))
+        if outcome['operation'] == 'issue':
+            issues[outcome['mac']] += 1
+        elif outcome['operation'] == 'return':
+            issues[outcome['mac']] = 0
+
+    lost = {
+        outcome_id
+        for (mac, field), (value, outcome_id) in expected.items()
+        if columns.text(by_mac.get(mac, []), field) != value
+    }
+    doubled = sum(count - 1 for count in issues.values() if count > 1)
+    return len(lost), doubled
+
+def percentile(values, q):
+    """q-й процентиль (0-100) по ближайшему рангу"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+async def run(args):
+    rows = make_inventory(args.size, seed=args.seed)
+    scripts = plan(rows, args.operators, args.rounds, args.contention, args.seed)
+    sheet = FakeWorksheet(rows, latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    sheets_helper.attach_worksheet(sheet)
+
+    # Прогон не должен писать файл очереди и подменять операторов настоящим списком доступа
+    write_queue.path = None
+    access_list.path = access_list.sheet_title = None
+    access_list.user_ids = frozenset(scripts)
+    if not args.throttle:
+        user_throttle.rate = user_throttle.burst = 1e9
+    # Напоминания пришли бы в чаты операторов вперемешку с ответами
+    bot.REMINDERS_ENABLED = False
+
+    telegram = StubTelegram()
+    application = bot.build_application(token='0:LOADTEST', request=telegram)
+    await application.initialize()
+    await bot.post_init(application)
+    # Локальная база прогрета до прихода операторов, как у давно запущенного бота
+    await async_sheets.refresh_cache()
+    await application.start()
+
+    operators = [
+        Operator(user_id, application, telegram, args.think, args.timeout, args.seed + user_id)
+        for user_id in scripts
+    ]
+    sheet.reset_stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(operator.run(scripts[operator.user_id]) for operator in operators))
+    elapsed = time.perf_counter() - started
+
+    # post_stop дописывает очередь записи, после этого лист можно сверять
+    await application.stop()
+    await bot.post_stop(application)
+    await application.shutdown()
+    return sheet, telegram, operators, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operators', type=int, default=15, help="число одновременно работающих операторов")
+    parser.add_argument('--rounds', type=int, default=5, help="раундов выдача/продление/возврат на оператора")
+    parser.add_argument('--size', type=int, default=2000, help="строк в листе")
+    parser.add_argument('--latency', type=float, default=0.05, help="задержка одного обращения к таблице, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля обращений, отвечающих 429")
+    parser.add_argument('--think', type=float, default=0.2, help="пауза оператора между сообщениями, с")
+    parser.add_argument('--contention', type=float, default=0.2, help="доля выдач одного общего роутера")
+    parser.add_argument('--timeout', type=float, default=30.0, help="сколько ждать ответа бота, с")
+    parser.add_argument('--throttle', action='store_true', help="не снимать ограничение команд пользователя")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # Журнал каждой записи из очереди заслонил бы отчет
+    logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        sheet, telegram, operators, elapsed = asyncio.run(run(args))
+    except ValueError as e:
+        parser.error(str(e))
+
+    latencies = defaultdict(list)
+    outcomes = []
+    for operator in operators:
+        for operation, values in operator.latencies.items():
+            latencies[operation] += values
+        outcomes += operator.outcomes
+    latencies['all'] = [value for values in list(latencies.values()) for value in values]
+
+    print(f"{'operation':<10} {'replies':>7} {'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9}")
+    for operation in ('issue', 'extend', 'return', 'update', 'all'):
+        values = latencies.get(operation)
+        if values:
+            print(
+                f"{operation:<10} {len(values):>7} {percentile(values, 50) * 1000:>9.1f} "
+                f"{percentile(values, 95) * 1000:>9.1f} {percentile(values, 99) * 1000:>9.1f}"
+            )
+
+    results = Counter(outcome['result'] for outcome in outcomes)
+    lost, doubled = verify(sheet, outcomes)
+    print()
+    print(f"operators: {len(operators)}, time: {elapsed:.1f} s, sheets calls: {sheet.total_calls}")
+    print(f"throughput: {len(latencies['all']) / elapsed:.1f} replies/s, {len(outcomes) / elapsed:.2f} operations/s")
+    print(
+        f"operations: ok {results['ok']}, conflict {results['conflict']}, "
+        f"failed {results['failed']}, timeout {results['timeout']}"
+    )
+    print(f"write notices: ok {telegram.writes_ok}, failed {telegram.writes_failed}")
+    print(f"lost writes: {lost}, double issues: {doubled}")
+
+    problems = []
+    if lost:
+        problems.append(f"ПОТЕРЯНЫ ЗАПИСИ: {lost} подтвержденных операций не дошли до таблицы")
+    if doubled:
+        problems.append(f"КОНФЛИКТ ЗАПИСЕЙ: роутер выдан дважды ({doubled})")
+    if results['timeout']:
+        problems.append(f"НЕТ ОТВЕТА: {results['timeout']} операций остались без ответа бота")
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+# local_store.py
+import json
+import sqlite3
+import threading
+
+import config
+from records import SHARD_ROWS, ColumnMap, RouterRecord, shard_range
+
+# Файл локальной базы (":memory:" - без сохранения на диск)
+LOCAL_DB_FILE = getattr(config, 'LOCAL_DB_FILE', 'routers.db')
+# Сколько байт базы читать через отображение в память (0 - обычное чтение)
+LOCAL_DB_MMAP_SIZE = getattr(config, 'LOCAL_DB_MMAP_SIZE', 64 * 1024 * 1024)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS routers (
+    row_num INTEGER PRIMARY KEY,
+    mac_key,
+    room TEXT,
+    status TEXT,
+    checkout TEXT,
+    cells TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS routers_mac ON routers (mac_key);
+CREATE INDEX IF NOT EXISTS routers_room ON routers (room);
+CREATE INDEX IF NOT EXISTS routers_status_checkout ON routers (status, checkout);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS contacts (
+    handle TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reminders_sent (
+    row_num INTEGER NOT NULL,
+    checkout TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    sent_at TEXT NOT NULL,
+    PRIMARY KEY (row_num, checkout, kind)
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    at TEXT NOT NULL,
+    user_id INTEGER,
+    user_name TEXT,
+    operation TEXT NOT NULL,
+    row_num INTEGER,
+    mac_key,
+    mac TEXT,
+    room TEXT,
+    changes TEXT NOT NULL,
+    exported INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS history_mac ON history (mac_key, id);
+CREATE INDEX IF NOT EXISTS history_room ON history (room, id);
+CREATE INDEX IF NOT EXISTS history_pending ON history (id) WHERE exported = 0;
+"""
+
+# Колонки журнала операций в порядке выдачи
+HISTORY_FIELDS = ('id', 'at', 'user_id', 'user_name', 'operation', 'row_num', 'mac', 'room', 'changes')
+
+def _in_shard(shard):
+    """Условие SQL на ключ строки: строки общежития shard (None - все общежития)"""
+    if shard is None:
+        return "1", ()
+    return "row_num BETWEEN ? AND ?", shard_range(shard * SHARD_ROWS)
+
+class LocalStore:
+    """Локальная копия листа с роутерами в SQLite с индексами по MAC, комнате, статусу и сроку"""
+
+    def __init__(self, key_func, path=LOCAL_DB_FILE):
+        # key_func приводит MAC к ключу индекса (см. sheets.normalize_mac)
+        self.key_func = key_func
+        self.path = path
+        # Растет при каждом изменении строк, чтобы производные индексы знали, когда перестраиваться
+        self.version = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Снимок с прошлого запуска читается через mmap, без копирования страниц в кэш SQLite
+        self._conn.execute(f"PRAGMA mmap_size={int(LOCAL_DB_MMAP_SIZE)}")
+        self._conn.executescript(SCHEMA)
+        # Колонки полей каждого общежития по заголовку (первой строке листа) снимка с прошлого запуска
+        self._columns = {}
+        headers = self._conn.execute("SELECT row_num, cells FROM routers WHERE row_num % ? = 1", (SHARD_ROWS,))
+        for row_key, cells in headers.fetchall():
+            self._columns[row_key // SHARD_ROWS] = ColumnMap.from_header(json.loads(cells))
+
+    def columns_for(self, row_key):
+        """Колонки полей листа, которому принадлежит строка"""
+        shard = row_key // SHARD_ROWS
+        columns = self._columns.get(shard)
+        if columns is None:
+            columns = self._columns[shard] = ColumnMap()
+        return columns
+
+    def _record(self, row_num, row):
+        columns = self.columns_for(row_num)
+        mac = columns.text(row, 'mac')
+        return (
+            row_num,
+            self.key_func(mac) if mac else None,
+            columns.text(row, 'room') or None,
+            columns.text(row, 'status'),
+            columns.text(row, 'checkout'),
+            json.dumps(row, ensure_ascii=False),
+        )
+
+    def replace_all(self, rows, columns=None, shard=0):
+        """Заменяет строки общежития shard снимком его листа ({строка: значения}), при необходимости с новыми колонками"""
+        with self._lock, self._conn:
+            if columns is not None:
+                self._columns[shard] = columns
+            records = [self._record(row_num, row) for row_num, row in rows.items()]
+            self._conn.execute("DELETE FROM routers WHERE row_num BETWEEN ? AND ?", shard_range(shard * SHARD_ROWS))
+            self._conn.executemany("INSERT INTO routers VALUES (?, ?, ?, ?, ?, ?)", records)
+            self.version += 1
+
+    def replace_ranges(self, ranges, rows, last_row):
+        """Заменяет строки в диапазонах [(первая, последняя)] и удаляет строки того же листа после last_row"""
+        records = [self._record(row_num, row) for row_num, row in rows.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM routers WHERE row_num BETWEEN ? AND ?", ranges)
+            self._conn.execute(
+                "DELETE FROM routers WHERE row_num > ? AND row_num <= ?", (last_row, shard_range(last_row)[1])
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO routers VALUES (?, ?, ?, ?, ?, ?)", records)
+            self.version += 1
+
+    def upsert_rows(self, rows):
+        """Записывает или заменяет отдельные строки ({строка: значения})"""
+        records = [self._record(row_num, row) for row_num, row in rows.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO routers VALUES (?, ?, ?, ?, ?, ?)", records)
+            self.version += 1
+
+    def _fetch_one(self, query, params):
+        with self._lock:
+            found = self._conn.execute(query, params).fetchone()
+        if found is None:
+            return None, None
+        return found[0], json.loads(found[1])
+
+    def get_row(self, row_num):
+        """Значения строки или None"""
+        _, row = self._fetch_one("SELECT row_num, cells FROM routers WHERE row_num = ?", (row_num,))
+        return row
+
+    def find_by_mac(self, mac_address):
+        """(номер строки, значения) первой строки с этим MAC"""
+        return self._fetch_one(
+            "SELECT row_num, cells FROM routers WHERE mac_key = ? ORDER BY row_num LIMIT 1",
+            (self.key_func(mac_address),)
+        )
+
+    def find_by_room(self, room_number, shard=None):
+        """(номер строки, значения) первой строки с этой комнатой (в общежитии shard или во всех)"""
+        where, params = _in_shard(shard)
+        return self._fetch_one(
+            f"SELECT row_num, cells FROM routers WHERE room = ? AND {where} ORDER BY row_num LIMIT 1",
+            (room_number.strip(), *params)
+        )
+
+    def rows_with_status_before(self, status, checkout_before, shard=None):
+        """Номера строк с заданным статусом (Status) и датой возврата (YYYY-MM-DD) раньше указанной"""
+        where, params = _in_shard(shard)
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT row_num FROM routers WHERE status = ? AND checkout < ? "
+                f"AND checkout GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' AND {where} ORDER BY row_num",
+                (status.value, checkout_before, *params)
+            ).fetchall()
+        return [row_num for (row_num,) in found]
+
+    def records_with_status(self, statuses):
+        """RouterRecord строк с одним из статусов (Status)"""
+        placeholders = ', '.join('?' * len(statuses))
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT row_num, cells FROM routers WHERE status IN ({placeholders}) ORDER BY row_num",
+                tuple(status.value for status in statuses)
+            ).fetchall()
+        return [RouterRecord(row_num, json.loads(cells), self.columns_for(row_num)) for row_num, cells in found]
+
+    def all_rows(self):
+        """Все строки {строка: значения} по порядку"""
+        return self.all_rows_versioned()[1]
+
+    def all_rows_versioned(self):
+        """(версия, все строки) одним чтением под блокировкой"""
+        with self._lock:
+            version = self.version
+            found = self._conn.execute("SELECT row_num, cells FROM routers ORDER BY row_num").fetchall()
+        return version, {row_num: json.loads(cells) for row_num, cells in found}
+
+    def row_count(self, shard=0):
+        """Номер последней строки листа общежития shard (0, если его строк нет)"""
+        first, last = shard_range(shard * SHARD_ROWS)
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT MAX(row_num) FROM routers WHERE row_num BETWEEN ? AND ?", (first, last)
+            ).fetchone()[0]
+        return found - first if found is not None else 0
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            found = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return found[0] if found else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def set_contact(self, handle, chat_id):
+        """Запоминает чат пользователя Telegram по его @username (без @, в нижнем регистре)"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO contacts VALUES (?, ?)", (handle, chat_id))
+
+    def delete_contact(self, handle):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM contacts WHERE handle = ?", (handle,)).rowcount > 0
+
+    def get_contacts(self):
+        """{username: чат} всех подписавшихся"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT handle, chat_id FROM contacts").fetchall())
+
+    def mark_reminded(self, keys, sent_at):
+        """Отмечает отправленные напоминания [(строка, дата возврата, вид)]"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO reminders_sent VALUES (?, ?, ?, ?)",
+                [(row_num, checkout, kind, sent_at) for row_num, checkout, kind in keys]
+            )
+
+    def reminded_keys(self):
+        """Множество уже отправленных напоминаний (строка, дата возврата, вид)"""
+        with self._lock:
+            return set(self._conn.execute("SELECT row_num, checkout, kind FROM reminders_sent").fetchall())
+
+    def add_history(self, entries):
+        """Дописывает операции в журнал: [{'at', 'user_id', 'user_name', 'operation', 'row_num', 'mac', 'room', 'changes'}]"""
+        records = [
+            (
+                entry['at'], entry['user_id'], entry['user_name'], entry['operation'], entry['row_num'],
+                self.key_func(entry['mac']) if entry['mac'] else None, entry['mac'], entry['room'] or None,
+                json.dumps(entry['changes'], ensure_ascii=False),
+            )
+            for entry in entries
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO history (at, user_id, user_name, operation, row_num, mac_key, mac, room, changes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+
+    def _history(self, where, params, limit, order='DESC'):
+        columns = ', '.join(HISTORY_FIELDS)
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT {columns} FROM history WHERE {where} ORDER BY id {order} LIMIT ?", (*params, limit)
+            ).fetchall()
+        entries = [dict(zip(HISTORY_FIELDS, values)) for values in found]
+        for entry in entries:
+            entry['changes'] = json.loads(entry['changes'])
+        return entries
+
+    def history_for_mac(self, mac_address, limit=20):
+        """Последние операции с роутером по MAC (новые первыми)"""
+        return self._history("mac_key = ?", (self.key_func(mac_address),), limit)
+
+    def history_for_room(self, room_number, limit=20, shard=None):
+        """Последние операции, в которых участвовала комната (новые первыми)"""
+        where, params = _in_shard(shard)
+        return self._history(f"room = ? AND {where}", (room_number.strip(), *params), limit)
+
+    def unexported_history(self, limit):
+        """Самые старые операции, еще не выгруженные в таблицу"""
+        return self._history("exported = 0", (), limit, order='ASC')
+
+    def mark_history_exported(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE history SET exported = 1 WHERE id = ?", [(i,) for i in ids])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
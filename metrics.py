@@ -0,0 +1,206 @@
+# metrics.py
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, в секундах
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Обработчик, из которого идет текущее обращение (переносится и в потоки пула Sheets)
+current_handler = contextvars.ContextVar('current_handler', default='background')
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+class MetricsRegistry:
+    """Счетчики и гистограммы задержек по метрике и набору меток"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (метрика, метки) -> Histogram
+        self._latency = {}
+        # (метрика, метки, тип ошибки) -> число
+        self._errors = Counter()
+
+    def observe(self, metric, labels, seconds, error=None):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = Histogram()
+            histogram.observe(seconds)
+            if error is not None:
+                self._errors[key + (type(error).__name__,)] += 1
+
+    @contextmanager
+    def timed(self, metric, **labels):
+        """Замеряет время блока и записывает ошибку, если блок упал"""
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.observe(metric, labels, time.perf_counter() - started, error)
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._errors.clear()
+
+    def _snapshot(self):
+        with self._lock:
+            latency = {key: (list(h.buckets), h.count, h.total, h) for key, h in self._latency.items()}
+            errors = dict(self._errors)
+        return latency, errors
+
+    def render_prometheus(self, prefix='router_bot'):
+        """Текстовый формат Prometheus"""
+        latency, errors = self._snapshot()
+        lines = []
+        for metric in sorted({key[0] for key in latency}):
+            name = f"{prefix}_{metric}_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            for (key_metric, labels), (buckets, count, total, _) in sorted(latency.items()):
+                if key_metric != metric:
+                    continue
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else bound
+                    sep = ',' if label_text else ''
+                    lines.append(f'{name}_bucket{{{label_text}{sep}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{label_text}}} {total:.6f}")
+                lines.append(f"{name}_count{{{label_text}}} {count}")
+        if errors:
+            lines.append(f"# TYPE {prefix}_errors_total counter")
+            for (metric, labels, error_type), count in sorted(errors.items()):
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels + (('metric', metric), ('error', error_type)))
+                lines.append(f"{prefix}_errors_total{{{label_text}}} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def render_summary(self, metrics=('sheets_api', 'handler', 'operation', 'conversation')):
+        """Краткая сводка для команды /stats"""
+        latency, errors = self._snapshot()
+        error_counts = Counter()
+        for (metric, labels, _), count in errors.items():
+            error_counts[(metric, labels)] += count
+
+        sections = []
+        for metric in metrics:
+            entries = sorted(
+                ((key, value) for key, value in latency.items() if key[0] == metric),
+                key=lambda item: -item[1][1]
+            )
+            if not entries:
+                continue
+            lines = [f"{metric}:"]
+            for key, (_, count, total, histogram) in entries[:10]:
+                label_text = ' '.join(v for _, v in key[1]) or '-'
+                line = (
+                    f"  {label_text}: {count} шт., ср. {total / count * 1000:.0f} мс, "
+                    f"p95 ≤ {histogram.quantile(0.95) * 1000:.0f} мс"
+                )
+                if error_counts[key]:
+                    line += f", ошибок {error_counts[key]}"
+                lines.append(line)
+            sections.append('\n'.join(lines))
+        return '\n\n'.join(sections) or "Пока нет данных."
+
+# Глобальный реестр для использования в других модулях
+metrics = MetricsRegistry()
+
+def track_handler(func):
+    """Замеряет обработчик целиком и помечает его именем все обращения к Sheets внутри"""
+    @functools.wraps(func)
+    async def wrapped(update, context, *args, **kwargs):
+        token = current_handler.set(func.__name__)
+        try:
+            with metrics.timed('handler', handler=func.__name__):
+                return await func(update, context, *args, **kwargs)
+        finally:
+            current_handler.reset(token)
+    return wrapped
+
+def instrumented(metric):
+    """Декоратор для синхронных методов: число вызовов, задержка и ошибки с меткой обработчика"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            with metrics.timed(metric, method=func.__name__, handler=current_handler.get()):
+                return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+class InstrumentedWorksheet:
+    """Обертка над листом gspread: каждое обращение к API попадает в метрику sheets_api"""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with metrics.timed('sheets_api', method=name, handler=current_handler.get()):
+                return attr(*args, **kwargs)
+        return call
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port, host='127.0.0.1'):
+    """Запускает отдачу метрик в формате Prometheus в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
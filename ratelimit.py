@@ -0,0 +1,35 @@
+# ratelimit.py
+import asyncio
+import time
+
+class TokenBucket:
+    """Token bucket: пополняется на rate токенов в секунду, хранит не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Забирает токены, если они есть; иначе возвращает False"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        """Сколько секунд ждать, пока накопится нужное число токенов"""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens=1):
+        """Ждет, пока токены станут доступны, и забирает их"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
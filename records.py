@@ -0,0 +1,170 @@
+# records.py
+import logging
+from datetime import date
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+class Status(str, Enum):
+    """Статус роутера в колонке Status"""
+    FREE = 'Свободен'
+    ISSUED = 'Выдан'
+    OVERDUE = 'Просрочен'
+
+    @classmethod
+    def parse(cls, text):
+        """Статус по тексту ячейки (None для пустого или неизвестного)"""
+        return _STATUS_BY_TEXT.get(text.strip())
+
+_STATUS_BY_TEXT = {status.value: status for status in Status}
+
+# Роутер на руках у владельца
+ISSUED_STATUSES = (Status.ISSUED, Status.OVERDUE)
+
+# Поля строки и их колонки (номера с 1), если заголовок листа не распознан
+FIELDS = ('number', 'mac', 'room', 'status', 'model', 'owner', 'checkin', 'checkout', 'contact', 'comment')
+DEFAULT_COLUMNS = {field: col_num for col_num, field in enumerate(FIELDS, 1)}
+# Названия колонок в заголовке листа (в нижнем регистре)
+HEADER_ALIASES = {
+    'number': {'№', '#', 'no', 'номер'},
+    'mac': {'mac', 'mac-адрес', 'mac адрес'},
+    'room': {'room', 'комната'},
+    'status': {'status', 'статус'},
+    'model': {'model', 'модель'},
+    'owner': {'owner', 'владелец', 'фио'},
+    'checkin': {'checkin', 'дата выдачи'},
+    'checkout': {'checkout', 'вернуть до', 'дата возврата'},
+    'contact': {'contact', 'contacts', 'контакт', 'контакты'},
+    'comment': {'comment', 'комментарий'},
+}
+
+# Ключ строки в локальной базе: номер общежития * SHARD_ROWS + номер строки в его листе
+# (в таблице Google не больше 10 млн ячеек, так что строки разных листов не пересекаются)
+SHARD_ROWS = 10_000_000
+
+def shard_range(row_key):
+    """(первый, последний) ключи строк общежития, которому принадлежит ключ"""
+    first = row_key // SHARD_ROWS * SHARD_ROWS
+    return first, first + SHARD_ROWS - 1
+
+def is_header_row(row_key):
+    """Первая строка листа - заголовок"""
+    return row_key % SHARD_ROWS == 1
+
+def _cell(row, col_num):
+    return row[col_num - 1].strip() if len(row) >= col_num else ''
+
+def _parse_date(text):
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        return None
+
+class ColumnMap:
+    """Номера колонок полей строки; определяется один раз по заголовку листа"""
+
+    __slots__ = FIELDS
+
+    def __init__(self, columns=None):
+        for field, col_num in (columns or DEFAULT_COLUMNS).items():
+            setattr(self, field, col_num)
+
+    @classmethod
+    def from_header(cls, header):
+        """Колонки по строке заголовка; без колонок MAC и Status - раскладка по умолчанию"""
+        found = {}
+        for col_num, title in enumerate(header or [], 1):
+            title = title.strip().lower()
+            for field, aliases in HEADER_ALIASES.items():
+                if title in aliases:
+                    found.setdefault(field, col_num)
+        if 'mac' not in found or 'status' not in found:
+            if header:
+                logger.warning("В заголовке листа нет колонок MAC и Status, используется раскладка по умолчанию")
+            return cls()
+
+        # Нераспознанные поля остаются на местах по умолчанию, если те не заняты
+        taken = set(found.values())
+        for field, col_num in DEFAULT_COLUMNS.items():
+            if field not in found and col_num not in taken:
+                found[field] = col_num
+                taken.add(col_num)
+        return cls(found)
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnMap) and self.as_dict() == other.as_dict()
+
+    def as_dict(self):
+        return {field: getattr(self, field, None) for field in FIELDS}
+
+    def text(self, row, field):
+        """Текст ячейки поля в строке (пустая строка, если колонки нет)"""
+        col_num = getattr(self, field, None)
+        return _cell(row, col_num) if col_num else ''
+
+    def fields(self, **values):
+        """{колонка: значение} для записи по именам полей"""
+        return {
+            getattr(self, field): value.value if isinstance(value, Status) else value
+            for field, value in values.items()
+            if getattr(self, field, None)
+        }
+
+    def row(self, **values):
+        """Новая строка листа со значениями полей"""
+        fields = self.fields(**values)
+        row = [''] * max(fields, default=0)
+        for col_num, value in fields.items():
+            row[col_num - 1] = value
+        return row
+
+class RouterRecord:
+    """Строка листа с роутером: поля разобраны один раз, даты - date, статус - Status"""
+
+    __slots__ = (
+        'row_num', 'cells', 'columns', 'dorm', 'mac', 'room', 'status', 'status_text',
+        'owner', 'checkin', 'checkout', 'contact', 'comment',
+    )
+
+    def __init__(self, row_num, cells, columns, dorm=''):
+        self.row_num = row_num
+        # Исходные значения нужны для отпечатка строки (compare-and-set) и показа дат как в таблице
+        self.cells = cells
+        self.columns = columns
+        # Название общежития, если их несколько
+        self.dorm = dorm
+        self.mac = columns.text(cells, 'mac')
+        self.room = columns.text(cells, 'room')
+        self.status_text = columns.text(cells, 'status')
+        self.status = Status.parse(self.status_text)
+        self.owner = columns.text(cells, 'owner')
+        self.checkin = _parse_date(columns.text(cells, 'checkin'))
+        self.checkout = _parse_date(columns.text(cells, 'checkout'))
+        self.contact = columns.text(cells, 'contact')
+        self.comment = columns.text(cells, 'comment')
+
+    @property
+    def is_free(self):
+        return self.status is Status.FREE
+
+    @property
+    def is_issued(self):
+        return self.status in ISSUED_STATUSES
+
+    def info(self):
+        """Информация о роутере для сообщения оператору"""
+        # Даты показываем так, как они записаны в таблице, даже если их не удалось разобрать
+        checkin = self.columns.text(self.cells, 'checkin')
+        checkout = self.columns.text(self.cells, 'checkout')
+        dorm = f"Общежитие: {self.dorm}\n" if self.dorm else ""
+        return (
+            f"{dorm}"
+            f"MAC: {self.mac}\n"
+            f"Комната: {self.room}\n"
+            f"Статус: {self.status_text}\n"
+            f"Владелец: {self.owner}\n"
+            f"Контакты: {self.contact}\n"
+            f"Комментарий: {self.comment}\n"
+            f"Дата выдачи: {checkin}\n"
+            f"Вернуть до: {checkout}"
+        )
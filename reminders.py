@@ -0,0 +1,170 @@
+# reminders.py
+import asyncio
+import heapq
+import logging
+import re
+from datetime import datetime, time, timedelta
+
+import config
+from broadcaster import Broadcaster
+from metrics import current_handler
+from records import ISSUED_STATUSES
+from sheets import sheets_helper, async_sheets
+
+logger = logging.getLogger(__name__)
+
+# За сколько дней до срока напомнить владельцу и в котором часу рассылать
+REMINDER_DAYS_BEFORE = getattr(config, 'REMINDER_DAYS_BEFORE', 1)
+REMINDER_HOUR = getattr(config, 'REMINDER_HOUR', 10)
+# Напоминания, опоздавшие больше чем на столько (бот был выключен), не отправляются
+REMINDER_GRACE = timedelta(days=getattr(config, 'REMINDER_GRACE_DAYS', 2))
+# Чаты операторов для сводки о просрочках (по умолчанию - администраторы)
+REMINDER_CHAT_IDS = getattr(config, 'REMINDER_CHAT_IDS', getattr(config, 'ADMIN_USER_IDS', []))
+# Как часто проверять, не изменилась ли локальная база, если ближайший срок еще не скоро
+RECHECK_INTERVAL = getattr(config, 'REMINDER_RECHECK_INTERVAL', 300)
+# Через сколько повторить напоминание, которое не удалось доставить (в пределах REMINDER_GRACE)
+RETRY_DELAY = timedelta(minutes=getattr(config, 'REMINDER_RETRY_MINUTES', 15))
+
+# Вид напоминания -> смещение от срока возврата в днях
+OFFSETS = {'soon': -REMINDER_DAYS_BEFORE, 'overdue': 1}
+
+# Контакт вида @username или t.me/username
+TELEGRAM_HANDLE_RE = re.compile(r"^(?:@|(?:https?://)?t\.me/)([A-Za-z0-9_]{5,32})$")
+
+def telegram_handle(contact):
+    """username без @ в нижнем регистре, если контакт - Telegram, иначе None"""
+    match = TELEGRAM_HANDLE_RE.match(contact.strip())
+    return match.group(1).lower() if match else None
+
+class ReminderScheduler:
+    """Напоминания о сроке возврата: владельцу - накануне и после срока, операторам - сводка о просрочках.
+
+    Сроки лежат в min-куче (когда, строка, вид, ...), поэтому задача просыпается к ближайшему
+    сроку, а не перебирает лист. Куча перестраивается по локальной базе, когда та меняется.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._heap = []
+        self._version = None
+        # (строка, срок, вид) -> время следующей попытки для недоставленных напоминаний
+        self._retry = {}
+
+    @staticmethod
+    def _scheduled(checkout, kind):
+        """Когда напоминание положено отправить по сроку возврата"""
+        return datetime.combine(checkout + timedelta(days=OFFSETS[kind]), time(REMINDER_HOUR))
+
+    def _rebuild(self):
+        """Строит кучу по выданным роутерам, пропуская уже отправленные напоминания"""
+        version = self.store.version
+        sent = self.store.reminded_keys()
+        heap = []
+        for record in self.store.records_with_status(ISSUED_STATUSES):
+            # Дата возврата уже разобрана в RouterRecord; строки без нее пропускаем
+            if record.checkout is None:
+                continue
+            checkout = record.checkout.isoformat()
+            for kind in OFFSETS:
+                key = (record.row_num, checkout, kind)
+                if key in sent:
+                    continue
+                when = self._retry.get(key) or self._scheduled(record.checkout, kind)
+                heap.append((when, record.row_num, kind, checkout, record))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._version = version
+
+    def pop_due(self, now):
+        """Снимает с кучи наступившие напоминания; устаревшие отмечаются без отправки.
+
+        Остальные отмечаются в settle, когда станет известно, дошли ли они.
+        """
+        due, stale = [], []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            _, _, kind, _, record = item
+            (stale if now - self._scheduled(record.checkout, kind) > REMINDER_GRACE else due).append(item)
+        self._mark(stale, now)
+        return due
+
+    def settle(self, items, messages, results, now):
+        """Отмечает доставленные напоминания, недоставленные владельцу ставит на повтор через RETRY_DELAY"""
+        failed = {id(item) for (_, _, item), ok in zip(messages, results) if item is not None and not ok}
+        self._mark([item for item in items if id(item) not in failed], now)
+        for item in items:
+            if id(item) in failed:
+                when = now + RETRY_DELAY
+                self._retry[item[1], item[3], item[2]] = when
+                heapq.heappush(self._heap, (when, *item[1:]))
+
+    def _mark(self, items, now):
+        keys = [(row_num, checkout, kind) for _, row_num, kind, checkout, _ in items]
+        if keys:
+            self.store.mark_reminded(keys, now.isoformat(timespec='seconds'))
+        for key in keys:
+            self._retry.pop(key, None)
+
+    def next_wakeup(self, now):
+        """Сколько секунд спать до ближайшего срока (не дольше RECHECK_INTERVAL)"""
+        if not self._heap:
+            return RECHECK_INTERVAL
+        return min(RECHECK_INTERVAL, max(1.0, (self._heap[0][0] - now).total_seconds()))
+
+    def build_messages(self, items, contacts):
+        """[(чат, текст, напоминание)] для владельцев с известным чатом и сводка для операторов.
+
+        У сводки напоминания нет (None): ее недоставка не повторяет напоминания владельцам.
+        """
+        messages = []
+        overdue_lines = []
+        for item in items:
+            _, row_num, kind, checkout, record = item
+            mac, room, owner, contact = record.mac, record.room, record.owner, record.contact
+            handle = telegram_handle(contact)
+            chat_id = contacts.get(handle) if handle else None
+            if kind == 'soon':
+                text = f"Напоминание: роутер (MAC {mac}, комната {room or '-'}) нужно вернуть до {checkout}."
+            else:
+                text = f"Срок возврата роутера (MAC {mac}, комната {room or '-'}) истек {checkout}. Пожалуйста, верните его или продлите срок."
+                # При повторе владельцу операторы сводку уже получили
+                if (row_num, checkout, kind) not in self._retry:
+                    overdue_lines.append(f"• комната {room or '-'}, {mac}, {owner or '-'}, {contact or '-'}, срок {checkout}")
+            if chat_id:
+                messages.append((chat_id, text, item))
+
+        if overdue_lines:
+            # Сводку режем на части, чтобы не упереться в лимит длины сообщения
+            chunks, chunk = [], "Просрочены роутеры:"
+            for line in overdue_lines:
+                if len(chunk) + len(line) + 1 > 4000:
+                    chunks.append(chunk)
+                    chunk = ""
+                chunk = f"{chunk}\n{line}" if chunk else line
+            chunks.append(chunk)
+            messages.extend((chat_id, text, None) for chat_id in REMINDER_CHAT_IDS for text in chunks)
+        return messages
+
+    async def run(self, bot):
+        """Фоновая задача: просыпается к ближайшему сроку и рассылает напоминания"""
+        current_handler.set('reminders')
+        broadcaster = Broadcaster(bot)
+        while True:
+            try:
+                if self._version != self.store.version:
+                    await async_sheets.run_local(self._rebuild)
+                now = datetime.now()
+                items = self.pop_due(now)
+                if items:
+                    messages = self.build_messages(items, self.store.get_contacts())
+                    results = await broadcaster.send_each([(chat_id, text) for chat_id, text, _ in messages])
+                    self.settle(items, messages, results, datetime.now())
+                    logger.info(f"Напоминаний к сроку: {len(items)}, отправлено сообщений: {sum(results)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка при рассылке напоминаний: {e}")
+            await asyncio.sleep(self.next_wakeup(datetime.now()))
+
+# Глобальный экземпляр для использования в других модулях
+reminders = ReminderScheduler(sheets_helper.store)
@@ -0,0 +1,44 @@
+# row_locks.py
+import asyncio
+from contextlib import asynccontextmanager
+
+# Ключ замка для добавления строк: два /add одного MAC не должны пройти оба
+APPEND_LOCK = 'append'
+
+class RowLockManager:
+    """Асинхронные замки по строкам листа.
+
+    Операции над разными роутерами идут параллельно, а проверка и запись одной
+    строки выполняются по очереди. Замки создаются по требованию и удаляются,
+    когда их никто не ждет.
+    """
+
+    def __init__(self):
+        # ключ -> [замок, число держащих и ожидающих]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def lock(self, *keys):
+        """Захватывает замки всех ключей; порядок захвата общий, поэтому взаимных блокировок нет"""
+        entries = []
+        for key in sorted(set(keys), key=str):
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            entries.append((key, entry))
+
+        acquired = []
+        try:
+            for _, entry in entries:
+                await entry[0].acquire()
+                acquired.append(entry)
+            yield
+        finally:
+            for entry in acquired:
+                entry[0].release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+# Глобальный экземпляр для использования в других модулях
+row_locks = RowLockManager()
@@ -0,0 +1,190 @@
+# search_index.py
+import bisect
+import re
+import threading
+
+from records import is_header_row, shard_range
+
+# Запрос из шестнадцатеричных цифр с разделителями - это часть MAC-адреса
+MAC_FRAGMENT_RE = re.compile(r"^[0-9a-f]{1,2}([:\-][0-9a-f]{0,2})+$")
+
+def normalize_text(text):
+    """Нижний регистр, ё -> е, без лишних пробелов"""
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+def normalize_query(query):
+    """Запрос к индексу; из части MAC-адреса убираются разделители"""
+    query = normalize_text(query)
+    if MAC_FRAGMENT_RE.match(query):
+        query = query.replace(':', '').replace('-', '')
+    return query
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    """Поиск по MAC, комнате, владельцу и контактам: по префиксу слова и по триграммам подстроки.
+
+    Строится из локальной базы и перестраивается только когда ее версия изменилась,
+    так что каждое нажатие клавиши в inline-режиме обходится без обращений к таблице.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._version = None
+        self.rows = {}
+        # Отсортированные (слово, строка) для поиска по префиксу
+        self._tokens = []
+        # триграмма -> номера строк, и текст строки для проверки совпадения
+        self._trigrams = {}
+        self._haystacks = {}
+        self._rooms = {}
+        # строка -> ее слова, чтобы убрать строку из индекса при изменении
+        self._row_words = {}
+
+    def _row_entries(self, row_num, row):
+        """(слова, текст для триграмм, комната) строки или None, если это не роутер"""
+        columns = self.store.columns_for(row_num)
+        mac = columns.text(row, 'mac')
+        # Первая строка листа - заголовок, строки без MAC не роутеры
+        if is_header_row(row_num) or not mac:
+            return None
+        mac_key = normalize_query(mac)
+        room = normalize_text(columns.text(row, 'room'))
+        owner = normalize_text(columns.text(row, 'owner'))
+        contact = normalize_text(columns.text(row, 'contact'))
+
+        words = {mac_key, room, owner, contact, contact.lstrip('@')}
+        words.update(owner.split())
+        words.update(contact.lstrip('@').split())
+        words.discard('')
+        return words, '\n'.join((mac_key, room, owner, contact)), room
+
+    def _add_row(self, row_num, row, tokens=None):
+        entries = self._row_entries(row_num, row)
+        if entries is None:
+            return
+        words, haystack, room = entries
+        if tokens is None:
+            for word in words:
+                bisect.insort(self._tokens, (word, row_num))
+        else:
+            tokens.extend((word, row_num) for word in words)
+        self._row_words[row_num] = words
+        self._haystacks[row_num] = haystack
+        for trigram in _trigrams(haystack):
+            self._trigrams.setdefault(trigram, set()).add(row_num)
+        if room:
+            bisect.insort(self._rooms.setdefault(room, []), row_num)
+
+    def _remove_row(self, row_num):
+        words = self._row_words.pop(row_num, None)
+        if words is None:
+            return
+        for word in words:
+            i = bisect.bisect_left(self._tokens, (word, row_num))
+            if i < len(self._tokens) and self._tokens[i] == (word, row_num):
+                del self._tokens[i]
+        haystack = self._haystacks.pop(row_num)
+        for trigram in _trigrams(haystack):
+            rows = self._trigrams.get(trigram)
+            if rows is not None:
+                rows.discard(row_num)
+                if not rows:
+                    del self._trigrams[trigram]
+        room = haystack.split('\n')[1]
+        if room in self._rooms:
+            self._rooms[room].remove(row_num)
+            if not self._rooms[room]:
+                del self._rooms[room]
+
+    def _rebuild(self):
+        version, rows = self.store.all_rows_versioned()
+        self._tokens = []
+        self._trigrams = {}
+        self._haystacks = {}
+        self._rooms = {}
+        self._row_words = {}
+        tokens = []
+        for row_num, row in rows.items():
+            self._add_row(row_num, row, tokens)
+        tokens.sort()
+        self._tokens = tokens
+        self.rows = rows
+        self._version = version
+
+    def _ensure_fresh(self):
+        if self._version != self.store.version:
+            self._rebuild()
+
+    def apply(self, version_before, version_after, rows, ranges=(), last_row=None):
+        """Точечно обновляет индекс после изменения базы с version_before на version_after.
+
+        rows - новые значения строк; строки в ranges, которых нет в rows, и строки
+        того же листа после last_row удаляются. Если индекс отстал сильнее, он перестроится
+        целиком при следующем поиске.
+        """
+        with self._lock:
+            if self._version != version_before:
+                return
+            removed = set(rows)
+            for first, last in ranges:
+                removed.update(row_num for row_num in self.rows if first <= row_num <= last)
+            if last_row is not None:
+                shard_last = shard_range(last_row)[1]
+                removed.update(row_num for row_num in self.rows if last_row < row_num <= shard_last)
+            for row_num in removed:
+                self._remove_row(row_num)
+                self.rows.pop(row_num, None)
+            for row_num, row in rows.items():
+                self.rows[row_num] = row
+                self._add_row(row_num, row)
+            self._version = version_after
+
+    def refresh(self):
+        """Перестраивает индекс заранее, если база изменилась"""
+        with self._lock:
+            self._ensure_fresh()
+
+    def _prefix_matches(self, query):
+        found = []
+        i = bisect.bisect_left(self._tokens, (query,))
+        while i < len(self._tokens) and self._tokens[i][0].startswith(query):
+            found.append(self._tokens[i][1])
+            i += 1
+        return found
+
+    def _substring_matches(self, query):
+        if len(query) < 3:
+            return []
+        candidates = None
+        for trigram in _trigrams(query):
+            rows = self._trigrams.get(trigram)
+            if not rows:
+                return []
+            candidates = set(rows) if candidates is None else candidates & rows
+        return sorted(row_num for row_num in candidates if query in self._haystacks[row_num])
+
+    def search(self, query, limit=20):
+        """[(номер строки, значения)]: сначала точная комната, затем совпадения по префиксу, затем по подстроке"""
+        query = normalize_query(query)
+        if not query:
+            return []
+
+        with self._lock:
+            self._ensure_fresh()
+            ordered = []
+            seen = set()
+            for row_num in (
+                self._rooms.get(query, [])
+                + sorted(self._prefix_matches(query))
+                + self._substring_matches(query)
+            ):
+                if row_num in seen:
+                    continue
+                seen.add(row_num)
+                ordered.append(row_num)
+                if len(ordered) >= limit:
+                    break
+            return [(row_num, self.rows[row_num]) for row_num in ordered]
@@ -0,0 +1,71 @@
+# shards.py
+import config
+from config import SPREADSHEET_ID, SHEET_NAME
+from change_tracker import ChangeTracker
+from records import SHARD_ROWS
+
+# Общежития, каждое в своей таблице или на своем листе:
+# {название: {'spreadsheet_id': ..., 'sheet_name': ..., 'room_prefix': ...}}.
+# room_prefix - корпус в начале номера комнаты: "Б-412" ищется в листе общежития с префиксом "Б".
+# Ключи строк в локальной базе и очереди записи зависят от порядка общежитий - новые добавляйте в конец.
+# Без DORMS бот работает с одной таблицей SPREADSHEET_ID / SHEET_NAME
+DORMS = getattr(config, 'DORMS', None)
+
+class Shard:
+    """Лист одного общежития: подключение, его доступность и проверка изменений"""
+
+    def __init__(self, index, name, spreadsheet_id, sheet_name, room_prefix=''):
+        self.index = index
+        self.name = name
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.room_prefix = room_prefix
+        # Строки листа лежат в локальной базе под ключами offset + номер строки
+        self.offset = index * SHARD_ROWS
+        self.sheet = None
+        self.changes = ChangeTracker()
+        self.loaded_at = None
+        self.online = False
+        # Неудачные синхронизации подряд
+        self.failures = 0
+
+    @property
+    def label(self):
+        """Название для журнала: " (общежитие)" или пустая строка, если общежитие одно"""
+        return f" ({self.name})" if self.name else ""
+
+    @property
+    def synced_key(self):
+        """Ключ времени синхронизации в meta; первое общежитие хранит его под прежним ключом"""
+        return 'synced_at' if self.index == 0 else f"synced_at:{self.name}"
+
+    def key(self, row_num):
+        """Ключ строки листа в локальной базе"""
+        return self.offset + row_num
+
+    def row_num(self, row_key):
+        """Номер строки в листе по ключу"""
+        return row_key - self.offset
+
+    def owns(self, row_key):
+        return self.offset <= row_key < self.offset + SHARD_ROWS
+
+    def strip_prefix(self, room):
+        """Номер комнаты без корпуса этого общежития (None, если номер начинается не с него)"""
+        if not self.room_prefix or not room.casefold().startswith(self.room_prefix.casefold()):
+            return None
+        return room[len(self.room_prefix):].lstrip(' -') or None
+
+def load_shards(dorms=DORMS):
+    """Общежития из DORMS в порядке объявления (или одно - из SPREADSHEET_ID / SHEET_NAME)"""
+    if not dorms:
+        return [Shard(0, '', SPREADSHEET_ID, SHEET_NAME)]
+    return [
+        Shard(
+            index, name,
+            settings.get('spreadsheet_id', SPREADSHEET_ID),
+            settings.get('sheet_name', SHEET_NAME),
+            settings.get('room_prefix', ''),
+        )
+        for index, (name, settings) in enumerate(dorms.items())
+    ]
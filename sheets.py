@@ -1,104 +1,720 @@
 # google_sheets.py
+import asyncio
+import contextvars
+import functools
+import hashlib
 import logging
+import random
 import re
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
 
-from config import SCOPES, SERVICE_ACCOUNT_FILE, SPREADSHEET_ID, SHEET_NAME
+import config
+from config import SCOPES, SERVICE_ACCOUNT_FILE
+from local_store import LOCAL_DB_FILE, LocalStore
+from metrics import InstrumentedWorksheet, current_handler, instrumented, metrics
+from records import SHARD_ROWS, ColumnMap, RouterRecord, Status
+from search_index import SearchIndex
+from shards import load_shards
+from singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# Как часто фоновая синхронизация перечитывает лист, в секундах (можно переопределить в config.py)
+SYNC_INTERVAL = getattr(config, 'SHEETS_SYNC_INTERVAL', 60)
+# Размер пула потоков и таймаут одного обращения к таблице для асинхронной обертки
+MAX_WORKERS = getattr(config, 'SHEETS_MAX_WORKERS', 4)
+CALL_TIMEOUT = getattr(config, 'SHEETS_CALL_TIMEOUT', 15)
+# Отдельный пул для запросов к локальной базе: они не ждут в очереди за медленными обращениями к таблице
+LOCAL_WORKERS = getattr(config, 'LOCAL_DB_WORKERS', 2)
+# Пауза между попытками подключения растет от меньшей к большей, в секундах
+RECONNECT_MIN_DELAY = getattr(config, 'SHEETS_RECONNECT_MIN_DELAY', 5)
+RECONNECT_MAX_DELAY = getattr(config, 'SHEETS_RECONNECT_MAX_DELAY', 300)
+# После скольких неудачных синхронизаций подряд подключение создается заново
+RECONNECT_AFTER_FAILURES = getattr(config, 'SHEETS_RECONNECT_AFTER_FAILURES', 3)
+
+# Номер строки в диапазоне из ответа append ("A12:D12" -> 12)
+APPENDED_ROW_RE = re.compile(r"^[A-Z]+(\d+)")
+
+def normalize_mac(mac_address):
+    """Приводит MAC-адрес к 48-битному числу (или к строке, если это не MAC)"""
+    mac_clean = mac_address.lower().replace('-', '').replace(':', '').replace(' ', '')
+    if len(mac_clean) == 12:
+        try:
+            return int(mac_clean, 16)
+        except ValueError:
+            pass
+    return mac_clean
+
+def is_retryable(error):
+    """Ошибки квоты (429), сервера (5xx) и сети стоит повторить, остальные - нет"""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        return True
+    return status == 429 or status >= 500
+
+def row_fingerprint(row_data):
+    """Короткий отпечаток значений строки для проверки, не изменилась ли она"""
+    joined = '\x1f'.join(value.strip() for value in row_data).rstrip('\x1f')
+    return hashlib.blake2b(joined.encode('utf-8'), digest_size=8).hexdigest()
+
+def _apply_fields(rows, updates):
+    """Накладывает {строка: {колонка: значение}} на {строка: значения}"""
+    for row_num, values_by_col in updates.items():
+        row = list(rows.get(row_num, []))
+        for col_num, value in values_by_col.items():
+            if len(row) < col_num:
+                row.extend([''] * (col_num - len(row)))
+            row[col_num - 1] = '' if value is None else str(value)
+        rows[row_num] = row
+
+def _contiguous_runs(fields):
+    """Разбивает {колонка: значение} на непрерывные диапазоны (первая колонка, [значения])"""
+    runs = []
+    for col_num in sorted(fields):
+        if runs and runs[-1][0] + len(runs[-1][1]) == col_num:
+            runs[-1][1].append(fields[col_num])
+        else:
+            runs.append((col_num, [fields[col_num]]))
+    return runs
+
 class GoogleSheetsHelper:
-    def __init__(self):
-        self.sheet = None
-        self.init_sheet()
+    def __init__(self, store_path=LOCAL_DB_FILE, shards=None):
+        # Листы общежитий: название -> Shard. Строки всех листов лежат в одной локальной базе
+        # под непересекающимися ключами, так что ее индекс по MAC сразу говорит, в каком листе роутер
+        self.shards = {shard.name: shard for shard in (shards or load_shards())}
+        self._by_index = list(self.shards.values())
+        # Другие листы таблицы первого общежития (например, история операций): название -> лист
+        self._tabs = {}
+        # Локальная копия листов - основной источник данных для поиска
+        self.store = LocalStore(normalize_mac, store_path)
+        # Индекс для inline-поиска, перестраивается при изменении базы
+        self.search_index = SearchIndex(self.store)
+        # Записи из очереди, еще не дошедшие до таблицы: {строка: {колонка: значение}}
+        self._staged = {}
+        self._cache_lock = threading.RLock()
+        # Одновременные одинаковые чтения листа выполняются одним запросом
+        self._flights = SingleFlight()
+        # Ключ сервисного аккаунта читается один раз, токен доступа кэшируется и обновляется в creds
+        self._creds = None
+        self._client = None
+        # Подключение выполняется не при импорте, а в фоне (AsyncSheetsHelper.run_sync)
     
+    @property
+    def primary(self):
+        """Первое общежитие: в его таблице ведутся журнал операций и список доступа"""
+        return self._by_index[0]
+
+    @property
+    def sheet(self):
+        return self.primary.sheet
+
+    @property
+    def connected(self):
+        """Подключены ли листы всех общежитий"""
+        return all(shard.sheet is not None for shard in self._by_index)
+
+    def shard_of(self, row_num):
+        """Общежитие, которому принадлежит строка"""
+        return self._by_index[row_num // SHARD_ROWS]
+
+    def shard(self, name=None):
+        """Общежитие по названию без учета регистра; без названия - единственное, если оно одно"""
+        if name is None:
+            return self.primary if len(self._by_index) == 1 else None
+        name = name.strip().casefold()
+        return next((shard for shard in self._by_index if shard.name.casefold() == name), None)
+
+    def row_label(self, row_num):
+        """Строка для сообщений: номер в листе и название общежития, если их несколько"""
+        shard = self.shard_of(row_num)
+        if len(self._by_index) == 1:
+            return str(shard.row_num(row_num))
+        return f"{shard.row_num(row_num)} ({shard.name})"
+
+    def route_room(self, room_number):
+        """(общежития, номер комнаты в листе): корпус в начале номера выбирает лист, без него - все листы"""
+        room = room_number.strip()
+        for shard in self._by_index:
+            rest = shard.strip_prefix(room)
+            if rest:
+                return [shard], rest
+        return list(self._by_index), room
+
     def init_sheet(self):
-        """Инициализирует подключение к Google Таблице"""
+        """Подключает листы общежитий, которые еще не подключены; возвращает успех для всех"""
         try:
-            creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-            client = gspread.authorize(creds)
-            spreadsheet = client.open_by_key(SPREADSHEET_ID)
-            self.sheet = spreadsheet.worksheet(SHEET_NAME)
-            logger.info("Успешное подключение к Google Таблице")
+            if self._creds is None:
+                self._creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            if self._client is None:
+                self._client = gspread.authorize(self._creds)
         except Exception as e:
             logger.error(f"Ошибка подключения к Google Таблице: {e}")
-            self.sheet = None
-    
-    def find_row_by_mac(self, mac_address):
-        """Ищет строку по MAC-адресу"""
-        if not self.sheet:
-            return None, None
-        
+            self._mark_health(e)
+            return False
+
+        connected = True
+        for shard in self._by_index:
+            if shard.sheet is None:
+                connected = self._connect_shard(shard) and connected
+        return connected
+
+    def _connect_shard(self, shard):
         try:
-            mac_clean = mac_address.lower().replace('-', '').replace(':', '').replace(' ', '')
-            all_macs = self.sheet.col_values(2)
-            
-            for i, mac in enumerate(all_macs, 1):
-                current_mac_clean = mac.lower().replace('-', '').replace(':', '').replace(' ', '')
-                if current_mac_clean == mac_clean:
-                    return i, self.sheet.row_values(i)
-            return None, None
+            spreadsheet = self._client.open_by_key(shard.spreadsheet_id)
+            shard.sheet = InstrumentedWorksheet(spreadsheet.worksheet(shard.sheet_name))
+            if shard is self.primary:
+                self._tabs = {}
+            logger.info(f"Успешное подключение к Google Таблице{shard.label}")
+            self._mark_health(None, shard)
+            return True
         except Exception as e:
-            logger.error(f"Ошибка при поиске по MAC: {e}")
-            return None, None
+            logger.error(f"Ошибка подключения к Google Таблице{shard.label}: {e}")
+            shard.sheet = None
+            self._mark_health(e, shard)
+            return False
+
+    def disconnect(self, name=None):
+        """Сбрасывает подключение листа (без name - всех), чтобы следующая попытка создала его заново"""
+        for shard in self._by_index if name is None else [self.shards[name]]:
+            shard.sheet = None
+            shard.online = False
+            if shard is self.primary:
+                self._tabs = {}
+        # Ключ остается в памяти, клиент создается заново
+        self._client = None
+
+    def _mark_health(self, error, shard=None):
+        """Запоминает исход обращения к листу (без shard - ко всем): успех, недоступность (квота, 5xx, сеть) или ошибку запроса"""
+        for shard in self._by_index if shard is None else [shard]:
+            if error is None:
+                if not shard.online:
+                    logger.info(f"Google Таблица{shard.label} доступна")
+                shard.online = True
+            elif is_retryable(error):
+                if shard.online:
+                    logger.warning(f"Google Таблица{shard.label} недоступна, работаем только на чтение: {error}")
+                shard.online = False
+
+    def columns_for(self, row_num):
+        """Колонки полей (ColumnMap) по заголовку листа, в котором строка"""
+        return self.store.columns_for(row_num)
+
+    def record(self, row_num, row_data):
+        """RouterRecord для строки (None, если строки нет)"""
+        if row_data is None:
+            return None
+        dorm = self.shard_of(row_num).name if len(self._by_index) > 1 else ''
+        return RouterRecord(row_num, row_data, self.store.columns_for(row_num), dorm)
+
+    def is_online(self, name=None):
+        """Доступны ли листы всех общежитий (или одного - name)"""
+        shards = self._by_index if name is None else [self.shards[name]]
+        return all(shard.sheet is not None and shard.online for shard in shards)
+
+    def synced_at(self, name=None):
+        """Время последней успешной синхронизации всех листов - самой давней из них (или одного - name; None, если ее не было)"""
+        times = []
+        for shard in self._by_index if name is None else [self.shards[name]]:
+            value = self.store.get_meta(shard.synced_key)
+            try:
+                times.append(datetime.fromisoformat(value) if value else None)
+            except ValueError:
+                times.append(None)
+        return None if None in times else min(times)
     
-    def find_row_by_room(self, room_number):
-        """Ищет строку по номеру комнаты"""
-        if not self.sheet:
-            return None, None
-        
+    def attach_worksheet(self, worksheet, name=None):
+        """Подключает готовый лист (например, FakeWorksheet) к общежитию и очищает его строки в локальной базе"""
+        shard = self.primary if name is None else self.shards[name]
+        with self._cache_lock:
+            shard.sheet = InstrumentedWorksheet(worksheet)
+            if shard is self.primary:
+                self._tabs = {}
+            shard.online = True
+            self._staged = {row_num: fields for row_num, fields in self._staged.items() if not shard.owns(row_num)}
+            shard.loaded_at = None
+            shard.changes.reset()
+            self.store.replace_all({}, shard=shard.index)
+    
+    @instrumented('sheets_helper')
+    def refresh_cache(self, force=False):
+        """Обновляет локальную базу из листов всех общежитий по очереди (параллельно - AsyncSheetsHelper)"""
+        results = [self.refresh_shard(name, force) for name in self.shards]
+        return all(results)
+
+    def refresh_shard(self, name, force=False):
+        """Обновляет локальную базу из листа общежития; без force пропускает загрузку, если лист не менялся"""
+        # Если загрузка уже идет (синхронизация, прогрев, первые запросы), ждем ее результат
+        return self._flights.do(('refresh_cache', name, force), self._refresh_cache, self.shards[name], force)
+
+    def _remote_modified(self, shard):
+        """Время последнего изменения файла таблицы по Drive API (None, если узнать нельзя)"""
+        spreadsheet = getattr(shard.sheet, 'spreadsheet', None)
+        if not shard.changes.gate_enabled or spreadsheet is None:
+            return None
         try:
-            all_rooms = self.sheet.col_values(3)
-            for i, room in enumerate(all_rooms, 1):
-                if room.strip() == room_number.strip():
-                    return i, self.sheet.row_values(i)
-            return None, None
+            with metrics.timed('sheets_api', method='get_lastUpdateTime', handler=current_handler.get()):
+                return spreadsheet.get_lastUpdateTime()
+        except gspread.exceptions.APIError as e:
+            if not is_retryable(e):
+                # Обычно у сервисного аккаунта нет области Drive (drive.metadata.readonly)
+                logger.warning(f"Нет доступа к метаданным файла в Drive, лист будет скачиваться каждый раз: {e}")
+                shard.changes.gate_enabled = False
+            return None
         except Exception as e:
-            logger.error(f"Ошибка при поиске по комнате: {e}")
-            return None, None
-    
-    def update_cell(self, row_num, col_num, value):
-        """Обновляет ячейку в таблице"""
-        if not self.sheet:
+            logger.warning(f"Не удалось узнать время изменения таблицы: {e}")
+            return None
+
+    def _refresh_cache(self, shard, force=False):
+        if not shard.sheet:
             return False
-        
-        try:
-            self.sheet.update_cell(row_num, col_num, value)
+
+        # Дешевая проверка метаданных вместо скачивания всего листа
+        modified = self._remote_modified(shard)
+        if not force and shard.loaded_at is not None and shard.changes.can_skip(modified):
+            with self._cache_lock:
+                shard.changes.accept(modified)
+                self.store.set_meta(shard.synced_key, datetime.now().isoformat(timespec='seconds'))
+            self._mark_health(None, shard)
             return True
+
+        try:
+            all_values = shard.sheet.get_all_values()
         except Exception as e:
-            logger.error(f"Ошибка при обновлении таблица: {e}")
+            logger.error(f"Ошибка при загрузке снимка таблицы{shard.label}: {e}")
+            self._mark_health(e, shard)
             return False
+        self._mark_health(None, shard)
+
+        rows = {shard.key(i): row for i, row in enumerate(all_values, 1)}
+        with self._cache_lock:
+            _apply_fields(rows, {row_num: fields for row_num, fields in self._staged.items() if shard.owns(row_num)})
+            ranges, changed_rows = shard.changes.diff(rows, modified)
+            columns = ColumnMap.from_header(rows.get(shard.key(1)))
+            if ranges is None or columns != self.store.columns_for(shard.offset):
+                # Первая загрузка или колонки в листе переставили - строки листа в базе строятся заново
+                self.store.replace_all(rows, columns, shard.index)
+            elif ranges:
+                # В базе и индексе поиска заменяются только блоки строк, которые изменились
+                last_row = max(rows, default=shard.offset)
+                version_before = self.store.version
+                self.store.replace_ranges(ranges, changed_rows, last_row)
+                self.search_index.apply(version_before, self.store.version, changed_rows, ranges, last_row)
+                logger.info(f"Синхронизация{shard.label}: изменились строки в {len(ranges)} блоках")
+            shard.loaded_at = time.monotonic()
+            self.store.set_meta(shard.synced_key, datetime.now().isoformat(timespec='seconds'))
+        # Индекс поиска строим здесь, в потоке синхронизации, а не на первом inline-запросе
+        self.search_index.refresh()
+        return True
+
+    def cold_shards(self):
+        """Общежития, строк которых еще нет в локальной базе"""
+        return [
+            shard for shard in self._by_index
+            if shard.loaded_at is None and self.store.row_count(shard.index) == 0
+        ]
+
+    def load_shard(self, name):
+        """Загружает лист общежития, если его строк еще нет в локальной базе"""
+        shard = self.shards[name]
+        if shard.loaded_at is not None or self.store.row_count(shard.index):
+            return True
+        return self.refresh_shard(name)
+
+    def _ensure_cache(self):
+        """Загружает листы, которых еще нет в локальной базе; дальше ее обновляет фоновая синхронизация"""
+        cold = self.cold_shards()
+        loaded = [self.load_shard(shard.name) for shard in cold]
+        # Без листа одного общежития поиск по остальным продолжает работать
+        return len(cold) < len(self._by_index) or any(loaded)
+
+    def _patch_cache(self, updates):
+        """Применяет наши собственные записи к локальной базе ({строка: {колонка: значение}})"""
+        with self._cache_lock:
+            rows = {}
+            for row_num in updates:
+                rows[row_num] = self.store.get_row(row_num) or []
+            _apply_fields(rows, updates)
+            # Более новые изменения из очереди важнее только что записанных
+            _apply_fields(rows, {row_num: self._staged[row_num] for row_num in rows if row_num in self._staged})
+            # Хэши этих блоков больше не соответствуют базе - сверим их при следующей загрузке
+            for shard in self._by_index:
+                shard.changes.invalidate(row_num for row_num in rows if shard.owns(row_num))
+            version_before = self.store.version
+            self.store.upsert_rows(rows)
+            self.search_index.apply(version_before, self.store.version, rows)
+
+    def stage_writes(self, updates):
+        """Записывает изменения в локальную базу, пока очередь не донесет их до таблицы"""
+        with self._cache_lock:
+            for row_num, fields in updates.items():
+                self._staged.setdefault(row_num, {}).update(fields)
+            self._patch_cache(updates)
+
+    def unstage_writes(self, updates):
+        """Убирает из наложения изменения, которые уже записаны в таблицу"""
+        with self._cache_lock:
+            for row_num, fields in updates.items():
+                staged = self._staged.get(row_num)
+                if staged is None:
+                    continue
+                for col_num, value in fields.items():
+                    if staged.get(col_num) == value:
+                        del staged[col_num]
+                if not staged:
+                    del self._staged[row_num]
+
+    @instrumented('sheets_helper')
+    def get_row(self, row_num, load=True):
+        """Возвращает строку из локальной базы (None, если ее нет)"""
+        if load and not self._ensure_cache():
+            return None
+
+        return self.store.get_row(row_num)
+
+    @instrumented('sheets_helper')
+    def find_row_by_mac(self, mac_address, load=True):
+        """Ищет строку по MAC-адресу во всех общежитиях одним запросом к индексу локальной базы"""
+        if load and not self._ensure_cache():
+            return None, None
+        
+        return self.store.find_by_mac(mac_address)
     
-    def get_all_records(self):
-        """Получает все записи из таблицы"""
-        if not self.sheet:
+    @instrumented('sheets_helper')
+    def find_row_by_room(self, room_number, load=True):
+        """Ищет строку по номеру комнаты; корпус в начале номера выбирает общежитие"""
+        if load and not self._ensure_cache():
+            return None, None
+        
+        shards, room = self.route_room(room_number)
+        if len(shards) == 1:
+            return self.store.find_by_room(room, shards[0].index)
+        # Без корпуса комната ищется во всех общежитиях, но только если она нашлась в одном из них
+        found = [row for row in (self.store.find_by_room(room, shard.index) for shard in shards) if row[0]]
+        return found[0] if len(found) == 1 else (None, None)
+    
+    def find_room_shards(self, room_number, load=True):
+        """Общежития, в листах которых есть комната: без корпуса в начале номера их может быть несколько"""
+        if load and not self._ensure_cache():
+            return []
+
+        shards, room = self.route_room(room_number)
+        return [shard for shard in shards if self.store.find_by_room(room, shard.index)[0]]
+
+    @instrumented('sheets_helper')
+    def search(self, query, limit=20, load=True):
+        """Ищет роутеры по части MAC, комнаты, ФИО или контактов"""
+        if load and not self._ensure_cache():
             return []
+
+        return self.search_index.search(query, limit)
+    
+    @instrumented('sheets_helper')
+    def write_rows_fields(self, updates):
+        """Обновляет ячейки нескольких строк одним batch_update-запросом на лист ({строка: {колонка: значение}}).
         
+        Исключения gspread пробрасываются - повторы и уведомления на стороне очереди записи.
+        """
+        by_shard = {}
+        for row_num, fields in updates.items():
+            by_shard.setdefault(self.shard_of(row_num), {})[row_num] = fields
+
+        written = {}
         try:
-            return self.sheet.get_all_records()
+            for shard, shard_updates in by_shard.items():
+                self._write_shard(shard, shard_updates)
+                written.update(shard_updates)
+        finally:
+            # Листы, запись в которые прошла, повторная запись не испортит: значения те же
+            if written:
+                self._patch_cache(written)
+        return True
+
+    def _write_shard(self, shard, updates):
+        if not shard.sheet:
+            raise ConnectionError(f"нет подключения к Google Таблице{shard.label}")
+
+        data = []
+        for row_num, fields in updates.items():
+            for first_col, values in _contiguous_runs(fields):
+                start = rowcol_to_a1(shard.row_num(row_num), first_col)
+                end = rowcol_to_a1(shard.row_num(row_num), first_col + len(values) - 1)
+                data.append({'range': f"{start}:{end}", 'values': [values]})
+        if not data:
+            return
+
+        started = shard.changes.now()
+        try:
+            shard.sheet.batch_update(data, value_input_option='USER_ENTERED')
         except Exception as e:
-            logger.error(f"Ошибка при получении записей: {e}")
+            self._mark_health(e, shard)
+            raise
+        self._mark_health(None, shard)
+        shard.changes.note_write(started)
+    
+    @instrumented('sheets_helper')
+    def append_router(self, mac_address, dorm=None):
+        """Добавляет свободный роутер в конец листа общежития одним запросом, возвращает номер новой строки"""
+        row_nums = self._append_routers([mac_address], dorm)
+        return row_nums[0] if row_nums else None
+
+    @instrumented('sheets_helper')
+    def append_routers(self, mac_addresses, dorm=None):
+        """Добавляет несколько свободных роутеров одним запросом, возвращает номера новых строк"""
+        return self._append_routers(mac_addresses, dorm)
+
+    def _append_routers(self, mac_addresses, dorm=None):
+        shard = self.shard(dorm)
+        if shard is None or not shard.sheet:
+            return None
+
+        columns = self.store.columns_for(shard.offset)
+        values = [columns.row(mac=mac_address, status=Status.FREE) for mac_address in mac_addresses]
+        if not values:
             return []
+        started = shard.changes.now()
+        try:
+            response = shard.sheet.append_rows(values, value_input_option='USER_ENTERED', table_range='A1')
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении строк: {e}")
+            self._mark_health(e, shard)
+            return None
+        self._mark_health(None, shard)
+        shard.changes.note_write(started)
+
+        # Номер первой строки берем из ответа API, а если его нет - из локального счетчика строк
+        updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+        match = APPENDED_ROW_RE.search(updated_range.rsplit('!', 1)[-1])
+        with self._cache_lock:
+            first_row = int(match.group(1)) if match else self.store.row_count(shard.index) + 1
+            rows = {shard.key(first_row + i): row for i, row in enumerate(values)}
+            shard.changes.invalidate(rows)
+            version_before = self.store.version
+            self.store.upsert_rows(rows)
+            self.search_index.apply(version_before, self.store.version, rows)
+        return list(rows)
+
+    @instrumented('sheets_helper')
+    def snapshot(self, load=True):
+        """Все строки листов из локальной базы одним согласованным снимком {строка: значения}"""
+        if load and not self._ensure_cache():
+            return {}
+
+        return self.store.all_rows()
+
+    def find_overdue_rows(self, name, today=None):
+        """Находит выданные роутеры общежития с истекшим сроком запросом по индексу (статус, срок); None при ошибке"""
+        shard = self.shards[name]
+        if not self.refresh_shard(name) and self.store.row_count(shard.index) == 0:
+            return None
+
+        # Даты в формате YYYY-MM-DD сравниваются как строки, без strptime на каждую строку
+        today_str = (today or date.today()).isoformat()
+        return self.store.rows_with_status_before(Status.ISSUED, today_str, shard.index)
     
-    def get_router_info(self, row_data):
-        """Форматирует информацию о роутере для отображения"""
-        if len(row_data) < 9:
-            return "Недостаточно данных о роутере"
-        
-        info = (
-            f"MAC: {row_data[1] if len(row_data) > 1 else 'Н/Д'}\n"
-            f"Комната: {row_data[2] if len(row_data) > 2 else 'Н/Д'}\n"
-            f"Статус: {row_data[3] if len(row_data) > 3 else 'Н/Д'}\n"
-            f"Владелец: {row_data[5] if len(row_data) > 5 else 'Н/Д'}\n"
-            f"Контакты: {row_data[8] if len(row_data) > 8 else 'Н/Д'}\n"
-            f"Комментарий: {row_data[9] if len(row_data) > 9 else 'Н/Д'}\n"
-            f"Дата выдачи: {row_data[6] if len(row_data) > 6 else 'Н/Д'}\n"
-            f"Вернуть до: {row_data[7] if len(row_data) > 7 else 'Н/Д'}"
+    @instrumented('sheets_helper')
+    def append_to_tab(self, title, values, header=None):
+        """Дописывает строки в другой лист таблицы первого общежития одним запросом; создает лист с заголовком, если его нет"""
+        shard = self.primary
+        spreadsheet = getattr(shard.sheet, 'spreadsheet', None)
+        if spreadsheet is None or not values:
+            return False
+
+        started = shard.changes.now()
+        try:
+            worksheet = self._tabs.get(title)
+            if worksheet is None:
+                with metrics.timed('sheets_api', method='worksheet', handler=current_handler.get()):
+                    try:
+                        worksheet = spreadsheet.worksheet(title)
+                    except gspread.exceptions.WorksheetNotFound:
+                        worksheet = spreadsheet.add_worksheet(title, rows=1, cols=len(header or values[0]))
+                        if header:
+                            values = [header] + values
+                worksheet = self._tabs[title] = InstrumentedWorksheet(worksheet)
+            # RAW: текст пишется как есть, без разбора формул и дат
+            worksheet.append_rows(values, value_input_option='RAW', table_range='A1')
+        except Exception as e:
+            logger.error(f"Ошибка при записи в лист {title}: {e}")
+            self._mark_health(e, shard)
+            return False
+        self._mark_health(None, shard)
+        # Запись в другой лист тоже меняет время изменения файла - это наше изменение
+        shard.changes.note_write(started)
+        return True
+
+    def read_column(self, title, col_num=1):
+        """Значения колонки другого листа таблицы первого общежития (None, если таблица не подключена)"""
+        spreadsheet = getattr(self.sheet, 'spreadsheet', None)
+        if spreadsheet is None:
+            return None
+        with metrics.timed('sheets_api', method='col_values', handler=current_handler.get()):
+            return spreadsheet.worksheet(title).col_values(col_num)
+
+class AsyncSheetsHelper:
+    """Асинхронная обертка над GoogleSheetsHelper: блокирующие вызовы gspread выполняются в пуле потоков.
+
+    Работа с листами разных общежитий (загрузка, синхронизация, проверка просрочек)
+    идет параллельно, по вызову в пуле на лист. Запросы к локальной базе идут
+    через свой пул и без таймаута (run_local).
+    """
+
+    def __init__(self, helper, max_workers=MAX_WORKERS, timeout=CALL_TIMEOUT, local_workers=LOCAL_WORKERS):
+        self.helper = helper
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sheets')
+        self._local = ThreadPoolExecutor(max_workers=local_workers, thread_name_prefix='local')
+
+    async def run(self, func, *args, default=None, shard=None):
+        """Выполняет блокирующий вызов в пуле потоков, по таймауту возвращает default.
+
+        shard - общежитие, к листу которого обращается вызов: по таймауту недоступным
+        считается только его лист и только если вызов успел начаться, а не ждал потока.
+        """
+        loop = asyncio.get_running_loop()
+        # Контекст копируется, чтобы метрики в потоке знали, какой обработчик их вызвал
+        context = contextvars.copy_context()
+        started = threading.Event()
+
+        def call():
+            started.set()
+            return context.run(func, *args)
+
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, call), self.timeout)
+        except asyncio.TimeoutError as e:
+            logger.error(f"Таймаут обращения к Google Таблице: {func.__name__}")
+            if shard is not None and started.is_set():
+                self.helper._mark_health(e, self.helper.shards[shard])
+            return default
+
+    def shard_for_rows(self, row_nums):
+        """Общежитие, к листу которого относятся все строки (None, если листов несколько)"""
+        names = {self.helper.shard_of(row_num).name for row_num in row_nums}
+        return names.pop() if len(names) == 1 else None
+
+    def _shard_name(self, dorm):
+        shard = self.helper.shard(dorm)
+        return shard.name if shard else None
+
+    async def run_local(self, func, *args):
+        """Выполняет запрос к локальной базе в ее пуле потоков, не занимая пул обращений к таблице"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        return await loop.run_in_executor(self._local, call)
+
+    async def ensure_loaded(self):
+        """Загружает листы общежитий, строк которых еще нет в локальной базе, параллельно"""
+        cold = self.helper.cold_shards()
+        if cold:
+            # Лист мог загрузиться, пока вызов ждал свободного потока, - это проверяется уже в потоке
+            await asyncio.gather(*(
+                self.run(self.helper.load_shard, shard.name, default=False, shard=shard.name) for shard in cold
+            ))
+
+    async def find_row_by_mac(self, mac_address):
+        await self.ensure_loaded()
+        return await self.run_local(self.helper.find_row_by_mac, mac_address, False)
+
+    async def find_row_by_room(self, room_number):
+        await self.ensure_loaded()
+        return await self.run_local(self.helper.find_row_by_room, room_number, False)
+
+    async def find_room_shards(self, room_number):
+        await self.ensure_loaded()
+        return await self.run_local(self.helper.find_room_shards, room_number, False)
+
+    async def get_row(self, row_num):
+        await self.ensure_loaded()
+        return await self.run_local(self.helper.get_row, row_num, False)
+
+    async def append_router(self, mac_address, dorm=None):
+        return await self.run(self.helper.append_router, mac_address, dorm, shard=self._shard_name(dorm))
+
+    async def append_routers(self, mac_addresses, dorm=None):
+        return await self.run(self.helper.append_routers, mac_addresses, dorm, shard=self._shard_name(dorm))
+
+    async def snapshot(self):
+        await self.ensure_loaded()
+        return await self.run_local(self.helper.snapshot, False)
+
+    async def search(self, query, limit=20):
+        await self.ensure_loaded()
+        return await self.run_local(self.helper.search, query, limit, False)
+
+    async def append_to_tab(self, title, values, header=None):
+        return await self.run(
+            self.helper.append_to_tab, title, values, header, default=False, shard=self.helper.primary.name
         )
-        return info
 
-# Глобальный экземпляр для использования в других модулях
-sheets_helper = GoogleSheetsHelper()
\ No newline at end of file
+    async def read_column(self, title, col_num=1):
+        return await self.run(self.helper.read_column, title, col_num, shard=self.helper.primary.name)
+
+    async def find_overdue(self):
+        """Просроченные роутеры доступных общежитий параллельно: {общежитие: номера строк или None}"""
+        # Недоступный лист пропускается, остальные проверяются без него
+        online = [name for name in self.helper.shards if self.helper.is_online(name)]
+        found = await asyncio.gather(*(self.run(self.helper.find_overdue_rows, name, shard=name) for name in online))
+        results = dict.fromkeys(self.helper.shards)
+        results.update(zip(online, found))
+        return results
+
+    async def refresh_cache(self, force=False, names=None):
+        """Обновляет листы общежитий names (по умолчанию все)"""
+        names = self.helper.shards if names is None else names
+        results = await asyncio.gather(*(self.refresh_shard(name, force) for name in names))
+        return all(results)
+
+    async def refresh_shard(self, name, force=False):
+        return await self.run(self.helper.refresh_shard, name, force, default=False, shard=name)
+
+    async def connect(self):
+        return await self.run(self.helper.init_sheet, default=False)
+
+    async def run_sync(self, interval=SYNC_INTERVAL):
+        """Фоновая задача: подключается к таблицам и периодически перечитывает листы в локальную базу.
+
+        Пока ни один лист не подключен, бот отвечает по локальной базе, а попытки
+        повторяются с растущей паузой; после нескольких неудачных синхронизаций
+        листа подряд его подключение пересоздается.
+        """
+        current_handler.set('sheets_sync')
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            if not self.helper.connected:
+                await self.connect()
+            shards = [shard for shard in self.helper.shards.values() if shard.sheet]
+            if not shards:
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            delay = RECONNECT_MIN_DELAY
+
+            # Первая синхронизация после подключения прогревает локальную базу и индекс поиска
+            results = await asyncio.gather(*(self.refresh_shard(shard.name) for shard in shards))
+            reconnect = False
+            for shard, ok in zip(shards, results):
+                shard.failures = 0 if ok else shard.failures + 1
+                if shard.failures >= RECONNECT_AFTER_FAILURES:
+                    logger.warning(f"Синхронизация{shard.label} не удалась {shard.failures} раз подряд, переподключаемся")
+                    self.helper.disconnect(shard.name)
+                    shard.failures = 0
+                    reconnect = True
+            if not reconnect:
+                await asyncio.sleep(interval)
+
+    def shutdown(self):
+        """Останавливает пул потоков, не дожидаясь зависших запросов"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._local.shutdown(wait=False, cancel_futures=True)
+
+# Глобальные экземпляры для использования в других модулях
+sheets_helper = GoogleSheetsHelper()
+async_sheets = AsyncSheetsHelper(sheets_helper)
\ No newline at end of file
@@ -0,0 +1,50 @@
+# singleflight.py
+import threading
+from collections import Counter
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Склеивает одновременные одинаковые вызовы из разных потоков.
+
+    Первый вызов с данным ключом выполняет функцию, остальные, пришедшие до его
+    завершения, ждут и получают тот же результат (или то же исключение).
+    Кэширования нет: следующий вызов после завершения снова идет в таблицу.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ключ -> выполняющийся вызов
+        self._calls = {}
+        # ключ -> сколько вызовов получили чужой результат
+        self.shared = Counter()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared[key] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
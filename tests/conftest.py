@@ -0,0 +1,41 @@
+# tests/conftest.py
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py с токенами в репозиторий не входит - для тестов хватает минимальных настроек
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = types.ModuleType('config')
+    config.BOT_TOKEN = '0:TEST'
+    config.SCOPES = []
+    config.SERVICE_ACCOUNT_FILE = ''
+    config.SPREADSHEET_ID = ''
+    config.SHEET_NAME = 'Sheet1'
+    config.ALLOWED_USER_IDS = [1]
+    config.DEFAULT_ISSUE_PERIOD = 14
+    sys.modules['config'] = config
+# Локальная база и очередь записи в тестах живут только в памяти
+sys.modules['config'].LOCAL_DB_FILE = ':memory:'
+sys.modules['config'].WRITE_QUEUE_FILE = ''
+
+from fake_sheets import FakeWorksheet, make_inventory  # noqa: E402
+
+@pytest.fixture
+def sheet():
+    """Лист из 20 роутеров, подключенный к глобальному sheets_helper и загруженный в локальную базу"""
+    from sheets import sheets_helper
+    from write_queue import write_queue
+
+    worksheet = FakeWorksheet(make_inventory(20, seed=1))
+    sheets_helper.attach_worksheet(worksheet)
+    assert sheets_helper.refresh_cache()
+    write_queue._pending.clear()
+    write_queue._macs.clear()
+    write_queue._notifications.clear()
+    return worksheet
@@ -0,0 +1,85 @@
+# tests/test_bulk.py
+from datetime import datetime
+
+import pytest
+
+import bulk
+from sheets import sheets_helper
+
+def snapshot():
+    return bulk.Snapshot(sheets_helper.snapshot(), sheets_helper)
+
+def rows_with_status(sheet, status):
+    return [(row_num, row) for row_num, row in enumerate(sheet.rows, start=1) if row[3] == status]
+
+def test_read_records_with_and_without_header():
+    with_header = "Комната;MAC\n101;AA:BB:CC:DD:EE:01\n\n102;AA:BB:CC:DD:EE:02\n".encode('cp1251')
+    assert bulk.read_records('a.csv', with_header) == [
+        (2, {'mac': 'AA:BB:CC:DD:EE:01', 'room': '101', 'name': '', 'contact': '', 'due': ''}),
+        (4, {'mac': 'AA:BB:CC:DD:EE:02', 'room': '102', 'name': '', 'contact': '', 'due': ''}),
+    ]
+    records = bulk.read_records('a.csv', b"AA:BB:CC:DD:EE:01,101,Ivanov,@ivan,+7\n")
+    assert records[0] == (1, {'mac': 'AA:BB:CC:DD:EE:01', 'room': '101', 'name': 'Ivanov', 'contact': '@ivan', 'due': '+7'})
+    with pytest.raises(bulk.BulkFileError):
+        bulk.read_records('a.csv', b"\n\n")
+
+def test_plan_issue(sheet):
+    (free_row, free), (_, second) = rows_with_status(sheet, 'Свободен')[:2]
+    _, issued = rows_with_status(sheet, 'Выдан')[0]
+    records = [
+        (1, {'mac': free[1], 'room': '501', 'name': 'Иванов', 'contact': '@ivan', 'due': '2026-12-01'}),
+        (2, {'mac': free[1].lower(), 'room': '502', 'name': 'Петров', 'contact': '', 'due': ''}),
+        (3, {'mac': issued[1], 'room': '503', 'name': 'Сидоров', 'contact': '', 'due': ''}),
+        (4, {'mac': second[1], 'room': '504', 'name': 'Козлов', 'contact': '', 'due': '+-5'}),
+        (5, {'mac': 'zz', 'room': '505', 'name': 'Смирнов', 'contact': '', 'due': ''}),
+    ]
+    plan = bulk.plan_issue(records, snapshot(), today=datetime(2026, 10, 1))
+
+    assert list(plan.updates) == [free_row]
+    assert plan.updates[free_row] == {3: '501', 4: 'Выдан', 6: 'Иванов', 7: '2026-10-01', 8: '2026-12-01', 9: '@ivan'}
+    assert [entry[2] for entry in plan.report] == [True, False, False, False, False]
+    assert plan.report[1][3] == "повторяется в файле (строка 1)"
+    assert plan.report[2][3] == "роутер не свободен (Выдан)"
+    assert plan.report[3][3].startswith("неверный формат даты")
+
+def test_plan_return_by_mac_and_room(sheet):
+    (first_row, first), (second_row, second) = rows_with_status(sheet, 'Выдан')[:2]
+    _, free = rows_with_status(sheet, 'Свободен')[0]
+    records = [
+        (1, {'mac': first[1], 'room': '', 'name': '', 'contact': '', 'due': ''}),
+        (2, {'mac': '', 'room': second[2], 'name': '', 'contact': '', 'due': ''}),
+        (3, {'mac': '', 'room': first[2], 'name': '', 'contact': '', 'due': ''}),
+        (4, {'mac': free[1], 'room': '', 'name': '', 'contact': '', 'due': ''}),
+    ]
+    plan = bulk.plan_return(records, snapshot())
+
+    assert sorted(plan.updates) == [first_row, second_row]
+    assert plan.updates[first_row][4] == 'Свободен' and plan.updates[first_row][6] == ''
+    assert [entry[3] for entry in plan.report[2:]] == ["повторяется в файле (строка 1)", "роутер уже свободен"]
+
+def test_plan_add_and_verify(sheet):
+    existing = sheet.rows[1][1]
+    records = [
+        (1, {'mac': 'FE:ED:00:00:00:01', 'room': '', 'name': '', 'contact': '', 'due': ''}),
+        (2, {'mac': 'fe-ed-00-00-00-01', 'room': '', 'name': '', 'contact': '', 'due': ''}),
+        (3, {'mac': existing, 'room': '', 'name': '', 'contact': '', 'due': ''}),
+        (4, {'mac': 'FE:ED:00:00:00:02', 'room': '', 'name': '', 'contact': '', 'due': ''}),
+    ]
+    plan = bulk.plan_add(records, snapshot())
+    assert plan.appends == ['FE:ED:00:00:00:01', 'FE:ED:00:00:00:02']
+    assert plan.report[2][3] == "уже есть в таблице (строка 2)"
+
+    # Пока файл проверялся, один из роутеров добавили командой /add
+    sheets_helper.append_router('FE:ED:00:00:00:02')
+    plan.verify(snapshot())
+    assert plan.appends == ['FE:ED:00:00:00:01']
+    assert plan.succeeded == 1
+    assert plan.report[3][3].startswith("уже есть в таблице")
+
+def test_verify_drops_changed_rows(sheet):
+    row_num, issued = rows_with_status(sheet, 'Выдан')[0]
+    plan = bulk.plan_return([(1, {'mac': issued[1], 'room': '', 'name': '', 'contact': '', 'due': ''})], snapshot())
+    sheet.edit(row_num, 10, 'правка')
+    assert sheets_helper.refresh_cache()
+    plan.verify(snapshot())
+    assert plan.updates == {} and plan.report[0][2] is False
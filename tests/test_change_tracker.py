@@ -0,0 +1,41 @@
+# tests/test_change_tracker.py
+from change_tracker import ChangeTracker
+from fake_sheets import make_inventory
+
+def sheet_rows(size=20):
+    return {row_num: row for row_num, row in enumerate(make_inventory(size, seed=1), start=1)}
+
+def test_first_load_replaces_everything():
+    tracker = ChangeTracker(block_size=5)
+    assert tracker.diff(sheet_rows(), '2026-01-01T00:00:00.000Z') == (None, None)
+    assert tracker.remote_version == '2026-01-01T00:00:00.000Z'
+
+def test_only_changed_block_returned():
+    tracker = ChangeTracker(block_size=5)
+    rows = sheet_rows()
+    tracker.diff(rows, 'v1')
+    rows[7] = [*rows[7][:9], 'правка']
+    ranges, changed = tracker.diff(rows, 'v2')
+    assert ranges == [(6, 10)]
+    assert sorted(changed) == [6, 7, 8, 9, 10]
+    assert changed[7][9] == 'правка'
+    assert tracker.diff(rows, 'v3') == ([], {})
+
+def test_deleted_rows_shift_blocks_and_removed_tail_reported():
+    tracker = ChangeTracker(block_size=5)
+    rows = sheet_rows()
+    tracker.diff(rows, 'v1')
+    # Строку 13 удалили вручную: последующие сдвинулись вверх, последней строки больше нет
+    shifted = {row_num: row for row_num, row in rows.items() if row_num < 13}
+    shifted.update({row_num - 1: row for row_num, row in rows.items() if row_num > 13})
+    ranges, changed = tracker.diff(shifted, 'v2')
+    assert ranges == [(11, 15), (16, 20), (21, 25)]
+    assert 21 not in changed and changed[13] == rows[14]
+
+def test_own_write_does_not_force_reload():
+    tracker = ChangeTracker(block_size=5)
+    tracker.diff(sheet_rows(), '2026-01-01T00:00:00.000Z')
+    started = tracker.now()
+    tracker.note_write(started)
+    assert tracker.can_skip(started.isoformat().replace('+00:00', 'Z'))
+    assert not tracker.can_skip('2020-01-01T00:00:00.000Z')
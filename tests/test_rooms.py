@@ -0,0 +1,40 @@
+# tests/test_rooms.py
+import asyncio
+
+import pytest
+
+import handlers
+from fake_sheets import FakeWorksheet, make_inventory
+from shards import load_shards
+from sheets import AsyncSheetsHelper, GoogleSheetsHelper
+
+@pytest.fixture
+def dorms():
+    """Два общежития с корпусами С и Ю; комната 101 есть в обоих, 102 - только в первом"""
+    north, south = make_inventory(3, issued_share=1, seed=1), make_inventory(3, issued_share=0, seed=2)
+    for row in south[1:]:
+        row[1] = 'BB' + row[1][2:]
+    south[1][2] = '101'
+    helper = GoogleSheetsHelper(':memory:', load_shards({'Север': {'room_prefix': 'С'}, 'Юг': {'room_prefix': 'Ю'}}))
+    helper.attach_worksheet(FakeWorksheet(north), 'Север')
+    helper.attach_worksheet(FakeWorksheet(south), 'Юг')
+    assert helper.refresh_cache()
+    return helper
+
+def test_room_in_several_dorms(dorms):
+    assert [shard.name for shard in dorms.find_room_shards('101')] == ['Север', 'Юг']
+    assert dorms.find_row_by_room('101') == (None, None)
+    assert [shard.name for shard in dorms.find_room_shards('Ю-101')] == ['Юг']
+    assert dorms.find_row_by_room('Ю-101')[0] == dorms.shards['Юг'].key(2)
+
+def test_ambiguous_room_asks_for_prefix(dorms, monkeypatch):
+    async_dorms = AsyncSheetsHelper(dorms)
+    monkeypatch.setattr(handlers, 'sheets_helper', dorms)
+    monkeypatch.setattr(handlers, 'async_sheets', async_dorms)
+    try:
+        text = asyncio.run(handlers.not_found_text('101', retry=True))
+        assert text.startswith("Комната 101 есть в нескольких общежитиях: Север, Юг. Укажите корпус: С-101 или Ю-101.")
+        assert text.endswith("Попробуйте еще раз или /cancel.")
+        assert asyncio.run(handlers.not_found_text('999')) == "Роутер не найден."
+    finally:
+        async_dorms.shutdown()
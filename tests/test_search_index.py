@@ -0,0 +1,51 @@
+# tests/test_search_index.py
+from fake_sheets import make_inventory
+from local_store import LocalStore
+from records import ColumnMap
+from search_index import SearchIndex
+from sheets import normalize_mac
+
+def make_index(size=30):
+    rows = {row_num: row for row_num, row in enumerate(make_inventory(size, seed=1), start=1)}
+    store = LocalStore(normalize_mac, ':memory:')
+    store.replace_all(rows, ColumnMap.from_header(rows[1]))
+    index = SearchIndex(store)
+    index.refresh()
+    return store, index, rows
+
+def apply_ranges(store, index, ranges, changed, last_row):
+    version_before = store.version
+    store.replace_ranges(ranges, changed, last_row)
+    index.apply(version_before, store.version, changed, ranges, last_row)
+
+def rebuilt(store):
+    index = SearchIndex(store)
+    index.refresh()
+    return index
+
+def test_apply_matches_full_rebuild():
+    store, index, rows = make_index()
+    owner = next(row_num for row_num, row in rows.items() if row_num > 1 and row[5])
+    # Владельца сменили, а последнюю строку удалили
+    changed = {row_num: list(row) for row_num, row in rows.items() if 1 <= row_num <= 10}
+    changed[owner][5] = 'Новиков Олег'
+    apply_ranges(store, index, [(1, 10), (21, 31)], changed, 30)
+
+    assert index._version == store.version
+    full = rebuilt(store)
+    for query in ('новиков', rows[owner][5].split()[0], rows[31][1], rows[5][1][-5:], '101'):
+        assert index.search(query) == full.search(query), query
+    assert index.search('новиков') == [(owner, changed[owner])]
+    assert index.search(rows[31][1]) == []
+
+def test_apply_skipped_when_index_is_behind():
+    store, index, rows = make_index()
+    store.upsert_rows({15: [*rows[15][:5], 'Пропущенный Апдейт', *rows[15][6:]]})
+    changed = {row_num: row for row_num, row in rows.items() if row_num <= 10}
+    changed[3] = [*rows[3][:5], 'Соколов Петр', *rows[3][6:]]
+    apply_ranges(store, index, [(1, 10)], changed, 31)
+
+    # Прошлое изменение индекс не видел - точечно обновлять нельзя, он перестроится при поиске
+    assert index._version != store.version
+    assert [row_num for row_num, _ in index.search('пропущенный')] == [15]
+    assert [row_num for row_num, _ in index.search('соколов')] == [3]
@@ -0,0 +1,29 @@
+# tests/test_sweep.py
+import asyncio
+
+import handlers
+from records import Status
+from write_queue import write_queue
+
+def make_overdue(sheet, *row_nums):
+    for row_num in row_nums:
+        sheet.edit(row_num, 4, 'Выдан')
+        sheet.edit(row_num, 8, '2000-01-01')
+
+def test_sweep_marks_overdue_through_queue(sheet):
+    make_overdue(sheet, 2, 3)
+    counts = asyncio.run(handlers.sweep_overdue())
+    # Пометки ждут в очереди вместе с MAC строк и попадают в лист одной записью
+    assert counts == {'': len(write_queue._pending)}
+    assert write_queue._macs[2] == sheet.rows[1][1]
+    sheet.reset_stats()
+    asyncio.run(write_queue.flush())
+    assert sheet.rows[1][3] == sheet.rows[2][3] == 'Просрочен'
+    assert sheet.calls['batch_update'] == 1
+
+def test_sweep_skips_router_returned_in_queue(sheet):
+    make_overdue(sheet, 2)
+    # Возврат уже подтвержден, но еще не записан в таблицу
+    write_queue.enqueue(2, {4: Status.FREE.value, 8: ''}, mac=sheet.rows[1][1])
+    asyncio.run(handlers.sweep_overdue())
+    assert write_queue._pending[2] == {4: Status.FREE.value, 8: ''}
@@ -0,0 +1,35 @@
+# tests/test_update_processor.py
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+def make_update(update_id, user_id):
+    message = Message(
+        update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=User(user_id, 'Test', False), text='x'
+    )
+    return Update(update_id, message=message)
+
+def test_updates_of_one_user_run_in_order_and_other_users_in_parallel():
+    processor = PerUserUpdateProcessor(4)
+    events = []
+
+    async def handle(name, delay):
+        events.append(f'{name} start')
+        await asyncio.sleep(delay)
+        events.append(f'{name} end')
+
+    async def main():
+        await asyncio.gather(
+            processor.process_update(make_update(1, 1), handle('a1', 0.02)),
+            processor.process_update(make_update(2, 1), handle('a2', 0)),
+            processor.process_update(make_update(3, 2), handle('b1', 0)),
+        )
+
+    asyncio.run(main())
+    # Второй апдейт пользователя ждет первый, апдейт другого пользователя - нет
+    assert events.index('a2 start') > events.index('a1 end')
+    assert events.index('b1 end') < events.index('a1 end')
+    assert processor._user_locks == {}
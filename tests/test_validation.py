@@ -0,0 +1,32 @@
+# tests/test_validation.py
+from datetime import datetime
+
+from validation import DATE_ARG_RE, command_args, parse_date
+
+def test_command_args_keeps_quoted_phrase():
+    assert command_args('/issue AA:BB:CC:DD:EE:FF 101 "Иванов Иван" @ivan') == [
+        'AA:BB:CC:DD:EE:FF', '101', 'Иванов Иван', '@ivan'
+    ]
+    assert command_args('/change_owner 101 «Петров Петр» @petr') == ['101', 'Петров Петр', '@petr']
+
+def test_command_args_apostrophe_is_plain_character():
+    assert command_args('/change_owner 101 "Шон О\'Брайен" @shon') == ['101', "Шон О'Брайен", '@shon']
+    assert command_args("/change_owner 101 О'Брайен @shon") == ['101', "О'Брайен", '@shon']
+
+def test_command_args_unclosed_quote():
+    assert command_args('/change_owner 101 "Петров Петр @petr') is None
+    assert command_args('/return') == []
+
+def test_parse_date_offsets():
+    assert (parse_date('+14').date() - datetime.now().date()).days == 14
+    assert parse_date('+14d') and parse_date('+14д')
+    assert parse_date('2026-01-31') == datetime(2026, 1, 31)
+    assert parse_date('+-30') is None
+    assert parse_date('+0') is None
+    assert parse_date('31.01.2026') is None
+
+def test_date_like_arguments_are_not_contacts():
+    for token in ('+14', '+14d', '+-5', '++5', '+-5d', '2026-01-31', '31.01.2026'):
+        assert DATE_ARG_RE.match(token), token
+    for token in ('+79991234567', '+7-999-123-45-67', '@ivan', 'ivan@mail.ru'):
+        assert not DATE_ARG_RE.match(token), token
@@ -0,0 +1,63 @@
+# tests/test_write_queue.py
+import asyncio
+
+from sheets import sheets_helper
+from write_queue import write_queue
+
+class Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append(text)
+
+def test_write_follows_router_after_row_deleted_by_hand(sheet):
+    mac = sheet.rows[4][1]
+    # Оператор подтвердил продление по старому номеру строки, а строку выше уже удалили
+    sheet.delete_row(3)
+    write_queue.enqueue(5, {8: '2026-11-16'}, chat_id=1, description='продление', mac=mac)
+    bot = Bot()
+    asyncio.run(write_queue.flush(bot))
+
+    moved = next(row for row in sheet.rows if row[1] == mac)
+    assert moved[7] == '2026-11-16'
+    # Роутер, оказавшийся в строке 5, не тронут
+    assert sheet.rows[4][1] != mac and sheet.rows[4][7] != '2026-11-16'
+    assert bot.sent == ['✅ Записано в таблицу: продление.']
+
+def test_write_dropped_when_router_removed(sheet):
+    mac = sheet.rows[4][1]
+    sheet.delete_row(5)
+    write_queue.enqueue(5, {8: '2026-11-16'}, chat_id=1, description='продление', mac=mac)
+    bot = Bot()
+    asyncio.run(write_queue.flush(bot))
+
+    assert all(row[7] != '2026-11-16' for row in sheet.rows)
+    assert bot.sent[0].startswith('❌')
+    assert sheets_helper.store.get_row(5)[7] != '2026-11-16'
+
+def test_updates_of_one_row_merge(sheet):
+    mac = sheet.rows[2][1]
+    write_queue.enqueue(3, {8: '2026-01-01', 10: 'a'}, mac=mac)
+    write_queue.enqueue(3, {8: '2026-02-02'}, mac=mac)
+    sheet.reset_stats()
+    asyncio.run(write_queue.flush())
+
+    assert sheet.rows[2][7] == '2026-02-02' and sheet.rows[2][9] == 'a'
+    assert sheet.calls['batch_update'] == 1
+
+def test_check_rows_follows_swapped_routers(sheet):
+    first, second = list(sheet.rows[4]), list(sheet.rows[5])
+    write_queue.enqueue(5, {10: 'первый'}, chat_id=1, description='первый', mac=first[1])
+    write_queue.enqueue(6, {10: 'второй'}, chat_id=1, description='второй', mac=second[1])
+    # Лист отсортировали вручную: роутеры поменялись строками
+    sheet.edit(5, 2, second[1])
+    sheet.edit(6, 2, first[1])
+    sheets_helper.refresh_cache()
+
+    batch, notifications = dict(write_queue._pending), list(write_queue._notifications)
+    rejected, mismatched = write_queue._check_rows(batch, notifications)
+    assert (rejected, mismatched) == ([], 2)
+    assert batch == {6: {10: 'первый'}, 5: {10: 'второй'}}
+    assert write_queue._macs == {6: first[1], 5: second[1]}
+    assert [(note['description'], note['row_num']) for note in notifications] == [('первый', 6), ('второй', 5)]
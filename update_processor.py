@@ -0,0 +1,49 @@
+# update_processor.py
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает апдейты разных пользователей параллельно, а апдейты одного пользователя - по очереди.
+
+    ConversationHandler рассчитан на последовательную обработку, поэтому сообщения
+    одного оператора не должны обгонять друг друга.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        # ключ пользователя -> [замок, число ожидающих апдейтов]
+        self._user_locks = {}
+
+    @staticmethod
+    def _user_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        """Ждет предыдущие апдейты того же пользователя; общее число параллельных апдейтов ограничивает базовый класс"""
+        key = self._user_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._user_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,43 @@
+# validation.py
+import re
+from datetime import datetime, timedelta
+
+MAC_RE = re.compile(r"^([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})$")
+# Аргумент команды, похожий на срок: +14, +14d, +-5, 2025-01-31 или 31.01.2025 (но не телефон +7999...).
+# Срок проверяется parse_date: похожий на срок, но неверный аргумент - ошибка, а не контакт
+DATE_ARG_RE = re.compile(r"^\+[-+]?\d{1,4}[dDдД]?$|^\+\d+[dDдД]$|^\d{1,4}[-./]\d{1,2}[-./]\d{1,4}$")
+SMART_QUOTES = str.maketrans({'«': '"', '»': '"', '“': '"', '”': '"', '„': '"'})
+# Аргумент: фраза в двойных кавычках или слово без пробелов и кавычек
+ARG_RE = re.compile(r'"([^"]*)"|[^\s"]+')
+
+def is_mac_address(text):
+    """Проверяет, похож ли текст на MAC-адрес"""
+    return MAC_RE.match(text) is not None
+
+def parse_date(date_str):
+    """Парсит строку даты в формате +Nd или YYYY-MM-DD"""
+    date_str = date_str.strip()
+    if date_str.startswith('+'):
+        try:
+            # Суффикс дней необязателен: +14, +14d и +14д означают одно и то же
+            days = int(date_str[1:].rstrip('dDдД'))
+            # Срок только вперед: +0 и +-5 - ошибка
+            if days <= 0:
+                return None
+            return datetime.now() + timedelta(days=days)
+        except (ValueError, OverflowError):
+            return None
+    else:
+        try:
+            return datetime.strptime(date_str, '%Y-%m-%d')
+        except ValueError:
+            return None
+
+def command_args(text):
+    """Аргументы команды из текста сообщения; фразы в кавычках - один аргумент. None, если кавычки не закрыты"""
+    # Телефоны часто подставляют вместо прямых кавычек «елочки» и “лапки”
+    text = text.translate(SMART_QUOTES)
+    # Особые только двойные кавычки: апостроф в фамилии (О'Брайен) и обратная косая черта - обычные символы
+    if text.count('"') % 2:
+        return None
+    return [match[1] if match[1] is not None else match[0] for match in ARG_RE.finditer(text)][1:]
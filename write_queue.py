@@ -0,0 +1,243 @@
+# write_queue.py
+import asyncio
+import json
+import logging
+import os
+import random
+
+import config
+from metrics import current_handler
+from ratelimit import TokenBucket
+from sheets import sheets_helper, async_sheets, is_retryable, normalize_mac
+
+logger = logging.getLogger(__name__)
+
+# Файл, в котором очередь переживает перезапуск бота
+QUEUE_FILE = getattr(config, 'WRITE_QUEUE_FILE', 'write_queue.json')
+# Квота Sheets - 60 запросов на запись в минуту на пользователя; держимся ниже
+WRITE_RATE = getattr(config, 'SHEETS_WRITE_RATE', 0.8)
+WRITE_BURST = getattr(config, 'SHEETS_WRITE_BURST', 5)
+# Пауза перед сбросом, чтобы успели склеиться соседние записи
+FLUSH_DELAY = getattr(config, 'WRITE_QUEUE_FLUSH_DELAY', 0.5)
+MAX_BACKOFF = getattr(config, 'WRITE_QUEUE_MAX_BACKOFF', 300)
+
+class WriteBehindQueue:
+    """Очередь отложенной записи в таблицу: склеивает изменения одной строки, пишет пачками и повторяет при ошибках"""
+
+    def __init__(self, helper, path=QUEUE_FILE):
+        self.helper = helper
+        self.path = path
+        # {строка: {колонка: значение}} - уже склеенные изменения
+        self._pending = {}
+        # {строка: MAC} - какой роутер был в строке, когда в нее поставили запись
+        self._macs = {}
+        # [{'chat_id': ..., 'description': ..., 'row_num': ...}] - кому сообщить, когда запись дойдет до таблицы
+        self._notifications = []
+        self.bucket = TokenBucket(WRITE_RATE, WRITE_BURST)
+        self._wakeup = asyncio.Event()
+        self._load()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _load(self):
+        """Восстанавливает очередь после перезапуска"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать очередь записи {self.path}: {e}")
+            return
+
+        for row_num, col_num, value in state.get('cells', []):
+            self._pending.setdefault(row_num, {})[col_num] = value
+        self._macs = {row_num: mac for row_num, mac in state.get('macs', [])}
+        self._notifications = state.get('notifications', [])
+        if self._pending:
+            logger.info(f"Восстановлено строк в очереди записи: {len(self._pending)}")
+            self.helper.stage_writes(self._pending)
+            self._wakeup.set()
+
+    def _save(self):
+        """Атомарно сохраняет очередь на диск"""
+        if not self.path:
+            return
+        state = {
+            'cells': [
+                [row_num, col_num, value]
+                for row_num, fields in self._pending.items()
+                for col_num, value in fields.items()
+            ],
+            'macs': [[row_num, mac] for row_num, mac in self._macs.items()],
+            'notifications': self._notifications,
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить очередь записи {self.path}: {e}")
+
+    def enqueue(self, row_num, fields, chat_id=None, description=None, mac=None):
+        """Ставит изменения строки в очередь; новые значения перекрывают еще не записанные.
+
+        mac - роутер в строке: перед записью строка сверяется с ним, чтобы запись
+        не попала на другой роутер, если строки в листе переставили.
+        """
+        self.enqueue_many({row_num: fields}, chat_id, description, {row_num: mac} if mac else None)
+
+    def enqueue_many(self, updates, chat_id=None, description=None, macs=None):
+        """Ставит в очередь изменения нескольких строк ({строка: {колонка: значение}}) с одним уведомлением"""
+        for row_num, fields in updates.items():
+            self._pending.setdefault(row_num, {}).update(fields)
+        self._macs.update(macs or {})
+        if chat_id is not None and description:
+            # Уведомление об одной строке снимается вместе с ней, если роутер в строке сменился
+            row_num = next(iter(updates)) if len(updates) == 1 else None
+            self._notifications.append({'chat_id': chat_id, 'description': description, 'row_num': row_num})
+        self._save()
+        self.helper.stage_writes(updates)
+        self._wakeup.set()
+
+    def _requeue(self, batch, notifications):
+        """Возвращает неудавшуюся пачку в очередь под более новыми изменениями"""
+        for row_num, fields in batch.items():
+            self._pending[row_num] = {**fields, **self._pending.get(row_num, {})}
+        self._notifications = notifications + self._notifications
+        self._save()
+
+    def _check_rows(self, batch, notifications):
+        """Сверяет роутеры в строках пачки с локальной копией листа.
+
+        Если роутер переместился (строки вставили, удалили или отсортировали вручную),
+        запись переносится в его новую строку; если его в листе больше нет - снимается.
+        Возвращает уведомления о снятых записях и число строк, в которых роутер не совпал.
+        """
+        # Сначала снимаем все несовпавшие строки, потом переносим: роутеры могли поменяться строками местами
+        moved = []
+        for row_num in list(batch):
+            mac = self._macs.get(row_num)
+            if not mac:
+                continue
+            record = self.helper.record(row_num, self.helper.store.get_row(row_num))
+            if record is not None and record.mac and normalize_mac(record.mac) == normalize_mac(mac):
+                continue
+
+            fields = batch.pop(row_num)
+            del self._macs[row_num]
+            self.helper.unstage_writes({row_num: fields})
+            notes = [note for note in notifications if note.get('row_num') == row_num]
+            moved.append((row_num, mac, fields, notes))
+
+        rejected = []
+        for row_num, mac, fields, notes in moved:
+            new_row, _ = self.helper.store.find_by_mac(mac)
+            if new_row is None:
+                logger.error(f"Роутера {mac} больше нет в строке {row_num} и в листе, запись снята: {fields}")
+                rejected.extend(notes)
+                continue
+
+            logger.warning(f"Роутер {mac} переместился из строки {row_num} в {new_row}, запись перенесена")
+            batch[new_row] = {**batch.get(new_row, {}), **fields}
+            self._macs[new_row] = mac
+            self.helper.stage_writes({new_row: fields})
+            for note in notes:
+                note['row_num'] = new_row
+        for note in rejected:
+            notifications.remove(note)
+        return rejected, len(moved)
+
+    def _forget_macs(self, batch):
+        """Строки пачки больше не ждут записи (если в них не поставили новые изменения)"""
+        for row_num in batch:
+            if row_num not in self._pending:
+                self._macs.pop(row_num, None)
+
+    async def _notify(self, bot, notifications, template):
+        if bot is None:
+            return
+        for note in notifications:
+            try:
+                await bot.send_message(chat_id=note['chat_id'], text=template.format(note['description']))
+            except Exception as e:
+                logger.error(f"Не удалось отправить уведомление о записи: {e}")
+
+    async def flush(self, bot=None):
+        """Записывает все накопленное, повторяя с экспоненциальной задержкой при временных ошибках"""
+        attempt = 0
+        while self._pending:
+            await self.bucket.acquire()
+            # Сверка строк идет по локальной копии - сначала перечитываем листы затронутых общежитий,
+            # чтобы она видела правки вручную. Если лист не менялся, это одна проверка времени изменения файла
+            dorms = {self.helper.shard_of(row_num).name for row_num in self._pending}
+            await async_sheets.refresh_cache(names=dorms)
+            batch, self._pending = self._pending, {}
+            notifications, self._notifications = self._notifications, []
+            rejected, mismatched = self._check_rows(batch, notifications)
+            if not batch:
+                self._save()
+                # Снятые записи были наложены на локальную копию - перечитываем лист
+                await async_sheets.refresh_cache(force=True, names=dorms)
+                await self._notify(bot, rejected, "❌ Не записано: в строке теперь другой роутер ({}).")
+                continue
+
+            try:
+                await self._notify(bot, rejected, "❌ Не записано: в строке теперь другой роутер ({}).")
+                if mismatched:
+                    # Записи из очереди были наложены на локальную копию по старым номерам строк - перечитываем лист
+                    await async_sheets.refresh_cache(force=True, names=dorms)
+                written = await async_sheets.run(
+                    self.helper.write_rows_fields, batch, default=False, shard=async_sheets.shard_for_rows(batch)
+                )
+                error = None if written else TimeoutError("таймаут записи")
+            except asyncio.CancelledError:
+                self._requeue(batch, notifications)
+                raise
+            except Exception as e:
+                error = e
+
+            if error is None:
+                attempt = 0
+                self._forget_macs(batch)
+                self._save()
+                self.helper.unstage_writes(batch)
+                logger.info(f"Записано строк из очереди: {len(batch)}")
+                await self._notify(bot, notifications, "✅ Записано в таблицу: {}.")
+                continue
+
+            if not is_retryable(error):
+                logger.error(f"Запись отклонена таблицей, изменения отброшены: {error}")
+                self._forget_macs(batch)
+                self._save()
+                self.helper.unstage_writes(batch)
+                # Локальная база могла разойтись с таблицей - перечитываем лист
+                await async_sheets.refresh_cache(force=True)
+                await self._notify(bot, notifications, "❌ Не удалось записать в таблицу: {}.")
+                continue
+
+            self._requeue(batch, notifications)
+            delay = min(MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1.0)
+            attempt += 1
+            logger.warning(f"Ошибка записи в таблицу ({error}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+    async def run(self, bot=None):
+        """Фоновая задача: ждет новых записей и сбрасывает их в таблицу"""
+        current_handler.set('write_queue')
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(FLUSH_DELAY)
+            try:
+                await self.flush(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в очереди записи: {e}")
+                self._wakeup.set()
+
+# Глобальный экземпляр для использования в других модулях
+write_queue = WriteBehindQueue(sheets_helper)